@@ -1,34 +1,289 @@
 #!/usr/bin/env python3
 
+import argparse
 import json
+import os
+import re
 import sys
+from collections import Counter
+from multiprocessing import Pool
+from typing import Callable, Iterator, List, Optional, Tuple
 
-# Return whether SARIF file contains error-level results
-def codeql_sarif_contain_error(filename: str) -> bool:
-    with open(filename, 'r') as f:
-        s = json.load(f)
-
-    for run in s.get('runs', []):
-        rules_metadata = run['tool']['driver']['rules']
-        if not rules_metadata:
-            rules_metadata = run['tool']['extensions'][0]['rules']
-
-        for res in run.get('results', []):
-            if 'ruleIndex' in res:
-                rule_index = res['ruleIndex']
-            elif 'rule' in res and 'index' in res['rule']:
-                rule_index = res['rule']['index']
-            else:
-                continue
+# How much of a SARIF file is read at once
+CHUNK_SIZE = 1 << 20
+
+WHITESPACE_RE = re.compile(r'[ \t\n\r]*')
+
+ANY = object()
+
+# The parts of a SARIF file that are decoded; everything else is skipped
+DRIVER_RULE_PATH = ('runs', ANY, 'tool', 'driver', 'rules', ANY)
+EXTENSION_RULE_PATH = ('runs', ANY, 'tool', 'extensions', ANY, 'rules', ANY)
+RESULT_PATH = ('runs', ANY, 'results', ANY)
+DECODED_PATHS = [DRIVER_RULE_PATH, EXTENSION_RULE_PATH, RESULT_PATH]
+
+Path = Tuple
+Event = Tuple[str, Path, object]
+
+
+def path_matches(path: Path, pattern: Path) -> bool:
+    return len(path) == len(pattern) and all(p is ANY or p == e for e, p in zip(path, pattern))
+
+
+# A JSON document read incrementally from a file: values are decoded one at
+# a time, with the C decoder, and only the unread rest of the file is kept
+class JsonStream:
+    def __init__(self, f, chunk_size: int = CHUNK_SIZE):
+        self.f = f
+        self.name = getattr(f, 'name', '<stream>')
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    # Read more of the file, at least as much as is buffered, so that a long
+    # value is decoded a few times rather than once per chunk
+    def _read(self) -> bool:
+        data = self.f.read(max(self.chunk_size, len(self.buf) - self.pos))
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            self.pos = WHITESPACE_RE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._read():
+                return ''
+
+    def take(self) -> str:
+        ch = self.peek()
+        if ch == '':
+            raise self.error('unexpected end of file')
+        self.pos += 1
+        return ch
+
+    def value(self) -> object:
+        self.peek()
+        while True:
             try:
-                rule_level = rules_metadata[rule_index]['defaultConfiguration']['level']
-            except IndexError as e:
-                print(e, rule_index, len(rules_metadata))
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError as e:
+                if self._read():
+                    continue
+                raise self.error(str(e)) from e
+            # a number may go on in the next chunk
+            if end == len(self.buf) and not self.eof and self._read():
+                continue
+            self.pos = end
+            return value
+
+    def error(self, message: str) -> ValueError:
+        return ValueError('{}: {}'.format(self.name, message))
+
+
+# Walk a JSON document, yielding ('value', path, value) for the values that
+# `decode` selects by their path, and ('start', path) and ('end', path) for
+# the objects and arrays that are walked into. Other values are skipped.
+# Raises ValueError, naming the file, on invalid JSON, including a file that
+# is empty or ends early.
+def json_events(stream: JsonStream, decode: Callable[[Path], bool], path: Path = ()) -> Iterator[Event]:
+    ch = stream.peek()
+    if ch == '':
+        raise stream.error('unexpected end of file at {!r}'.format(path))
+    if decode(path):
+        yield ('value', path, stream.value())
+        return
+    if ch not in '{[':
+        stream.value()
+        return
+
+    yield ('start', path, None)
+    stream.take()
+    close = '}' if ch == '{' else ']'
+    if stream.peek() == close:
+        stream.take()
+    elif ch == '[' and decode(path + (0,)):
+        # an array of decoded values, such as results: decode them in a loop
+        index = 0
+        while True:
+            yield ('value', path + (index,), stream.value())
+            index += 1
+            sep = stream.take()
+            if sep == close:
+                break
+            if sep != ',':
+                raise stream.error('expected , or ] at {!r}'.format(path + (index,)))
+    else:
+        index = 0
+        while True:
+            if ch == '{':
+                key = stream.value()
+                if stream.take() != ':':
+                    raise stream.error('expected : after key {!r}'.format(key))
             else:
-                if rule_level == 'error':
+                key = index
+                index += 1
+            yield from json_events(stream, decode, path + (key,))
+            sep = stream.take()
+            if sep == close:
+                break
+            if sep != ',':
+                raise stream.error('expected , or {} at {!r}'.format(close, path + (key,)))
+    yield ('end', path, None)
+
+
+def decode_sarif_path(path: Path) -> bool:
+    return any(path_matches(path, pattern) for pattern in DECODED_PATHS)
+
+
+# The rule index of a result, or None
+def result_rule_index(res: dict) -> Optional[int]:
+    if 'ruleIndex' in res:
+        return res['ruleIndex']
+    if 'rule' in res and 'index' in res['rule']:
+        return res['rule']['index']
+    return None
+
+
+# The rules of a run, and the results seen before its rules were known
+class RunRules:
+    def __init__(self):
+        self.driver: List[dict] = []
+        self.extension: List[dict] = []
+        self.driver_done = False
+        self.extension_done = False
+        self.pending: List[int] = []
+
+    # The rules results refer to: those of the driver, or if there are none,
+    # those of the first extension. None while that is not known yet.
+    def rules(self, run_done: bool = False) -> Optional[List[dict]]:
+        if self.driver_done and self.driver:
+            return self.driver
+        if run_done or (self.driver_done and self.extension_done):
+            return self.driver or self.extension
+        return None
+
+    def level(self, rule_index: int, run_done: bool = False) -> Optional[str]:
+        rules = self.rules(run_done)
+        try:
+            return rules[rule_index]['defaultConfiguration']['level']
+        except IndexError as e:
+            print(e, rule_index, len(rules))
+        except (KeyError, TypeError):
+            pass
+        return None
+
+    def rule_id(self, rule_index: int) -> str:
+        rules = self.rules(True)
+        try:
+            return rules[rule_index].get('id', str(rule_index))
+        except (IndexError, AttributeError):
+            return str(rule_index)
+
+
+# Scan a SARIF file for results whose rule has the error level. Without
+# `counts`, the scan stops at the first error. With it, all the results are
+# counted per (rule, level), and the scan goes to the end.
+def scan_sarif(filename: str, counts: Optional[Counter] = None) -> bool:
+    found_error = False
+    run = None
+
+    def account(rule_index: int, run_done: bool = False) -> bool:
+        level = run.level(rule_index, run_done)
+        if counts is not None:
+            counts[(run.rule_id(rule_index), level or 'none')] += 1
+        return level == 'error'
+
+    with open(filename, 'r') as f:
+        for event, path, value in json_events(JsonStream(f), decode_sarif_path):
+            if len(path) == 2 and path[0] == 'runs':
+                # a run starts or ends
+                if event == 'start':
+                    run = RunRules()
+                    continue
+                for rule_index in run.pending:
+                    found_error |= account(rule_index, True)
+                if found_error and counts is None:
                     return True
-    return False
+                run = None
+            elif run is None:
+                continue
+            elif event == 'value' and path[2] == 'results':
+                rule_index = result_rule_index(value)
+                if rule_index is None:
+                    if counts is not None:
+                        counts[('(no rule)', value.get('level', 'none'))] += 1
+                elif run.rules() is None:
+                    run.pending.append(rule_index)
+                else:
+                    found_error |= account(rule_index)
+                    if found_error and counts is None:
+                        return True
+            elif event == 'value' and path[3] == 'driver':
+                run.driver.append(value)
+            elif event == 'value' and path[4] == 0:
+                run.extension.append(value)
+            elif event == 'end' and path[2:] == ('tool', 'driver', 'rules'):
+                run.driver_done = True
+            elif event == 'end' and path[2:] in [('tool', 'extensions', 0, 'rules'), ('tool', 'extensions')]:
+                run.extension_done = True
+            elif event == 'end' and path[2:] == ('tool',):
+                run.driver_done = run.extension_done = True
+                # the results seen before the tool
+                pending, run.pending = run.pending, []
+                for rule_index in pending:
+                    found_error |= account(rule_index, True)
+                if found_error and counts is None:
+                    return True
+    return found_error
+
+
+# Return whether SARIF file contains error-level results
+def codeql_sarif_contain_error(filename: str) -> bool:
+    return scan_sarif(filename)
+
+
+def summarize_sarif(filename: str) -> Tuple[bool, Counter]:
+    counts = Counter()
+    return scan_sarif(filename, counts), counts
+
+
+def print_summary(counts: Counter) -> None:
+    order = {'error': 0, 'warning': 1, 'note': 2}
+    for (rule, level), count in sorted(counts.items(), key=lambda item: (order.get(item[0][1], 3), -item[1], item[0][0])):
+        print('{:8} {:8} {}'.format(count, level, rule))
+    print('{:8} results'.format(sum(counts.values())))
+
 
 if __name__ == "__main__":
-    if codeql_sarif_contain_error(sys.argv[1]):
+    parser = argparse.ArgumentParser(description='Fail if SARIF files contain error-level results.')
+    parser.add_argument('files', nargs='+', metavar='SARIF')
+    parser.add_argument('--summary', action='store_true',
+                        help='count the results per rule and level, instead of stopping at the first error')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='the number of files scanned at once (default: the number of CPUs)')
+    args = parser.parse_args()
+
+    jobs = min(args.jobs or os.cpu_count() or 1, len(args.files))
+    error = False
+    if args.summary:
+        total = Counter()
+        with Pool(jobs) as pool:
+            for file_error, counts in pool.imap_unordered(summarize_sarif, args.files):
+                error |= file_error
+                total.update(counts)
+        print_summary(total)
+    elif jobs == 1:
+        error = any(codeql_sarif_contain_error(filename) for filename in args.files)
+    else:
+        with Pool(jobs) as pool:
+            # leaving the pool terminates the scans still running
+            error = any(pool.imap_unordered(codeql_sarif_contain_error, args.files))
+    if error:
         sys.exit(1)
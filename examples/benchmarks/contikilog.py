@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+
+# Shared ingestion of Contiki-NG logs for the benchmark scripts.
+#
+# Reads the three log formats the scripts are fed with, plain or compressed,
+# and tokenizes their lines into (time, node, level, module, message) events.
+# Scripts that only need a few kinds of lines can instead compile their own
+# message pattern after the common line header, with compile_line_pattern(),
+# and match raw lines directly.
+
+import os
+import re
+import sys
+import gzip
+import lzma
+from itertools import chain
+from typing import NamedTuple
+
+###########################################
+
+# supported log formats
+LOG_FORMAT_COOJA = "cooja"      # coojalogger.js: "<time us> <node> <message>"
+LOG_FORMAT_TESTBED = "testbed"  # FIT IoT-Lab serial_aggregator: "<unix time>;<device>;<message>"
+LOG_FORMAT_TABBED = "tabbed"    # Cooja log export, as read by parse.py: "<time s>\tID:<node>\t<message>"
+
+LOG_FORMATS = [LOG_FORMAT_COOJA, LOG_FORMAT_TESTBED, LOG_FORMAT_TABBED]
+
+# how much of the log is inspected to detect its format
+LOG_FORMAT_SNIFF_BYTES = 64 * 1024
+
+# how much of the log is read at once
+READ_CHUNK_BYTES = 1 << 20
+
+# bytes dropped from the log when only printable lines are wanted: everything
+# but printable ASCII, tab and newline
+NON_PRINTABLE_BYTES = bytes([b for b in range(256) if not (0x20 <= b < 0x7f or b in b"\t\n")])
+
+# magic numbers of the compressed log formats read directly
+GZIP_MAGIC = b"\x1f\x8b"
+XZ_MAGIC = b"\xfd7zXZ\x00"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+###########################################
+# Detect the format of a log
+
+COOJA_LINE_RE = re.compile(rb"^\d+ \d+ ")
+TESTBED_LINE_RE = re.compile(rb"^\d+(\.\d*)?;[^;]+;")
+TABBED_LINE_RE = re.compile(rb"^\s*[.\d]+\tID:\d+\t")
+
+# Detect the format from the complete lines of a part of the log. Returns
+# None if none of them is in a known format.
+def detect_log_format(data):
+    for line in data.split(b"\n")[:-1]:
+        if b"Starting COOJA logger" in line or COOJA_LINE_RE.match(line):
+            return LOG_FORMAT_COOJA
+        if TABBED_LINE_RE.match(line):
+            return LOG_FORMAT_TABBED
+        if TESTBED_LINE_RE.match(line):
+            return LOG_FORMAT_TESTBED
+    return None
+
+###########################################
+# Read a log
+
+# Open a log file for binary reading, decompressing it on the fly if needed
+def open_log(filename):
+    with open(filename, "rb") as f:
+        magic = f.read(6)
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.open(filename, "rb")
+    if magic.startswith(XZ_MAGIC):
+        return lzma.open(filename, "rb")
+    if magic.startswith(ZSTD_MAGIC):
+        try:
+            import zstandard
+        except ImportError:
+            sys.exit("Reading {} requires the zstandard module".format(filename))
+        return zstandard.open(filename, "rb")
+    return open(filename, "rb")
+
+# Detect the format of a log from its first line in a known format, reading
+# past the first chunk if needed. Raises ValueError if there is no such line.
+def scan_log_format(filename, first_chunk):
+    log_format = detect_log_format(first_chunk[:LOG_FORMAT_SNIFF_BYTES])
+    if log_format is not None:
+        return log_format
+    # the lines past the sniffed prefix are rarely needed: read them again
+    with open_log(filename) as f:
+        data = b""
+        while True:
+            chunk = f.read(READ_CHUNK_BYTES)
+            data += chunk if chunk else b"\n"
+            log_format = detect_log_format(data)
+            if log_format is not None:
+                return log_format
+            if not chunk:
+                raise ValueError("{}: no line in a known log format ({})".format(
+                    filename, ", ".join(LOG_FORMATS)))
+            # keep the last, partial line
+            data = data[data.rfind(b"\n") + 1:]
+
+# A log file, plain or compressed, iterated line by line as raw bytes without
+# their line ends. The file is read in fixed-size chunks, so memory use does
+# not depend on the log size, and its format is detected from its first line
+# in a known format; a log with none raises ValueError. With printable_only,
+# non-printable bytes are dropped from the lines.
+class LogFile:
+    def __init__(self, filename, printable_only=False):
+        self.filename = filename
+        self.delete = NON_PRINTABLE_BYTES if printable_only else None
+        self.file = None
+        self.first_chunk = b""
+        self.format = LOG_FORMAT_TESTBED
+
+    def __enter__(self):
+        self.file = open_log(self.filename)
+        self.first_chunk = self.file.read(READ_CHUNK_BYTES)
+        if self.first_chunk:
+            try:
+                self.format = scan_log_format(self.filename, self.first_chunk)
+            except ValueError:
+                self.file.close()
+                raise
+        return self
+
+    def __exit__(self, *args):
+        self.file.close()
+
+    # the lines of each chunk, as lists, so that they are iterated at C speed
+    def _chunks(self):
+        chunk = self.first_chunk
+        self.first_chunk = b""
+        remainder = b""
+        while chunk:
+            if self.delete is not None:
+                chunk = chunk.translate(None, self.delete)
+            lines = (remainder + chunk).split(b"\n")
+            remainder = lines.pop()
+            yield lines
+            chunk = self.file.read(READ_CHUNK_BYTES)
+        if remainder:
+            yield [remainder]
+
+    def __iter__(self):
+        return chain.from_iterable(self._chunks())
+
+# A log file that is still being written, read incrementally: read() returns
+# the complete lines appended since the previous call. The format is detected
+# from the first line in a known format, and is None until there is one; all
+# lines are returned regardless. A file replaced under the same name (rotated)
+# is drained, then followed from the start of the new file. A file that
+# shrinks (truncated, e.g. by a new simulation run) is followed from its start
+# again, and `restarted` is set so that the earlier analysis can be dropped.
+class LogFollower:
+    def __init__(self, filename, chunk_size=READ_CHUNK_BYTES):
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self.file = None
+        self.inode = None
+        self.pending = b""
+        self.format = None
+        self.restarted = False
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _open(self):
+        try:
+            self.file = open(self.filename, "rb")
+        except OSError:
+            # not created yet, or being rotated
+            return False
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        return True
+
+    def _rotated(self):
+        try:
+            return os.stat(self.filename).st_ino != self.inode
+        except OSError:
+            return False
+
+    def read(self):
+        if self.file is None and not self._open():
+            return []
+
+        if os.fstat(self.file.fileno()).st_size < self.file.tell():
+            self.file.seek(0)
+            self.pending = b""
+            self.format = None
+            self.restarted = True
+
+        data = self.file.read(self.chunk_size)
+        if not data and self._rotated():
+            # the old file is complete, including its last line
+            data = b"\n" if self.pending else b""
+            self.close()
+
+        data = self.pending + data
+        end = data.rfind(b"\n") + 1
+        self.pending = data[end:]
+        if self.format is None and end:
+            self.format = detect_log_format(data[:end])
+        return data[:end - 1].split(b"\n") if end else []
+
+###########################################
+# Tokenize log lines
+
+# The timestamp and node at the start of a line, per log format
+LINE_HEADER_RE = {
+    LOG_FORMAT_COOJA: rb"(?P<ts>\d+)\s+(?P<node>\S+)\s*",
+    LOG_FORMAT_TESTBED: rb"(?P<ts>[^;]*);(?P<node>[^;]*);\s*",
+    LOG_FORMAT_TABBED: rb"(?P<ts>[^\t]*)\t(?P<node>[^\t]*)\t\s*",
+}
+
+# A Contiki-NG LOG_* message: "[LEVEL: Module    ] message"
+LOG_MESSAGE_RE = rb"\[(?P<level>.*?):(?P<module>.*?)\](?P<message>.*)"
+
+# Compile a pattern matching a whole line of the given format: the common
+# header, with the ts and node groups, followed by the message pattern
+def compile_line_pattern(log_format, message_pattern):
+    return re.compile(LINE_HEADER_RE[log_format] + message_pattern)
+
+# The node of a line, from its raw field: a number in Cooja logs, and a number
+# after a three-character prefix otherwise ("m3-12", "ID:12")
+def parse_node(node, log_format):
+    if log_format == LOG_FORMAT_COOJA:
+        return int(node)
+    return int(node[3:])
+
+# A log line. The time is in seconds: since the start of the simulation for
+# Cooja logs, and since the first timestamped line for testbed logs.
+class LogEvent(NamedTuple):
+    time: float
+    node: int
+    level: str
+    module: str
+    message: str
+
+# Tokenize raw lines of the given format into LogEvents. Lines that are not
+# Contiki-NG LOG_* output, or whose time or node cannot be parsed, are skipped.
+def log_events(lines, log_format):
+    match = compile_line_pattern(log_format, LOG_MESSAGE_RE).match
+    is_cooja = log_format == LOG_FORMAT_COOJA
+    is_testbed = log_format == LOG_FORMAT_TESTBED
+    start_time = None
+    nodes = {}
+    for line in lines:
+        m = match(line)
+        if m is None:
+            continue
+        ts, raw_node, level, module, message = m.groups()
+        try:
+            if is_cooja:
+                time = int(ts) / 1e6
+            else:
+                time = float(ts)
+                if is_testbed:
+                    if start_time is None:
+                        start_time = time
+                    time -= start_time
+            node = nodes.get(raw_node)
+            if node is None:
+                node = nodes[raw_node] = parse_node(raw_node, log_format)
+        except ValueError:
+            continue
+        yield LogEvent(time, node,
+                       level.strip().decode("ascii", "replace"),
+                       module.strip().decode("ascii", "replace"),
+                       message.strip().decode("ascii", "replace"))
+
+# Iterate over the events of a log file
+def read_log_events(filename, printable_only=True):
+    with LogFile(filename, printable_only) as f:
+        yield from log_events(f, f.format)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+# Throughput benchmark of the CCM* (AES-128) and SHA-256 implementations of
+# os/lib on the native target.
+#
+# Generates size-swept vectors, runs them through crypto-bench.native, checks
+# every output against PyCryptodome (CCM*) and hashlib (SHA-256), and reports
+# bytes per second and cycles per byte. Results are saved as JSON, and can be
+# compared to the results of an earlier run.
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import hashlib
+import argparse
+import platform
+import subprocess
+import tempfile
+
+SELF_PATH = os.path.dirname(os.path.abspath(__file__))
+BINARY = os.path.join(SELF_PATH, "build", "native", "crypto-bench.native")
+
+# message lengths, up to the largest CCM* message (0xffff bytes)
+CCM_SIZES = [16, 32, 64, 127, 256, 1024, 4096, 16384, 65535]
+# header (additional authenticated data) lengths
+CCM_HEADER_SIZES = [0, 26]
+# header lengths of the authentication-only vectors, up to the largest
+# CCM* header (0xfeff bytes)
+CCM_AUTH_ONLY_SIZES = [16, 127, 1024, 16384, 65279]
+# MIC lengths supported by both CCM* and PyCryptodome
+CCM_MIC_SIZES = [4, 8, 16]
+SHA256_SIZES = [16, 64, 127, 256, 1024, 4096, 16384, 65536]
+
+# how many bytes each vector processes in its timed runs
+DEFAULT_TARGET_BYTES = 1 << 20
+MIN_ITERATIONS = 16
+
+# default slowdown, in percent, reported as a regression
+DEFAULT_TOLERANCE = 10.0
+
+#######################################################
+# Generate the vectors
+
+def iterations_for(length, target_bytes):
+    iterations = max(MIN_ITERATIONS, math.ceil(target_bytes / max(length, 16)))
+    # an even number of CCM* runs leaves the message as it was
+    return iterations + (iterations & 1)
+
+def generate_vectors(seed, target_bytes):
+    rng = random.Random(seed)
+
+    def random_bytes(n):
+        return bytes(rng.getrandbits(8) for _ in range(n))
+
+    vectors = []
+    ccm_lengths = [(a_len, m_len) for m_len in CCM_SIZES for a_len in CCM_HEADER_SIZES]
+    ccm_lengths += [(a_len, 0) for a_len in CCM_AUTH_ONLY_SIZES]
+    for a_len, m_len in ccm_lengths:
+        for mic_len in CCM_MIC_SIZES:
+            vectors.append({
+                "op": "ccm",
+                "mic_len": mic_len,
+                "key": random_bytes(16),
+                "nonce": random_bytes(13),
+                "header": random_bytes(a_len),
+                "message": random_bytes(m_len),
+                "iterations": iterations_for(a_len + m_len, target_bytes),
+            })
+    for m_len in SHA256_SIZES:
+        vectors.append({
+            "op": "sha256",
+            "message": random_bytes(m_len),
+            "iterations": iterations_for(m_len, target_bytes),
+        })
+    return vectors
+
+def hex_field(data):
+    return data.hex() if data else "-"
+
+def vector_line(vector):
+    if vector["op"] == "ccm":
+        return "ccm {} {} {} {} {} {}\n".format(
+            vector["mic_len"], vector["iterations"], hex_field(vector["key"]), hex_field(vector["nonce"]),
+            hex_field(vector["header"]), hex_field(vector["message"]))
+    return "sha256 {} {}\n".format(vector["iterations"], hex_field(vector["message"]))
+
+#######################################################
+# Reference outputs
+
+def load_pycryptodome():
+    try:
+        from Crypto.Cipher import AES
+    except ImportError:
+        sys.exit("Verifying CCM* requires PyCryptodome: pip3 install pycryptodome (or use --no-verify)")
+    return AES
+
+def reference_output(vector, aes):
+    if vector["op"] == "sha256":
+        return hashlib.sha256(vector["message"]).digest()
+    cipher = aes.new(vector["key"], aes.MODE_CCM, vector["nonce"], mac_len=vector["mic_len"])
+    cipher.update(vector["header"])
+    ciphertext = cipher.encrypt(vector["message"])
+    return ciphertext + cipher.digest()
+
+#######################################################
+# Run the benchmark
+
+def build_binary():
+    print("Building {}".format(os.path.relpath(BINARY)))
+    if subprocess.call(["make", "-C", SELF_PATH, "TARGET=native", "-j{}".format(os.cpu_count() or 1)],
+                       stdout=subprocess.DEVNULL) != 0:
+        sys.exit("Building the benchmark failed")
+
+def run_vectors(binary, vectors):
+    with tempfile.NamedTemporaryFile("w", prefix="crypto-bench-", suffix=".txt") as f:
+        f.writelines(vector_line(vector) for vector in vectors)
+        f.flush()
+        output = subprocess.run([binary, f.name], stdout=subprocess.PIPE, universal_newlines=True)
+    results = [line.split()[1:] for line in output.stdout.splitlines() if line.startswith("result ")]
+    if output.returncode != 0 or len(results) != len(vectors):
+        sys.exit("The benchmark failed:\n" + output.stdout[-2000:])
+    return results
+
+# Combine a vector and its result line into a result record
+def make_result(vector, fields, aes):
+    if vector["op"] == "ccm":
+        _, mic_len, a_len, m_len, iterations, ns, cycles, out = fields
+    else:
+        _, m_len, iterations, ns, cycles, out = fields
+        mic_len, a_len = 0, 0
+    a_len, m_len, iterations, ns, cycles = (int(x) for x in (a_len, m_len, iterations, ns, cycles))
+    output = bytes.fromhex(out) if out != "-" else b""
+    processed = (a_len + m_len) * iterations
+    return {
+        "op": vector["op"],
+        "mic_len": int(mic_len),
+        "a_len": a_len,
+        "m_len": m_len,
+        "iterations": iterations,
+        "ns": ns,
+        "cycles": cycles,
+        "bytes_per_second": processed / (ns / 1e9) if ns else 0.0,
+        "cycles_per_byte": cycles / processed if cycles and processed else None,
+        "verified": None if aes is False else output == reference_output(vector, aes),
+    }
+
+def result_key(result):
+    return "{} mic={} a={} m={}".format(result["op"], result["mic_len"], result["a_len"], result["m_len"])
+
+def print_results(results):
+    print("{:<8} {:>4} {:>6} {:>6} {:>10} {:>12} {:>8}  {}".format(
+        "op", "mic", "a_len", "m_len", "iterations", "MB/s", "cyc/B", "verified"))
+    for r in results:
+        cycles_per_byte = "{:.1f}".format(r["cycles_per_byte"]) if r["cycles_per_byte"] else "-"
+        verified = {True: "ok", False: "MISMATCH", None: "-"}[r["verified"]]
+        print("{:<8} {:>4} {:>6} {:>6} {:>10} {:>12.2f} {:>8}  {}".format(
+            r["op"], r["mic_len"] or "", r["a_len"], r["m_len"], r["iterations"],
+            r["bytes_per_second"] / 1e6, cycles_per_byte, verified))
+
+# Compare throughput with an earlier run; returns the number of regressions
+def compare_results(results, baseline_file, tolerance):
+    with open(baseline_file) as f:
+        baseline = {result_key(r): r for r in json.load(f)["results"]}
+    regressions = 0
+    print("Compared to {}:".format(baseline_file))
+    for r in results:
+        old = baseline.get(result_key(r))
+        if old is None or not old["bytes_per_second"]:
+            continue
+        change = 100.0 * (r["bytes_per_second"] / old["bytes_per_second"] - 1)
+        if change < -tolerance:
+            regressions += 1
+            print("  REGRESSION {}: {:.2f} -> {:.2f} MB/s ({:+.1f}%)".format(
+                result_key(r), old["bytes_per_second"] / 1e6, r["bytes_per_second"] / 1e6, change))
+    print("  {} regressions beyond {:.0f}%".format(regressions, tolerance))
+    return regressions
+
+#######################################################
+# Main
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CCM* and SHA-256 on the native target.")
+    parser.add_argument("--binary", default=BINARY, help="the benchmark binary (built if missing)")
+    parser.add_argument("--seed", type=int, default=1, help="the seed of the generated vectors (default: 1)")
+    parser.add_argument("--bytes", type=int, default=DEFAULT_TARGET_BYTES,
+                        help="bytes processed per vector (default: {})".format(DEFAULT_TARGET_BYTES))
+    parser.add_argument("--no-verify", action="store_true", help="do not check the outputs with PyCryptodome")
+    parser.add_argument("-o", "--output", default="crypto-bench.json", help="the results file (default: %(default)s)")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="slowdown in percent reported as a regression (default: %(default)s)")
+    args = parser.parse_args()
+
+    aes = False if args.no_verify else load_pycryptodome()
+    if args.binary == BINARY and not os.path.exists(BINARY):
+        build_binary()
+
+    vectors = generate_vectors(args.seed, args.bytes)
+    results = [make_result(vector, fields, aes) for vector, fields in zip(vectors, run_vectors(args.binary, vectors))]
+    print_results(results)
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "time": int(time.time()),
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "seed": args.seed,
+            "results": results,
+        }, f, indent=2)
+    print("Results in {}".format(args.output))
+
+    failed = sum(r["verified"] is False for r in results)
+    if failed:
+        print("{} outputs do not match the reference".format(failed))
+    regressions = compare_results(results, args.baseline, args.tolerance) if args.baseline else 0
+    if failed or regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+/*
+ * Copyright (c) 2026, Contiki-NG contributors.
+ * All rights reserved.
+ *
+ * Redistribution and use in source and binary forms, with or without
+ * modification, are permitted provided that the following conditions
+ * are met:
+ * 1. Redistributions of source code must retain the above copyright
+ *    notice, this list of conditions and the following disclaimer.
+ * 2. Redistributions in binary form must reproduce the above copyright
+ *    notice, this list of conditions and the following disclaimer in the
+ *    documentation and/or other materials provided with the distribution.
+ * 3. Neither the name of the copyright holder nor the names of its
+ *    contributors may be used to endorse or promote products derived
+ *    from this software without specific prior written permission.
+ *
+ * THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDER AND CONTRIBUTORS
+ * "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+ * LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+ * FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+ * COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+ * INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+ * (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+ * SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+ * HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+ * STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+ * ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+ * OF THE POSSIBILITY OF SUCH DAMAGE.
+ */
+
+/**
+ * \file
+ *         Benchmark of the CCM* (AES-128) and SHA-256 implementations of
+ *         os/lib, for the native target. Runs the vectors of the file given
+ *         on the command line, one per line:
+ *
+ *           ccm <mic_len> <iterations> <key> <nonce> <header> <message>
+ *           sha256 <iterations> <message>
+ *
+ *         with the byte strings in hex, "-" for an empty one. For each
+ *         vector, prints a line with the output of the first run, for
+ *         verification, and the time and cycles of the timed runs:
+ *
+ *           result ccm <mic_len> <a_len> <m_len> <iterations> <ns> <cycles> <ciphertext+MIC>
+ *           result sha256 <m_len> <iterations> <ns> <cycles> <digest>
+ *
+ *         The timed CCM* runs alternate encryption and decryption, which
+ *         cost the same, so that the message is restored without copies.
+ *         Cycles are time stamp counter ticks, or 0 where there is none.
+ *         See bench.py.
+ */
+
+#include "contiki.h"
+#include "lib/ccm-star.h"
+#include "lib/sha-256.h"
+#include "lib/hexconv.h"
+
+#include <inttypes.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+
+#if defined(__x86_64__) || defined(__i386__)
+#include <x86intrin.h>
+#define CYCLES() __rdtsc()
+#else
+#define CYCLES() 0
+#endif
+
+#define MAX_LEN 0xffff
+#define NONCE_LEN CCM_STAR_NONCE_LENGTH
+#define MAX_MIC_LEN 16
+
+extern int contiki_argc;
+extern char **contiki_argv;
+
+static uint8_t key[16];
+static uint8_t nonce[NONCE_LEN];
+static uint8_t header[MAX_LEN];
+static uint8_t message[MAX_LEN + 1];
+static uint8_t work[MAX_LEN + MAX_MIC_LEN];
+static uint8_t mic[MAX_MIC_LEN];
+
+PROCESS(crypto_bench_process, "Crypto benchmark");
+AUTOSTART_PROCESSES(&crypto_bench_process);
+/*---------------------------------------------------------------------------*/
+static uint64_t
+now_ns(void)
+{
+  struct timespec ts;
+
+  clock_gettime(CLOCK_MONOTONIC, &ts);
+  return (uint64_t)ts.tv_sec * 1000000000 + ts.tv_nsec;
+}
+/*---------------------------------------------------------------------------*/
+/* Decode a hex field into buf, returning its length, or -1 */
+static int
+unhex_field(const char *field, uint8_t *buf, int buf_len)
+{
+  int len;
+
+  if(field == NULL) {
+    return -1;
+  }
+  if(!strcmp(field, "-")) {
+    return 0;
+  }
+  len = strlen(field);
+  if(len / 2 > buf_len) {
+    return -1;
+  }
+  return hexconv_unhexlify(field, len, buf, buf_len);
+}
+/*---------------------------------------------------------------------------*/
+/* Decode a decimal field into value, returning 1, or 0 if it is not one */
+static int
+number_field(const char *field, long *value)
+{
+  char *end;
+
+  if(field == NULL) {
+    return 0;
+  }
+  *value = strtol(field, &end, 10);
+  return end != field && *end == '\0';
+}
+/*---------------------------------------------------------------------------*/
+static void
+print_hex(const uint8_t *data, int len)
+{
+  int i;
+
+  if(len == 0) {
+    printf("-");
+  }
+  for(i = 0; i < len; i++) {
+    printf("%02x", data[i]);
+  }
+}
+/*---------------------------------------------------------------------------*/
+static int
+bench_ccm(char **save)
+{
+  long mic_len, iterations;
+  int a_len, m_len;
+  long i;
+  uint64_t start_ns, elapsed_ns;
+  uint64_t start_cycles, elapsed_cycles;
+
+  if(!number_field(strtok_r(NULL, " ", save), &mic_len)
+     || !number_field(strtok_r(NULL, " ", save), &iterations)
+     || unhex_field(strtok_r(NULL, " ", save), key, sizeof(key)) != sizeof(key)
+     || unhex_field(strtok_r(NULL, " ", save), nonce, sizeof(nonce)) != sizeof(nonce)
+     || (a_len = unhex_field(strtok_r(NULL, " ", save), header, sizeof(header))) < 0
+     || (m_len = unhex_field(strtok_r(NULL, " \n", save), message, MAX_LEN)) < 0
+     || mic_len < 0 || mic_len > MAX_MIC_LEN || iterations < 1) {
+    return 0;
+  }
+
+  CCM_STAR.set_key(key);
+
+  /* The output to verify */
+  memcpy(work, message, m_len);
+  CCM_STAR.aead(nonce, work, m_len, header, a_len, mic, mic_len, 1);
+  printf("result ccm %ld %d %d %ld ", mic_len, a_len, m_len, iterations);
+
+  memcpy(work, message, m_len);
+  start_ns = now_ns();
+  start_cycles = CYCLES();
+  for(i = 0; i < iterations; i++) {
+    CCM_STAR.aead(nonce, work, m_len, header, a_len, mic, mic_len, !(i & 1));
+  }
+  elapsed_cycles = CYCLES() - start_cycles;
+  elapsed_ns = now_ns() - start_ns;
+
+  printf("%" PRIu64 " %" PRIu64 " ", elapsed_ns, elapsed_cycles);
+  memcpy(work, message, m_len);
+  CCM_STAR.aead(nonce, work, m_len, header, a_len, mic, mic_len, 1);
+  memcpy(work + m_len, mic, mic_len);
+  print_hex(work, m_len + mic_len);
+  printf("\n");
+  return 1;
+}
+/*---------------------------------------------------------------------------*/
+static int
+bench_sha256(char **save)
+{
+  long iterations;
+  uint8_t digest[SHA_256_DIGEST_LENGTH];
+  int m_len;
+  long i;
+  uint64_t start_ns, elapsed_ns;
+  uint64_t start_cycles, elapsed_cycles;
+
+  if(!number_field(strtok_r(NULL, " ", save), &iterations)
+     || (m_len = unhex_field(strtok_r(NULL, " \n", save), message, sizeof(message))) < 0
+     || iterations < 1) {
+    return 0;
+  }
+
+  start_ns = now_ns();
+  start_cycles = CYCLES();
+  for(i = 0; i < iterations; i++) {
+    sha_256_hash(message, m_len, digest);
+  }
+  elapsed_cycles = CYCLES() - start_cycles;
+  elapsed_ns = now_ns() - start_ns;
+
+  printf("result sha256 %d %ld %" PRIu64 " %" PRIu64 " ",
+         m_len, iterations, elapsed_ns, elapsed_cycles);
+  print_hex(digest, sizeof(digest));
+  printf("\n");
+  return 1;
+}
+/*---------------------------------------------------------------------------*/
+PROCESS_THREAD(crypto_bench_process, ev, data)
+{
+  static FILE *vectors;
+  static char *line;
+  static size_t line_size;
+  char *save;
+  char *op;
+  int ok;
+
+  PROCESS_BEGIN();
+
+  if(contiki_argc < 2 || (vectors = fopen(contiki_argv[1], "r")) == NULL) {
+    printf("usage: %s <vectors>\n", contiki_argv[0]);
+    exit(EXIT_FAILURE);
+  }
+
+  while(getline(&line, &line_size, vectors) > 0) {
+    op = strtok_r(line, " \n", &save);
+    if(op == NULL) {
+      continue;
+    }
+    if(!strcmp(op, "ccm")) {
+      ok = bench_ccm(&save);
+    } else if(!strcmp(op, "sha256")) {
+      ok = bench_sha256(&save);
+    } else {
+      ok = 0;
+    }
+    if(!ok) {
+      printf("error: invalid vector %s\n", op);
+      exit(EXIT_FAILURE);
+    }
+  }
+
+  fclose(vectors);
+  free(line);
+  printf("done\n");
+  exit(EXIT_SUCCESS);
+
+  PROCESS_END();
+}
+/*---------------------------------------------------------------------------*/
@@ -2,9 +2,20 @@
 
 import os
 import sys
+import json
 import time
+import shutil
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import matplotlib.pyplot as pl
 
+# the log ingestion shared by the benchmark scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from contikilog import LOG_FORMAT_COOJA, LOG_FORMAT_TESTBED, LOG_FORMATS, \
+    LogFile, LogFollower, compile_line_pattern, parse_node
+
 ###########################################
 
 # If set to true, all nodes are plotted, even those with no valid data
@@ -14,8 +25,29 @@ PLOT_ALL_NODES = True
 
 LOG_FILE = 'COOJA.testlog'
 
+# in follow mode: how often the log is checked for new lines, and how often
+# snapshot metrics are written, in seconds
+FOLLOW_POLL_SECONDS = 1.0
+FOLLOW_SNAPSHOT_SECONDS = 60.0
+
 COORDINATOR_ID = 1
 
+# the metrics plotted, with their axis labels
+PLOTS = [
+    ("pdr", "Packet Delivery Ratio, %"),
+    ("par", "Packet Acknowledgement Ratio, %"),
+    ("rpl_switches", "RPL parent switches"),
+    ("duty_cycle", "Radio Duty Cycle, %"),
+    ("duty_cycle_joined", "Joined Radio Duty Cycle, %"),
+    ("charge", "Charge consumption, mC"),
+]
+
+PLOT_FORMATS = ["pdf", "png", "svg"]
+
+# content hashes of the plotted figures, to skip redrawing unchanged ones;
+# kept next to the analyzed log
+PLOT_CACHE_FILE = ".plot-cache.json"
+
 # for charge calculations
 CC2650_MHZ = 48
 CC2650_RADIO_TX_CURRENT_MA          = 9.100 # at 5 dBm, from CC2650 datasheet
@@ -31,7 +63,56 @@ node_id_to_device_id = {}
 
 ###########################################
 
+# Set of the sequence numbers received from a node, as a bitmap grown on
+# demand. Sequence numbers too large for the bitmap are kept in a plain set.
+class SeqnumSet:
+    __slots__ = ("bits", "count", "overflow")
+
+    # largest sequence number kept in the bitmap (a 2 MiB bitmap at most)
+    MAX_BITMAP_SEQNUM = (1 << 24) - 1
+
+    def __init__(self):
+        self.bits = bytearray()
+        self.count = 0
+        self.overflow = None
+
+    def add(self, seqnum):
+        if seqnum > self.MAX_BITMAP_SEQNUM:
+            if self.overflow is None:
+                self.overflow = set()
+            self.overflow.add(seqnum)
+            return
+        index = seqnum >> 3
+        if index >= len(self.bits):
+            # grow geometrically, for amortized constant time
+            self.bits.extend(bytes(max(index + 1, 2 * len(self.bits)) - len(self.bits)))
+        mask = 1 << (seqnum & 7)
+        if not self.bits[index] & mask:
+            self.bits[index] |= mask
+            self.count += 1
+
+    def __contains__(self, seqnum):
+        if seqnum > self.MAX_BITMAP_SEQNUM:
+            return self.overflow is not None and seqnum in self.overflow
+        index = seqnum >> 3
+        return index < len(self.bits) and bool(self.bits[index] & (1 << (seqnum & 7)))
+
+    def __len__(self):
+        return self.count + (len(self.overflow) if self.overflow else 0)
+
 class NodeStats:
+    __slots__ = (
+        "id",
+        "is_valid", "is_tsch_joined", "tsch_join_time_sec", "rpl_join_time_sec",
+        "tsch_time_source", "rpl_parent", "max_seqnum_sent", "seqnums_received_on_root",
+        "parent_packets_tx", "parent_packets_ack", "parent_packets_queue_dropped",
+        "energest_cpu_on", "energest_cpu_sleep", "energest_cpu_deep_sleep",
+        "energest_radio_tx", "energest_radio_rx", "energest_radio_rx_joined",
+        "energest_total", "energest_total_joined", "energest_ticks_per_second",
+        "energest_joined", "energest_period_seconds",
+        "pdr", "rpl_parent_changes", "par", "rdc", "rdc_joined", "charge",
+    )
+
     def __init__(self, id):
         self.id = id
 
@@ -43,7 +124,7 @@ class NodeStats:
         self.tsch_time_source = None
         self.rpl_parent = None
         self.max_seqnum_sent = 0
-        self.seqnums_received_on_root = set()
+        self.seqnums_received_on_root = SeqnumSet()
         self.parent_packets_tx = 0
         self.parent_packets_ack = 0
         self.parent_packets_queue_dropped = 0
@@ -67,8 +148,8 @@ class NodeStats:
         self.rdc_joined = None
         self.charge = None
 
-    # calculate the final metrics
-    def calc(self):
+    # calculate the final metrics; warnings are only printed when verbose
+    def calc(self, verbose=True):
         if self.energest_total:
             radio_on = self.energest_radio_tx + self.energest_radio_rx
             self.rdc = 100.0 * radio_on / self.energest_total
@@ -86,7 +167,8 @@ class NodeStats:
                 + CC2650_RADIO_CPU_DEEP_SLEEP_CURRENT * cpu_deep_sleep_sec
 
         else:
-            print("warning: no energest results for {}".format(self.id))
+            if verbose:
+                print("warning: no energest results for {}".format(self.id))
             self.rdc = 0.0
             self.charge = 0.0
 
@@ -98,15 +180,18 @@ class NodeStats:
 
 
         if self.tsch_join_time_sec is None:
-            print("node {} never associated TSCH".format(self.id))
+            if verbose:
+                print("node {} never associated TSCH".format(self.id))
             return 0, 0, 0, 0, 0
 
         if self.rpl_join_time_sec is None:
-            print("node {} never joined RPL DAG".format(self.id))
+            if verbose:
+                print("node {} never joined RPL DAG".format(self.id))
             return 0, 0, 0, 0, 0
 
         if self.max_seqnum_sent == 0:
-            print("node {} never sent any data packets".format(self.id))
+            if verbose:
+                print("node {} never sent any data packets".format(self.id))
             return 0, 0, 0, 0, 0
 
         self.is_valid = True
@@ -151,93 +236,178 @@ def extract_ipaddr_pair(fields):
 def addr_to_id(addr):
     return int(addr.split(":")[-1], 16)
 
+###########################################
+# Classify log lines
+
+# The events of interest in the message of a line. Each event is a named
+# group, which is the last group of a match; for the Energest events, the
+# group is the value of interest. Alternatives are ordered by how often the
+# events occur in logs, rare events are looked for anywhere in the message in
+# a single scan, and lines without an event of interest match as "other".
+# Lines are not stripped: trailing whitespace, such as the \r of CRLF logs,
+# is left out of the fields, which end at whitespace or match it before $.
+LINE_EVENT_RE = (
+    rb"(?:"
+    rb"\[INFO: Energest\s*\] (?:"
+    rb"Radio Rx\s*:\s*(?P<energest_radio_rx>\d+)/"
+    rb"|Radio Tx\s*:\s*(?P<energest_radio_tx>\d+)/"
+    rb"|Deep LPM\s*:\s*(?P<energest_deep_lpm>\d+)/"
+    rb"|CPU\s*:\s*\d+/\s*(?P<energest_cpu>\d+)"
+    rb"|LPM\s*:\s*\d+/\s*(?P<energest_lpm>\d+)"
+    rb"|Total time\s*:\s*(?P<energest_total>\d+)"
+    rb"|--- Period summary #\d+ \((?P<energest_period>\d+)"
+    rb"|(?P<energest>)"
+    rb")"
+    rb"|(?P<link_stats>\[INFO: Link Stats\s*\] num packets: tx=(?P<link_stats_tx>\d+) ack=(?P<link_stats_ack>\d+)"
+    rb" rx=\d+ queue_drops=(?P<link_stats_queue_drops>\d+) to=(?P<link_stats_to>\S+))"
+    rb"|(?P<app_generate>\[INFO: App\s*\] app generate packet seqnum=(?P<app_generate_seqnum>\d+)"
+    rb"(?: node_id=(?P<app_generate_node_id>\d+))?)"
+    rb"|(?P<app_receive>\[INFO: App\s*\] app receive packet seqnum=(?P<app_receive_seqnum>\d+)"
+    rb" from=(?P<app_receive_from>\S+))"
+    rb"|.*?(?:"
+    rb"(?P<association>association done)"
+    rb"|(?P<leaving>leaving the network)"
+    rb"|(?P<time_source>update time source: .*? -> (?P<time_source_addr>.*?)(?: -> .*?)?\s*$)"
+    rb"|(?P<preferred_parent>rpl_set_preferred_parent\s+(?P<preferred_parent_addr>\S+))"
+    rb"|(?P<parent_switch> parent switch: .*? -> (?P<parent_switch_addr>.*?)(?: -> .*?)?\s*$)"
+    rb")"
+    rb"|(?P<other>)"
+    rb")"
+)
+
+# Line classifier per log format: a single match of a raw line gives the
+# timestamp, the node, and the event with its fields
+LINE_RE = dict((log_format, compile_line_pattern(log_format, LINE_EVENT_RE))
+               for log_format in LOG_FORMATS)
+
 ###########################################
 # Parse a log file
 
-def analyze_results(filename, is_testbed):
-    nodes = {}
+# The state of the analysis of one log, fed with raw lines as they are read
+class LogAnalyzer:
+    def __init__(self, log_format):
+        self.format = log_format
+        self.nodes = {}
+        # nodes by their raw identifier in the log, to parse each only once
+        self.line_nodes = {}
+        self.start_ts_unix = None
+
+    def feed(self, lines):
+        nodes = self.nodes
+        line_nodes = self.line_nodes
+        start_ts_unix = self.start_ts_unix
+        is_testbed = self.format == LOG_FORMAT_TESTBED
+        is_cooja = self.format == LOG_FORMAT_COOJA
+        line_re = LINE_RE[self.format]
+        for line in lines:
+            m = line_re.match(line)
+            if m is None:
+                continue
 
-    in_initialization = True
+            ts, node = m.group("ts", "node")
+            if is_cooja:
+                # timestamps are validated by the classifier, and only
+                # converted to milliseconds for the events that use them
+                ts_ms = None
+            else:
+                try:
+                    # in milliseconds
+                    if is_testbed:
+                        ts_unix = float(ts)
+                        if start_ts_unix is None:
+                            start_ts_unix = self.start_ts_unix = ts_unix
+                        ts_unix -= start_ts_unix
+                        ts_ms = int(float(ts_unix) * 1000)
+                    else:
+                        ts_ms = int(float(ts) * 1000) # convert to ms
+                except:
+                    # failed to extract timestamp
+                    continue
 
-    start_ts_unix = None
+            n = line_nodes.get(node)
+            if n is None:
+                try:
+                    node = parse_node(node, self.format)
+                except:
+                    continue
+                n = nodes.get(node)
+                if n is None:
+                    n = nodes[node] = NodeStats(node)
+                line_nodes[m.group("node")] = n
 
-    with open(filename, "r") as f:
-        for line in f:
-            line = line.strip()
-            if is_testbed:
-                fields1 = line.split(";")
-                fields2 = fields1[2].split()
-                fields = fields1[:2] + fields2
-            else:
-                fields = line.split()
+            event = m.lastgroup
 
-            try:
-                # in milliseconds
-                if is_testbed:
-                    ts_unix = float(fields[0])
-                    if start_ts_unix is None:
-                        start_ts_unix = ts_unix
-                    ts_unix -= start_ts_unix
-                    ts = int(float(ts_unix) * 1000)
-                    node = int(fields[1][3:])
-                else:
-                    ts = int(fields[0]) // 1000 # convert to ms
-                    node = int(fields[1]) 
-            except:
-                # failed to extract timestamp
+            # 960073000 8 [INFO: Energest  ] Total time  :   60000000
+            # 960073000 8 [INFO: Energest  ] CPU         :   60000000/  60000000 (69 permil)
+            # 960073000 8 [INFO: Energest  ] LPM         :          0/  60000000 (0 permil)
+            # 960073000 8 [INFO: Energest  ] Deep LPM    :          0/  60000000 (0 permil)
+            # 960073000 8 [INFO: Energest  ] Radio Tx    :      49216/  60000000 (0 permil)
+            # 960073000 8 [INFO: Energest  ] Radio Rx    :    2470552/  60000000 (41 permil)
+            # 960073000 8 [INFO: Energest  ] Radio total :    2519768/  60000000 (41 permil)
+            if event == "energest_radio_rx":
+                ticks = int(m.group(event))
+                n.energest_radio_rx += ticks
+                if n.energest_joined:
+                    n.energest_radio_rx_joined += ticks
+                # update the state
+                n.energest_joined = n.is_tsch_joined
                 continue
 
-            if node not in nodes:
-                nodes[node] = NodeStats(node)
+            if event == "energest_radio_tx":
+                n.energest_radio_tx += int(m.group(event))
+                continue
 
-            if "association done" in line:
-                # has_assoc.add(node)
-                #nodes[node].seqnums = set()
-                if nodes[node].tsch_join_time_sec is None:
-                    nodes[node].tsch_join_time_sec = ts / 1000
-                nodes[node].is_tsch_joined = True
+            if event == "energest_deep_lpm":
+                n.energest_cpu_sleep += int(m.group(event))
                 continue
 
-            if "leaving the network" in line:
-                nodes[node].is_tsch_joined = False
-                nodes[node].energest_joined = False
+            # CPU and LPM ticks used to be read from the fifth whitespace-
+            # separated field of the message, which for these one-word names
+            # is the period total, minus its last character. Kept as is.
+            if event == "energest_cpu":
+                n.energest_cpu_on += int(m.group(event)[:-1])
                 continue
 
-            # 536000 2 [INFO: TSCH Queue] update time source: (NULL LL addr) -> 0001.0001.0001.0001
-            if "update time source" in line:
-                nodes[node].tsch_time_source = extract_macaddr(line.split(" -> ")[1])
+            if event == "energest_lpm":
+                n.energest_cpu_deep_sleep += int(m.group(event)[:-1])
                 continue
 
-            # 2497128 2 [INFO: RPL       ] rpl_set_preferred_parent fe80::201:1:1:1 used to be NULL
-            if "rpl_set_preferred_parent" in line:
-                nodes[node].rpl_parent_changes += 1
-                nodes[node].rpl_parent = extract_ipaddr(fields[6])
-                if nodes[node].rpl_join_time_sec is None:
-                    nodes[node].rpl_join_time_sec = ts / 1000
+            if event == "energest_total":
+                total = int(m.group(event))
+                n.energest_total += total
+                n.energest_ticks_per_second = total / n.energest_period_seconds
+                if n.energest_joined:
+                    n.energest_total_joined += total
                 continue
 
-            # 377018480 76 [INFO: RPL       ] parent switch: (NULL IP addr) -> fe80::244:44:44:44
-            if " parent switch: " in line:
-                nodes[node].rpl_parent_changes += 1
-                nodes[node].rpl_parent = extract_ipaddr_pair(fields[7:])[1]
-                if nodes[node].rpl_join_time_sec is None:
-                    nodes[node].rpl_join_time_sec = ts / 1000
+            if event == "energest_period":
+                n.energest_period_seconds = int(m.group(event))
+                continue
+
+            # 600142000 28 [INFO: Link Stats] num packets: tx=0 ack=0 rx=0 queue_drops=0 to=0014.0014.0014.0014
+            if event == "link_stats":
+                tx, ack, queue_drops, to_addr = m.group("link_stats_tx", "link_stats_ack",
+                                                        "link_stats_queue_drops", "link_stats_to")
+                # only account for the (current) time source node
+                if n.tsch_time_source == to_addr.decode():
+                    n.parent_packets_tx += int(tx)
+                    n.parent_packets_ack += int(ack)
+                    n.parent_packets_queue_dropped += int(queue_drops)
                 continue
 
             # 120904000 4 [INFO: App       ] app generate packet seqnum=1
-            if "app generate packet" in line:
-                seqnum = int(fields[8].split("=")[1])
+            if event == "app_generate":
+                seqnum = int(m.group("app_generate_seqnum"))
                 if is_testbed:
-                    node_id = int(fields[9].split("=")[1])
-                    node_id_to_device_id[node_id] = node
-                nodes[node].max_seqnum_sent = max(nodes[node].max_seqnum_sent, seqnum)
+                    node_id = int(m.group("app_generate_node_id"))
+                    node_id_to_device_id[node_id] = n.id
+                n.max_seqnum_sent = max(n.max_seqnum_sent, seqnum)
                 continue
 
             # 123047424 1 [INFO: App       ] app receive packet seqnum=1 from=fd00::208:8:8:8
-            if "app receive packet" in line:
-                seqnum = int(fields[8].split("=")[1])
-                fromaddr = fields[9].split("=")[1]
-                from_node = addr_to_id(fromaddr)
+            if event == "app_receive":
+                seqnum = int(m.group("app_receive_seqnum"))
+                from_node = addr_to_id(m.group("app_receive_from").decode())
                 if is_testbed:
                     from_node = node_id_to_device_id.get(from_node, 0)
                 if from_node not in nodes:
@@ -245,91 +415,347 @@ def analyze_results(filename, is_testbed):
                 nodes[from_node].seqnums_received_on_root.add(seqnum)
                 continue
 
-            # 600142000 28 [INFO: Link Stats] num packets: tx=0 ack=0 rx=0 queue_drops=0 to=0014.0014.0014.0014
-            if "num packets" in line:
-                tx = int(fields[7].split("=")[1])
-                ack = int(fields[8].split("=")[1])
-                rx = int(fields[9].split("=")[1])
-                queue_drops = int(fields[10].split("=")[1])
-                to_addr = fields[11].split("=")[1]
-                # only account for the (current) time source node
-                if nodes[node].tsch_time_source == to_addr:
-                    nodes[node].parent_packets_tx += tx
-                    nodes[node].parent_packets_ack += ack
-                    nodes[node].parent_packets_queue_dropped += queue_drops
+            if event == "energest" or event == "other":
                 continue
 
-            # 960073000 8 [INFO: Energest  ] Total time  :   60000000
-            # 960073000 8 [INFO: Energest  ] CPU         :   60000000/  60000000 (69 permil)
-            # 960073000 8 [INFO: Energest  ] LPM         :          0/  60000000 (0 permil)
-            # 960073000 8 [INFO: Energest  ] Deep LPM    :          0/  60000000 (0 permil)
-            # 960073000 8 [INFO: Energest  ] Radio Tx    :      49216/  60000000 (0 permil)
-            # 960073000 8 [INFO: Energest  ] Radio Rx    :    2470552/  60000000 (41 permil)
-            # 960073000 8 [INFO: Energest  ] Radio total :    2519768/  60000000 (41 permil)
-            if "INFO: Energest" in line:
-                if "Period" in line:
-                    nodes[node].energest_period_seconds = int(fields[9][1:])
-                elif "Total time" in line:
-                    total = int(fields[8])
-                    nodes[node].energest_total += total
-                    nodes[node].energest_ticks_per_second = total / nodes[node].energest_period_seconds
-                    if nodes[node].energest_joined:
-                        nodes[node].energest_total_joined += total
-                else:
-                    ticks = int(fields[8][:-1])
-                    if "CPU" in line:
-                        nodes[node].energest_cpu_on += ticks
-                    elif "Deep LPM" in line:
-                        nodes[node].energest_cpu_sleep += ticks
-                    elif "LPM" in line:
-                        nodes[node].energest_cpu_deep_sleep += ticks
-                    elif "Radio Tx" in line:
-                        nodes[node].energest_radio_tx += ticks
-                    elif "Radio Rx" in line:
-                        nodes[node].energest_radio_rx += ticks
-                        if nodes[node].energest_joined:
-                            nodes[node].energest_radio_rx_joined += ticks
-                        # update the state
-                        nodes[node].energest_joined = nodes[node].is_tsch_joined
-                    continue
+            # the remaining events are rare, and some use the timestamp
+            if ts_ms is None:
+                ts_ms = int(ts) // 1000 # convert to ms
+
+            if event == "association":
+                # has_assoc.add(node)
+                #nodes[node].seqnums = set()
+                if n.tsch_join_time_sec is None:
+                    n.tsch_join_time_sec = ts_ms / 1000
+                n.is_tsch_joined = True
+                continue
+
+            if event == "leaving":
+                n.is_tsch_joined = False
+                n.energest_joined = False
+                continue
+
+            # 536000 2 [INFO: TSCH Queue] update time source: (NULL LL addr) -> 0001.0001.0001.0001
+            if event == "time_source":
+                n.tsch_time_source = extract_macaddr(m.group("time_source_addr").decode(errors="replace"))
+                continue
 
-    r = []
-    # link layer PAR
-    total_ll_sent = 0
-    total_ll_acked = 0
-    total_ll_queue_dropped = 0
-    # end to end PDR
-    total_e2e_sent = 0
-    total_e2e_received = 0
-    for k in sorted(nodes.keys()):
-        n = nodes[k]
-        if n.id == COORDINATOR_ID:
-            continue
-        ll_sent, ll_acked, ll_queue_dropped, e2e_sent, e2e_received = n.calc()
-        if n.is_valid or PLOT_ALL_NODES:
-            d = {
-                "id": n.id,
-                "pdr": n.pdr,
-                "par": n.par,
-                "rpl_switches": n.rpl_parent_changes,
-                "duty_cycle": n.rdc,
-                "duty_cycle_joined": n.rdc_joined,
-                "charge": n.charge
-            }
-            r.append(d)
-            total_ll_sent += ll_sent
-            total_ll_acked += ll_acked
-            total_ll_queue_dropped += ll_queue_dropped
-            total_e2e_sent += e2e_sent
-            total_e2e_received += e2e_received
-    ll_par = 100.0 * total_ll_acked / total_ll_sent if total_ll_sent else 0.0
-    e2e_pdr = 100.0 * total_e2e_received / total_e2e_sent if total_e2e_sent else 0.0
-    return r, ll_par, total_ll_queue_dropped, e2e_pdr
+            # 2497128 2 [INFO: RPL       ] rpl_set_preferred_parent fe80::201:1:1:1 used to be NULL
+            if event == "preferred_parent":
+                n.rpl_parent_changes += 1
+                n.rpl_parent = extract_ipaddr(m.group("preferred_parent_addr").decode(errors="replace"))
+                if n.rpl_join_time_sec is None:
+                    n.rpl_join_time_sec = ts_ms / 1000
+                continue
+
+            # 377018480 76 [INFO: RPL       ] parent switch: (NULL IP addr) -> fe80::244:44:44:44
+            if event == "parent_switch":
+                n.rpl_parent_changes += 1
+                n.rpl_parent = extract_ipaddr(m.group("parent_switch_addr").decode(errors="replace"))
+                if n.rpl_join_time_sec is None:
+                    n.rpl_join_time_sec = ts_ms / 1000
+                continue
+
+    # calculate the final metrics of all nodes
+    def results(self, verbose=True):
+        nodes = self.nodes
+        r = []
+        # link layer PAR
+        total_ll_sent = 0
+        total_ll_acked = 0
+        total_ll_queue_dropped = 0
+        # end to end PDR
+        total_e2e_sent = 0
+        total_e2e_received = 0
+        for k in sorted(nodes.keys()):
+            n = nodes[k]
+            if n.id == COORDINATOR_ID:
+                continue
+            ll_sent, ll_acked, ll_queue_dropped, e2e_sent, e2e_received = n.calc(verbose)
+            if n.is_valid or PLOT_ALL_NODES:
+                d = {
+                    "id": n.id,
+                    "pdr": n.pdr,
+                    "par": n.par,
+                    "rpl_switches": n.rpl_parent_changes,
+                    "duty_cycle": n.rdc,
+                    "duty_cycle_joined": n.rdc_joined,
+                    "charge": n.charge
+                }
+                r.append(d)
+                total_ll_sent += ll_sent
+                total_ll_acked += ll_acked
+                total_ll_queue_dropped += ll_queue_dropped
+                total_e2e_sent += e2e_sent
+                total_e2e_received += e2e_received
+        ll_par = 100.0 * total_ll_acked / total_ll_sent if total_ll_sent else 0.0
+        e2e_pdr = 100.0 * total_e2e_received / total_e2e_sent if total_e2e_sent else 0.0
+        return r, ll_par, total_ll_queue_dropped, e2e_pdr
+
+###########################################
+# Cache the parsed state of logs
+
+# The per-node state saved in the cache, one column per attribute. Optional
+# values are saved as NaN (floats) or with a mask of None entries (strings).
+# The final metrics are not saved, as calc() derives them from this state.
+NODE_STATE_COLUMNS = [
+    ("id", "int"),
+    ("is_tsch_joined", "bool"),
+    ("tsch_join_time_sec", "float"),
+    ("rpl_join_time_sec", "float"),
+    ("tsch_time_source", "str"),
+    ("rpl_parent", "str"),
+    ("max_seqnum_sent", "int"),
+    ("parent_packets_tx", "int"),
+    ("parent_packets_ack", "int"),
+    ("parent_packets_queue_dropped", "int"),
+    ("energest_cpu_on", "int"),
+    ("energest_cpu_sleep", "int"),
+    ("energest_cpu_deep_sleep", "int"),
+    ("energest_radio_tx", "int"),
+    ("energest_radio_rx", "int"),
+    ("energest_radio_rx_joined", "int"),
+    ("energest_total", "int"),
+    ("energest_total_joined", "int"),
+    ("energest_ticks_per_second", "float"),
+    ("energest_joined", "bool"),
+    ("energest_period_seconds", "int"),
+    ("rpl_parent_changes", "int"),
+]
+
+# Bump when the parsing or the saved state changes, to ignore older entries
+PARSE_CACHE_VERSION = 2
+
+PARSE_CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+                               "contiki-ng", "run-analysis")
+PARSE_CACHE_MAX_MB = 256
+
+def save_node_state(filename, nodes, log_format):
+    columns = {"format": np.array(log_format)}
+    node_list = [nodes[k] for k in sorted(nodes.keys())]
+    for name, kind in NODE_STATE_COLUMNS:
+        values = [getattr(n, name) for n in node_list]
+        if kind == "str":
+            columns[name + ".none"] = np.array([v is None for v in values], dtype=bool)
+            values = ["" if v is None else v for v in values]
+            columns[name] = np.array(values, dtype=str)
+        elif kind == "float":
+            columns[name] = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+        else:
+            columns[name] = np.array(values, dtype=np.int64 if kind == "int" else bool)
+
+    # the received sequence numbers: all bitmaps, then all overflow sets,
+    # concatenated, with the boundaries of each node
+    seqnums = [n.seqnums_received_on_root for n in node_list]
+    columns["seqnum_counts"] = np.array([s.count for s in seqnums], dtype=np.int64)
+    columns["seqnum_bitmap_ends"] = np.cumsum([len(s.bits) for s in seqnums], dtype=np.int64)
+    columns["seqnum_bitmaps"] = np.frombuffer(b"".join(bytes(s.bits) for s in seqnums), dtype=np.uint8)
+    overflows = [sorted(s.overflow) if s.overflow else [] for s in seqnums]
+    columns["seqnum_overflow_ends"] = np.cumsum([len(o) for o in overflows], dtype=np.int64)
+    columns["seqnum_overflows"] = np.array([v for o in overflows for v in o], dtype=np.int64)
+
+    with open(filename, "wb") as f:
+        np.savez(f, **columns)
+
+def load_node_state(filename):
+    with np.load(filename) as columns:
+        log_format = str(columns["format"])
+        ids = columns["id"].tolist()
+        nodes = dict((node, NodeStats(node)) for node in ids)
+        node_list = [nodes[node] for node in ids]
+        for name, kind in NODE_STATE_COLUMNS[1:]:
+            values = columns[name].tolist()
+            if kind == "str":
+                values = [None if none else v for v, none in zip(values, columns[name + ".none"].tolist())]
+            elif kind == "float":
+                values = [None if v != v else v for v in values]
+            for n, v in zip(node_list, values):
+                setattr(n, name, v)
+
+        counts = columns["seqnum_counts"].tolist()
+        bitmaps = columns["seqnum_bitmaps"].tobytes()
+        bitmap_ends = columns["seqnum_bitmap_ends"].tolist()
+        overflows = columns["seqnum_overflows"].tolist()
+        overflow_ends = columns["seqnum_overflow_ends"].tolist()
+        bitmap_start = overflow_start = 0
+        for n, count, bitmap_end, overflow_end in zip(node_list, counts, bitmap_ends, overflow_ends):
+            s = n.seqnums_received_on_root
+            s.bits = bytearray(bitmaps[bitmap_start:bitmap_end])
+            s.count = count
+            if overflow_end > overflow_start:
+                s.overflow = set(overflows[overflow_start:overflow_end])
+            bitmap_start, overflow_start = bitmap_end, overflow_end
+    return nodes, log_format
+
+# A directory of parsed log states, named by the content hash of the log.
+# An index maps each log path to its size, mtime and hash, so that an
+# unchanged log is not hashed again. The least recently used states are
+# evicted when the directory grows past its size bound.
+class ParseCache:
+    def __init__(self, directory=PARSE_CACHE_DIR, max_mb=PARSE_CACHE_MAX_MB):
+        self.directory = directory
+        self.max_bytes = max_mb * 1024 * 1024
+        self.index_file = os.path.join(directory, "index.json")
+
+    def _load_index(self):
+        try:
+            with open(self.index_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self, index):
+        tmp_file = self.index_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_file, self.index_file)
+
+    # The cache key of a log: its content hash, reused from the index while
+    # its path, size and mtime are unchanged
+    def key(self, filename):
+        path = os.path.realpath(filename)
+        st = os.stat(path)
+        index = self._load_index()
+        entry = index.get(path)
+        if entry and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+            return entry["key"]
+
+        h = hashlib.blake2b(digest_size=20)
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        key = "v{}-{}".format(PARSE_CACHE_VERSION, h.hexdigest())
+
+        os.makedirs(self.directory, exist_ok=True)
+        index[path] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "key": key}
+        self._save_index(index)
+        return key
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def load(self, key):
+        path = self._path(key)
+        try:
+            state = load_node_state(path)
+        except (OSError, ValueError, KeyError):
+            # missing, or written by an incompatible version
+            return None
+        # mark as recently used
+        os.utime(path)
+        return state
+
+    def store(self, key, nodes, log_format):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        tmp_file = path + ".tmp"
+        save_node_state(tmp_file, nodes, log_format)
+        os.replace(tmp_file, path)
+        self.evict()
+
+    # Remove the least recently used states until the cache fits its bound
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npz"):
+                st = os.stat(os.path.join(self.directory, name))
+                entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+    def clear(self):
+        if os.path.isdir(self.directory):
+            shutil.rmtree(self.directory)
+
+def analyze_results(filename, cache=None):
+    state = None
+    if cache is not None:
+        key = cache.key(filename)
+        state = cache.load(key)
+
+    if state is not None:
+        nodes, log_format = state
+        analyzer = LogAnalyzer(log_format)
+        analyzer.nodes = nodes
+    else:
+        with LogFile(filename) as f:
+            analyzer = LogAnalyzer(f.format)
+            analyzer.feed(f)
+        if cache is not None:
+            cache.store(key, analyzer.nodes, analyzer.format)
+    return analyzer.results()
+
+# Print a one-line summary of the metrics so far, and optionally write them,
+# with the per-node results, to a JSON file
+def write_snapshot(results, snapshot_file=None):
+    r, ll_par, ll_queue_dropped, e2e_pdr = results
+    rdc = sum(d["duty_cycle"] for d in r) / len(r) if r else 0.0
+    charge = sum(d["charge"] for d in r) / len(r) if r else 0.0
+    print("{} nodes={} PDR={:.2f} PAR={:.2f} ({} queue dropped) mean RDC={:.2f} mean charge={:.2f} mC".format(
+        time.strftime("%H:%M:%S"), len(r), e2e_pdr, ll_par, ll_queue_dropped, rdc, charge), flush=True)
+
+    if snapshot_file:
+        snapshot = {
+            "time": time.time(),
+            "pdr": e2e_pdr,
+            "par": ll_par,
+            "queue_dropped": ll_queue_dropped,
+            "nodes": r,
+        }
+        # replace the file atomically, so that readers never see a partial one
+        tmp_file = snapshot_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(snapshot, f, indent=2)
+        os.replace(tmp_file, snapshot_file)
+
+# Analyze a log while it grows, writing snapshot metrics periodically, until
+# interrupted. Returns the results for the log read so far.
+def follow_results(filename, snapshot_interval=FOLLOW_SNAPSHOT_SECONDS, snapshot_file=None):
+    follower = LogFollower(filename)
+    analyzer = None
+    changed = False
+    last_snapshot = time.monotonic()
+    try:
+        while True:
+            lines = follower.read()
+            if follower.restarted:
+                print("{} was truncated, restarting the analysis".format(filename), flush=True)
+                follower.restarted = False
+                analyzer = None
+                changed = False
+            # lines before the first one in a known format are not log lines
+            if lines and follower.format is not None:
+                if analyzer is None:
+                    analyzer = LogAnalyzer(follower.format)
+                analyzer.feed(lines)
+                changed = True
+
+            now = time.monotonic()
+            if changed and now - last_snapshot >= snapshot_interval:
+                write_snapshot(analyzer.results(verbose=False), snapshot_file)
+                changed = False
+                last_snapshot = now
+
+            if not lines:
+                # idle until the log grows
+                time.sleep(FOLLOW_POLL_SECONDS)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        follower.close()
+
+    if analyzer is None:
+        return [], 0.0, 0, 0.0
+    return analyzer.results()
 
 #######################################################
 # Plot the results of a given metric as a bar chart
 
-def plot(results, metric, ylabel):
+def plot(results, metric, ylabel, plot_format="pdf"):
     pl.figure(figsize=(5, 4))
 
     data = [r[metric] for r in results]
@@ -352,36 +778,120 @@ def plot(results, metric, ylabel):
     else:
         pl.ylim(ymin=0)
 
-    pl.savefig("plot_{}.pdf".format(metric), format="pdf", bbox_inches='tight')
+    filename = plot_filename(metric, plot_format)
+    pl.savefig(filename, format=plot_format, bbox_inches='tight')
     pl.close()
+    return filename
+
+def plot_filename(metric, plot_format):
+    return "plot_{}.{}".format(metric, plot_format)
+
+# The hash of everything a figure is drawn from, to tell whether it changed
+def plot_hash(results, metric, ylabel, plot_format):
+    series = [(r["id"], r[metric]) for r in results]
+    return hashlib.sha256(repr((metric, ylabel, plot_format, series)).encode()).hexdigest()
+
+# The plot cache is kept with the figures, in the current directory: the
+# directory of the log is not written to, and may be read-only
+def plot_cache_file():
+    return os.path.abspath(PLOT_CACHE_FILE)
+
+def load_plot_cache(cache_file):
+    try:
+        with open(cache_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_plot_cache(cache, cache_file):
+    tmp_file = cache_file + ".tmp"
+    try:
+        with open(tmp_file, "w") as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        # the figures are written: only the next run redraws them all
+        print("Warning: cannot save the plot cache: {}".format(e))
+
+# Plot all metrics in the given formats, rendering the figures concurrently.
+# Figures whose file exists and whose data is unchanged since it was written
+# are skipped, unless use_cache is false. The cache is kept in cache_file,
+# keyed by the absolute path of the figures.
+def plot_all(results, cache_file, plot_formats=("pdf",), jobs=None, use_cache=True):
+    cache = load_plot_cache(cache_file) if use_cache else {}
+
+    todo = []
+    for plot_format in plot_formats:
+        for metric, ylabel in PLOTS:
+            h = plot_hash(results, metric, ylabel, plot_format)
+            filename = plot_filename(metric, plot_format)
+            if cache.get(os.path.abspath(filename)) == h and os.path.exists(filename):
+                continue
+            todo.append((metric, ylabel, plot_format, h))
+
+    if todo:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [(pool.submit(plot, results, metric, ylabel, plot_format), h)
+                       for metric, ylabel, plot_format, h in todo]
+            for future, h in futures:
+                cache[os.path.abspath(future.result())] = h
+        save_plot_cache(cache, cache_file)
+
+    print("Plotted {} figures, {} unchanged".format(
+        len(todo), len(plot_formats) * len(PLOTS) - len(todo)))
 
 #######################################################
 # Run the application
 
 def main():
-    input_file = LOG_FILE
-    if len(sys.argv) > 1:
-        # change from the default
-        input_file = sys.argv[1]
-
-    if not os.access(input_file, os.R_OK):
-        print('The input file "{}" does not exist'.format(input_file))
-        exit(-1)
-
-    with open(input_file, "r") as f:
-        is_testbed = "Starting COOJA logger" not in f.read()
+    parser = argparse.ArgumentParser(description="Extract performance metrics from a Cooja or testbed log and plot them.")
+    parser.add_argument("input_file", nargs="?", default=LOG_FILE,
+                        help="log file to analyze (default: {})".format(LOG_FILE))
+    parser.add_argument("-f", "--follow", action="store_true",
+                        help="follow a log that is still being written, printing snapshot metrics periodically; "
+                        "interrupt with Ctrl-C to plot the final results")
+    parser.add_argument("--snapshot-interval", type=float, default=FOLLOW_SNAPSHOT_SECONDS,
+                        help="seconds between snapshots in follow mode (default: %(default)s)")
+    parser.add_argument("--snapshot-file",
+                        help="in follow mode, also write each snapshot with per-node metrics to this JSON file")
+    parser.add_argument("--plot-format", action="append", choices=PLOT_FORMATS,
+                        help="format of the plots; repeat for several formats (default: pdf)")
+    parser.add_argument("-j", "--jobs", type=int,
+                        help="number of plots rendered in parallel (default: number of CPUs)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="parse the log and render all plots, even if unchanged since a previous run")
+    parser.add_argument("--clear-cache", action="store_true",
+                        help="remove all parsed logs from the cache in {}".format(PARSE_CACHE_DIR))
+    parser.add_argument("--cache-size", type=int, default=PARSE_CACHE_MAX_MB,
+                        help="size bound of the parsed log cache, in MB (default: %(default)s)")
+    args = parser.parse_args()
+    input_file = args.input_file
+
+    cache = ParseCache(max_mb=args.cache_size)
+    if args.clear_cache:
+        cache.clear()
+
+    if args.follow:
+        results, ll_par, ll_queue_dropped, e2e_pdr = follow_results(
+            input_file, args.snapshot_interval, args.snapshot_file)
+        if not results:
+            return
+    else:
+        if not os.access(input_file, os.R_OK):
+            print('The input file "{}" does not exist'.format(input_file))
+            exit(-1)
 
-    results, ll_par, ll_queue_dropped, e2e_pdr = analyze_results(input_file, is_testbed)
+        try:
+            results, ll_par, ll_queue_dropped, e2e_pdr = analyze_results(
+                input_file, None if args.no_cache else cache)
+        except ValueError as e:
+            print(e)
+            exit(-1)
 
     print("Link-layer PAR={:.2f} ({} packets queue dropped) End-to-end PDR={:.2f}".format(
         ll_par, ll_queue_dropped, e2e_pdr))
 
-    plot(results, "pdr", "Packet Delivery Ratio, %")
-    plot(results, "par", "Packet Acknowledgement Ratio, %")
-    plot(results, "rpl_switches", "RPL parent switches")
-    plot(results, "duty_cycle", "Radio Duty Cycle, %")
-    plot(results, "duty_cycle_joined", "Joined Radio Duty Cycle, %")
-    plot(results, "charge", "Charge consumption, mC")
+    plot_all(results, plot_cache_file(), args.plot_format or ["pdf"], args.jobs, not args.no_cache)
 
 #######################################################
 
@@ -2,97 +2,415 @@
 
 import sys
 import os
-from subprocess import Popen, PIPE, STDOUT, CalledProcessError
+import re
+import json
+import time
+import signal
+import shutil
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from subprocess import Popen, PIPE, STDOUT, DEVNULL, TimeoutExpired
 
 # get the path of this example
 SELF_PATH = os.path.dirname(os.path.abspath(__file__))
 # move three levels up
 CONTIKI_PATH = os.path.dirname(os.path.dirname(os.path.dirname(SELF_PATH)))
 
+# the log ingestion shared by the benchmark scripts
+sys.path.insert(0, os.path.dirname(SELF_PATH))
+from contikilog import LogFollower
+
 COOJA_PATH = os.path.normpath(os.path.join(CONTIKI_PATH, "tools", "cooja"))
 cooja_input = 'cooja.csc'
 cooja_output = 'COOJA.testlog'
 
+# patterns ending a simulation as soon as they appear in Cooja's output or log:
+# by default, the test result written by the simulation script
+SUCCESS_PATTERNS = [r"^TEST OK$"]
+FAILURE_PATTERNS = [r"^TEST FAILED$"]
+
+# how many of the last lines of Cooja's output are kept, to report failures
+OUTPUT_TAIL_LINES = 200
+
+# how often the log of a running simulation is checked, in seconds
+POLL_SECONDS = 0.5
+
+# how long a terminated simulation is given to exit before it is killed
+TERMINATE_GRACE_SECONDS = 10
+
 #######################################################
-# Run a child process and get its output
+# Run a child process, watching its output
+
+# One regular expression matching any of the patterns, each grouped so that
+# its alternatives and anchors stay its own
+def compile_patterns(patterns):
+    return re.compile("|".join("(?:{})".format(pattern) for pattern in patterns))
+
+# The conditions that end a simulation early: success and failure patterns,
+# and a wall-clock budget in seconds
+class Watch:
+    def __init__(self, success=(), failure=(), budget=None):
+        self.success = compile_patterns(SUCCESS_PATTERNS + list(success))
+        self.failure = compile_patterns(FAILURE_PATTERNS + list(failure))
+        self.budget = budget
+
+    # The outcome a line shows, if any; failures take precedence
+    def check(self, line):
+        line = line.rstrip("\r\n")
+        if self.failure.search(line):
+            return "failed"
+        if self.success.search(line):
+            return "ok"
+        return None
+
+# Terminate a child started in its own session, with everything it started.
+# Killing the Gradle client makes the Gradle daemon cancel the build, which
+# stops the Cooja JVM it runs.
+def terminate(proc):
+    for sig, timeout in ((signal.SIGTERM, TERMINATE_GRACE_SECONDS), (signal.SIGKILL, None)):
+        try:
+            os.killpg(proc.pid, sig)
+        except ProcessLookupError:
+            pass
+        try:
+            proc.wait(timeout)
+            return
+        except TimeoutExpired:
+            continue
+
+# Run a simulation command, streaming its output line by line into an
+# optional file and a bounded tail, and following the Cooja log it writes.
+# The simulation is terminated as soon as a line of either shows its outcome,
+# or when its budget is exhausted. Returns the exit code, the outcome ("ok",
+# "failed", "timeout", or None if the simulation ended without showing one),
+# and the tail of the output.
+def run_simulation(args, log_file, watch=None, output_file=None):
+    watch = watch or Watch()
+    tail = deque(maxlen=OUTPUT_TAIL_LINES)
+    outcomes = []
+
+    proc = Popen(args, stdout=PIPE, stderr=STDOUT, stdin=DEVNULL, shell=True,
+                 universal_newlines=True, errors="replace", start_new_session=True)
+    out = open(output_file, "w") if output_file else None
 
-def run_subprocess(args, input_string):
-    retcode = -1
-    stdoutdata = ''
+    def read_output():
+        for line in proc.stdout:
+            tail.append(line)
+            if out is not None:
+                out.write(line)
+            outcome = watch.check(line)
+            if outcome is not None:
+                outcomes.append(outcome)
+
+    reader = threading.Thread(target=read_output, daemon=True)
+    reader.start()
+
+    follower = LogFollower(log_file)
+    deadline = time.monotonic() + watch.budget if watch.budget else None
     try:
-        proc = Popen(args, stdout=PIPE, stderr=STDOUT, stdin=PIPE, shell=True, universal_newlines=True)
-        (stdoutdata, stderrdata) = proc.communicate(input_string)
-        if not stdoutdata:
-            stdoutdata = '\n'
-        if stderrdata:
-            stdoutdata += stderrdata + '\n'
-        retcode = proc.returncode
-    except OSError as e:
-        sys.stderr.write("run_subprocess OSError:" + str(e))
-    except CalledProcessError as e:
-        sys.stderr.write("run_subprocess CalledProcessError:" + str(e))
-        retcode = e.returncode
-    except Exception as e:
-        sys.stderr.write("run_subprocess exception:" + str(e))
+        while True:
+            try:
+                proc.wait(POLL_SECONDS)
+                exited = True
+            except TimeoutExpired:
+                exited = False
+
+            lines = follower.read()
+            while lines:
+                for line in lines:
+                    outcome = watch.check(line.decode("utf-8", "replace"))
+                    if outcome is not None:
+                        outcomes.append(outcome)
+                lines = follower.read() if exited or not outcomes else []
+
+            if exited:
+                # the last line of the log may lack its newline
+                if follower.pending:
+                    outcome = watch.check(follower.pending.decode("utf-8", "replace"))
+                    if outcome is not None:
+                        outcomes.append(outcome)
+                break
+            if outcomes:
+                terminate(proc)
+                break
+            if deadline is not None and time.monotonic() > deadline:
+                outcomes.append("timeout")
+                terminate(proc)
+                break
     finally:
-        return (retcode, stdoutdata)
+        follower.close()
+        # children left behind may still hold the output open
+        reader.join(TERMINATE_GRACE_SECONDS)
+        if reader.is_alive():
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            reader.join()
+        if out is not None:
+            out.close()
+
+    return proc.returncode, (outcomes[0] if outcomes else None), "".join(tail)
 
 #############################################################
 # Run a single instance of Cooja on a given simulation script
 
-def execute_test(cooja_file):
-    # cleanup
+# The command running Cooja without GUI on a simulation script, writing its
+# log to the given directory, with the random seed of the script by default
+def cooja_command(cooja_file, logdir, seed=None):
+    filename = os.path.join(SELF_PATH, cooja_file)
+    args = [COOJA_PATH + "/gradlew --no-watch-fs --parallel --build-cache -p", COOJA_PATH,
+            "run --args='--contiki=" + CONTIKI_PATH, "--no-gui", "--logdir=" + logdir]
+    if seed is not None:
+        args.append("--random-seed=" + str(seed))
+    args.append(filename + "'")
+    return " ".join(args)
+
+def remove_output(log_file):
     try:
-        os.remove(cooja_output)
+        os.remove(log_file)
     except FileNotFoundError as ex:
         pass
+
+def execute_test(cooja_file, logdir=SELF_PATH, seed=None, watch=None):
+    log_file = os.path.join(logdir, cooja_output)
+
+    # cleanup
+    try:
+        remove_output(log_file)
     except PermissionError as ex:
         print("Cannot remove previous Cooja output:", ex)
         return False
 
-    filename = os.path.join(SELF_PATH, cooja_file)
-    args = " ".join([COOJA_PATH + "/gradlew --no-watch-fs --parallel --build-cache -p", COOJA_PATH, "run --args='--contiki=" + CONTIKI_PATH, "--no-gui", "--logdir=" + SELF_PATH, filename + "'"])
+    args = cooja_command(cooja_file, logdir, seed)
     sys.stdout.write("  Running Cooja, args={}\n".format(args))
 
-    (retcode, output) = run_subprocess(args, '')
-    if retcode != 0:
+    (retcode, outcome, output) = run_simulation(args, log_file, watch)
+    if outcome is None and retcode != 0:
         sys.stderr.write("Failed, retcode=" + str(retcode) + ", output:")
         sys.stderr.write(output)
         return False
 
     sys.stdout.write("  Checking for output...")
 
-    is_done = False
-    with open(cooja_output, "r") as f:
-        for line in f.readlines():
-            line = line.strip()
-            if line == "TEST OK":
-                sys.stdout.write(" done.\n")
-                is_done = True
-                continue
+    if outcome == "timeout":
+        sys.stdout.write("  test timed out after {} s.\n".format(watch.budget))
+        return False
 
-    if not is_done:
+    if outcome != "ok":
         sys.stdout.write("  test failed.\n")
         return False
 
+    sys.stdout.write(" done.\n")
     sys.stdout.write(" test done\n")
     return True
 
+#############################################################
+# Run a simulation script with many random seeds, concurrently
+
+# The tests/coojabatch.py module, which edits simulation scripts and runs the
+# batch daemon
+def import_coojabatch():
+    sys.path.insert(0, os.path.join(CONTIKI_PATH, "tests"))
+    import coojabatch
+    return coojabatch
+
+# Run one seed in its own log directory, keeping Cooja's output there. A script
+# given for the seed is run from a copy in the log directory, with the same
+# name and with [CONFIG_DIR] resolved, and the build directories given are
+# removed after the run.
+def execute_seed(cooja_file, seed, logdir, watch=None, script=None, build_dirs=()):
+    os.makedirs(logdir, exist_ok=True)
+    log_file = os.path.join(logdir, cooja_output)
+    remove_output(log_file)
+
+    if script is not None:
+        config_dir = os.path.dirname(os.path.abspath(cooja_file))
+        cooja_file = os.path.join(logdir, os.path.basename(cooja_file))
+        with open(cooja_file, "w") as f:
+            f.write(script.replace("[CONFIG_DIR]", config_dir))
+
+    start = time.time()
+    try:
+        (retcode, outcome, output) = run_simulation(cooja_command(cooja_file, logdir, seed), log_file, watch,
+                                                    os.path.join(logdir, "cooja.out"))
+    finally:
+        if script is not None:
+            remove_output(cooja_file)
+        for build_dir in build_dirs:
+            shutil.rmtree(build_dir, ignore_errors=True)
+
+    return {
+        "seed": seed,
+        "logdir": logdir,
+        "log": log_file,
+        "retcode": retcode,
+        "outcome": outcome,
+        "ok": outcome == "ok",
+        "seconds": round(time.time() - start, 1),
+    }
+
+# Run all seeds in one Cooja process, through the batch daemon of
+# tests/coojabatch.py, which is started if no daemon serves the socket
+def execute_seeds_batched(cooja_file, seeds, results_dir, socket_path, done):
+    coojabatch = import_coojabatch()
+    socket_path = socket_path or coojabatch.DEFAULT_SOCKET
+    coojabatch.start_daemon(socket_path)
+    with coojabatch.CoojaClient(socket_path) as client:
+        job_ids = [(seed, client.submit(cooja_file, seed, os.path.join(results_dir, "seed-{}".format(seed))))
+                   for seed in seeds]
+        for seed, job_id in job_ids:
+            result = client.wait(job_id)
+            run = {
+                "seed": seed,
+                "logdir": os.path.join(results_dir, "seed-{}".format(seed)),
+                "log": result.get("log"),
+                "retcode": result.get("retcode"),
+                "outcome": None,
+                "ok": False,
+                "seconds": result.get("batch_seconds", 0.0),
+            }
+            if "error" in result:
+                # the daemon could not run the job: the seed failed
+                run["error"] = result["error"]
+            else:
+                run["ok"] = result["ok"]
+                run["outcome"] = "ok" if result["ok"] else "failed"
+            done(run)
+
+# Run the seeds with up to `jobs` concurrent simulations, each logging to
+# results_dir/seed-<seed>, and write an aggregated report. The first seed runs
+# alone, so that Cooja is built before the concurrent runs start. The build
+# commands of a script start with `make clean`, so concurrent seeds do not
+# share a build directory: each builds its firmware in build/seed-<seed> when
+# the script names all its firmware, for Cooja to find it there. Otherwise,
+# as with Cooja motes, the first seed builds the firmware, and the others run
+# the build commands without the clean ones, only relinking the firmware.
+# With a batch daemon, all seeds run in one Cooja process instead.
+def execute_seeds(cooja_file, seeds, jobs, results_dir, watch=None, batch=False, socket_path=None):
+    runs = []
+
+    def done(run):
+        runs.append(run)
+        if run["ok"]:
+            status = "ok"
+        elif "error" in run:
+            status = "FAILED ({})".format(run["error"])
+        elif run["outcome"] is not None:
+            status = "FAILED ({})".format(run["outcome"])
+        elif run["retcode"] != 0:
+            status = "FAILED (retcode {})".format(run["retcode"])
+        else:
+            status = "FAILED (no outcome)"
+        sys.stdout.write("  [{}/{}] seed {}: {} in {:.1f} s, log in {}\n".format(
+            len(runs), len(seeds), run["seed"], status, run["seconds"], run["logdir"]))
+        sys.stdout.flush()
+
+    def logdir(seed):
+        return os.path.join(results_dir, "seed-{}".format(seed))
+
+    start = time.time()
+    if batch:
+        execute_seeds_batched(cooja_file, seeds, results_dir, socket_path, done)
+    else:
+        coojabatch = import_coojabatch()
+        with open(cooja_file) as f:
+            script = f.read()
+        private_builds = coojabatch.can_set_build_dir(script)
+        sources = coojabatch.source_dirs(script, cooja_file, CONTIKI_PATH)
+
+        def run_seed(seed, first=False):
+            if private_builds:
+                build_dir = "build/seed-{}".format(seed)
+                return execute_seed(cooja_file, seed, logdir(seed), watch, coojabatch.set_build_dir(script, build_dir),
+                                    [os.path.join(source_dir, build_dir) for source_dir in sources])
+            if first:
+                return execute_seed(cooja_file, seed, logdir(seed), watch)
+            return execute_seed(cooja_file, seed, logdir(seed), watch, coojabatch.remove_clean_commands(script))
+
+        done(run_seed(seeds[0], first=True))
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(run_seed, seed) for seed in seeds[1:]]
+            for future in as_completed(futures):
+                done(future.result())
+
+    runs.sort(key=lambda run: run["seed"])
+    report = {
+        "simulation": os.path.abspath(cooja_file),
+        "jobs": jobs,
+        "seconds": round(time.time() - start, 1),
+        "passed": sum(run["ok"] for run in runs),
+        "failed": sum(not run["ok"] for run in runs),
+        "runs": runs,
+    }
+    with open(os.path.join(results_dir, "report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+
+    sys.stdout.write("{} of {} seeds passed in {:.1f} s".format(report["passed"], len(runs), report["seconds"]))
+    if report["failed"]:
+        sys.stdout.write(", failed seeds: {}".format(" ".join(str(run["seed"]) for run in runs if not run["ok"])))
+    sys.stdout.write("\nReport in {}\n".format(os.path.join(results_dir, "report.json")))
+    return report
+
+# Parse seeds given as a comma-separated list of numbers and inclusive ranges,
+# e.g. "1-32" or "1,5,10-12"
+def parse_seeds(spec):
+    seeds = []
+    for part in spec.split(","):
+        first, _, last = part.partition("-")
+        seeds.extend(range(int(first), int(last or first) + 1))
+    if not seeds:
+        raise argparse.ArgumentTypeError("no seeds in '{}'".format(spec))
+    return seeds
+
 #######################################################
 # Run the application
 
 def main():
-    input_file = cooja_input
-    if len(sys.argv) > 1:
-        # change from the default
-        input_file = sys.argv[1]
+    parser = argparse.ArgumentParser(description="Run a Cooja simulation without GUI.")
+    parser.add_argument("input_file", nargs="?", default=cooja_input,
+                        help="simulation script (default: {})".format(cooja_input))
+    parser.add_argument("--seeds", type=parse_seeds,
+                        help="run the simulation once per random seed, e.g. 1-32 or 1,5,10-12, "
+                        "each with its log in its own directory")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="number of concurrent simulations with --seeds (default: number of CPUs)")
+    parser.add_argument("--results-dir", default="cooja-runs",
+                        help="directory of the per-seed logs and the report with --seeds (default: %(default)s)")
+    parser.add_argument("--success", action="append", default=[], metavar="REGEX",
+                        help="stop the simulation as passed when a line of its output or log matches; "
+                        "can be repeated, 'TEST OK' always counts")
+    parser.add_argument("--failure", action="append", default=[], metavar="REGEX",
+                        help="stop the simulation as failed when a line of its output or log matches; "
+                        "can be repeated, 'TEST FAILED' always counts")
+    parser.add_argument("--budget", type=float, metavar="SECONDS",
+                        help="stop the simulation as failed after this wall-clock time")
+    parser.add_argument("--batch", action="store_true",
+                        help="with --seeds, run all seeds in one Cooja process through the batch daemon of "
+                        "tests/coojabatch.py, started if needed, to pay the Gradle and JVM startup once")
+    parser.add_argument("--batch-socket", help="socket of the batch daemon (default: that of coojabatch.py)")
+    args = parser.parse_args()
+    if args.batch and not args.seeds:
+        parser.error("--batch only applies with --seeds")
+    if args.batch and (args.success or args.failure or args.budget):
+        # the daemon runs whole batches, and only checks for TEST OK
+        parser.error("--success, --failure and --budget do not apply to --batch")
+    input_file = args.input_file
+    watch = Watch(args.success, args.failure, args.budget)
 
     if not os.access(input_file, os.R_OK):
         print('Simulation script "{}" does not exist'.format(input_file))
         exit(-1)
 
     print('Using simulation script "{}"'.format(input_file))
-    if not execute_test(input_file):
+    if args.seeds:
+        report = execute_seeds(input_file, args.seeds, args.jobs, os.path.abspath(args.results_dir), watch,
+                               args.batch, args.batch_socket)
+        if report["failed"]:
+            exit(-1)
+    elif not execute_test(input_file, watch=watch):
         exit(-1)
 
 #######################################################
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+# Tests of run-analysis.py: python3 -m pytest test_run_analysis.py
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+import importlib.util
+
+SELF_PATH = os.path.dirname(os.path.abspath(__file__))
+
+spec = importlib.util.spec_from_file_location("run_analysis", os.path.join(SELF_PATH, "run-analysis.py"))
+run_analysis = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(run_analysis)
+
+# A testbed log of two nodes: node 2 sends to the root through its time source
+TESTBED_LOG = [
+    "1000.000;m3-2;[INFO: TSCH      ] association done",
+    "1000.100;m3-2;[INFO: TSCH Queue] update time source: (NULL LL addr) -> 0001.0001.0001.0001",
+    "1000.200;m3-2;[INFO: RPL       ] parent switch: (NULL IP addr) -> fe80::201:1:1:1",
+    "1001.000;m3-2;[INFO: App       ] app generate packet seqnum=1 node_id=2",
+    "1001.100;m3-1;[INFO: App       ] app receive packet seqnum=1 from=fd00::202:2:2:2",
+    "1002.000;m3-2;[INFO: App       ] app generate packet seqnum=2 node_id=2",
+    "1060.000;m3-2;[INFO: Link Stats] num packets: tx=21 ack=4 rx=0 queue_drops=200 to=0001.0001.0001.0001",
+]
+
+class TestLineEnds(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        run_analysis.node_id_to_device_id.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def analyze(self, line_end):
+        filename = os.path.join(self.directory, "log.txt")
+        with open(filename, "wb") as f:
+            f.write("".join(line + line_end for line in TESTBED_LOG).encode())
+        return run_analysis.analyze_results(filename)
+
+    def test_crlf_log(self):
+        expected = self.analyze("\n")
+        _, ll_par, ll_queue_dropped, e2e_pdr = expected
+        self.assertAlmostEqual(ll_par, 100.0 * 4 / 21)
+        self.assertEqual(ll_queue_dropped, 200)
+        self.assertEqual(e2e_pdr, 50.0)
+
+        self.assertEqual(self.analyze("\r\n"), expected)
+
+    def test_trailing_whitespace(self):
+        self.assertEqual(self.analyze(" \t\n"), self.analyze("\n"))
+
+# A clock for follow_results: each sleep advances the time, and runs the next
+# step of a script, until the script ends with an interrupt
+class ScriptedClock:
+    def __init__(self, steps):
+        self.now = 0.0
+        self.steps = list(steps)
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += 100.0
+        if not self.steps:
+            raise KeyboardInterrupt
+        self.steps.pop(0)()
+
+    strftime = staticmethod(time.strftime)
+    time = staticmethod(time.time)
+
+class TestFollow(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "log.txt")
+        self.snapshot_file = os.path.join(self.directory, "snapshot.json")
+        run_analysis.node_id_to_device_id.clear()
+        self.time = run_analysis.time
+
+    def tearDown(self):
+        run_analysis.time = self.time
+        shutil.rmtree(self.directory)
+
+    def write(self, lines):
+        with open(self.filename, "w") as f:
+            f.write("".join(line + "\n" for line in lines))
+
+    def test_truncated_log(self):
+        self.write(TESTBED_LOG)
+        # truncated to nothing while metrics are pending, then a new, shorter
+        # run: only the new run is analyzed
+        run_analysis.time = ScriptedClock([
+            lambda: self.write([]),
+            lambda: self.write(TESTBED_LOG[:4]),
+        ])
+        results, ll_par, ll_queue_dropped, e2e_pdr = run_analysis.follow_results(
+            self.filename, snapshot_interval=10.0, snapshot_file=self.snapshot_file)
+
+        self.assertEqual(ll_queue_dropped, 0)
+        self.assertEqual(e2e_pdr, 0.0)
+        self.assertEqual([d["id"] for d in results], [2])
+        with open(self.snapshot_file) as f:
+            self.assertEqual(json.load(f)["pdr"], 0.0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,6 +2,11 @@
 
 import re
 import os
+import sys
+import glob
+import json
+import argparse
+import numpy as np
 import fileinput
 import math
 import yaml
@@ -10,267 +15,691 @@ from pandas import *
 from pylab import *
 from datetime import *
 from collections import OrderedDict
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 from IPython import embed
 import matplotlib as mpl
 
+# the log ingestion shared by the benchmark scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from contikilog import read_log_events
+
 pd.set_option('display.max_rows', 48)
 pd.set_option('display.width', None)
 pd.set_option('display.max_columns', None)
 
-networkFormationTime = None
-parents = {}
-
-def calculateHops(node):
-    hops = 0
-    while(parents[node] != None):
-        node = parents[node]
-        hops += 1
-        # safeguard, in case of scrambled logs
-        if hops > 50:
-            return hops
-    return hops
-
-def calculateChildren(node):
-    children = 0
-    for n in parents.keys():
-        if(parents[n] == node):
-            children += 1
-    return children
-
-def updateTopology(child, parent):
-    global parents
-    if not child in parents:
-        parents[child] = {}
-    if not parent in parents:
-        parents[parent] = None
-    parents[child] = parent
-
-def parseRPL(log):
-    res = re.compile('.*? rank (\d*).*?dioint (\d*).*?nbr count (\d*)').match(log)
-    if res:
-        rank = int(res.group(1))
-        trickle = (2**int(res.group(2)))/(60*1000.)
-        nbrCount = int(res.group(3))
-        return {'event': 'rank', 'rank': rank, 'trickle': trickle }
-    res = re.compile('parent switch: .*? -> .*?-(\d*)$').match(log)
-    if res:
-        parent = int(res.group(1))
-        return {'event': 'switch', 'pswitch': parent }
-    res = re.compile('sending a (.+?) ').match(log)
-    if res:
-        message = res.group(1)
-        return {'event': 'sending', 'message': message }
-    res = re.compile('links: 6G-(\d+)\s*to 6G-(\d+)').match(log)
+# Requests not answered within this many seconds are accounted as lost
+defaultRequestTimeout = 60.
+
+# Width of the per-time statistics bins, in minutes
+defaultTimeBin = 2
+
+# Hop count reported for nodes whose path to the root is longer than this
+# or loops; a safeguard, in case of scrambled logs
+maxHops = 51
+
+# RPL topology as seen from the root's routing links. Child counts are kept
+# up to date as edges change, and per-node depths are memoized until the next
+# change, so that a snapshot of the whole tree costs O(n).
+class TopologyTree:
+    def __init__(self):
+        self.parents = {}
+        self.children = {}
+        self.depths = None
+        # per-node time series of (time, hops, children), one per snapshot
+        self.history = {}
+
+    def update(self, child, parent):
+        oldParent = self.parents.get(child)
+        if not child in self.parents:
+            self.parents[child] = None
+        if not parent in self.parents:
+            self.parents[parent] = None
+        if oldParent == parent:
+            return
+        if oldParent != None:
+            self.children[oldParent] -= 1
+        self.children[parent] = self.children.get(parent, 0) + 1
+        self.parents[child] = parent
+        self.depths = None
+
+    def calculateDepths(self):
+        depths = {}
+        for node in self.parents:
+            # walk up until a node of known depth, the root or a loop
+            path = []
+            onPath = set()
+            n = node
+            while not n in depths and self.parents[n] != None and not n in onPath:
+                path.append(n)
+                onPath.add(n)
+                n = self.parents[n]
+            if n in depths:
+                hops = depths[n]
+            elif self.parents[n] == None:
+                hops = depths[n] = 0
+            else:
+                hops = maxHops
+            for n in reversed(path):
+                hops = min(hops + 1, maxHops)
+                depths[n] = hops
+        return depths
+
+    def hops(self, node):
+        if self.depths == None:
+            self.depths = self.calculateDepths()
+        return self.depths[node]
+
+    def childCount(self, node):
+        return self.children.get(node, 0)
+
+    # Record the current hops and children of every node at the given time,
+    # and return them as a list of (node, hops, children)
+    def snapshot(self, time):
+        ret = []
+        for node in self.parents:
+            hops = self.hops(node)
+            children = self.childCount(node)
+            self.history.setdefault(node, []).append((time, hops, children))
+            ret.append((node, hops, children))
+        return ret
+
+    # Time series of (time, hops, children) of a node, optionally restricted
+    # to snapshots taken in [start, end)
+    def nodeHistory(self, node, start = None, end = None):
+        return [x for x in self.history.get(node, [])
+                if (start == None or x[0] >= start) and (end == None or x[0] < end)]
+
+# Compile a table of alternatives into a single pattern. Each alternative is
+# wrapped in a named group so that the match tells which event was seen;
+# alternatives are tried in order, first match wins.
+def compileAlternatives(alternatives):
+    return re.compile('|'.join(['(?P<%s>%s)' %(name, pattern) for name, pattern in alternatives]))
+
+# Match a log message against a module pattern and run the corresponding
+# event handler on the match
+def dispatch(pattern, handlers, log):
+    res = pattern.match(log)
     if res:
-        child = int(res.group(1))
-        parent = int(res.group(2))
-        updateTopology(child, parent)
-        return None
-    res = re.compile('links: end of list').match(log)
-    if res:
-        # This was the last line, commit full topology
-        return {'event': 'topology' }
-    res = re.compile('initialized DAG').match(log)
-    if res:
-        return {'event': 'DAGinit' }
+        return handlers[res.lastgroup](res)
     return None
 
+def onRank(res):
+    rank = int(res.group('rank_rank'))
+    trickle = (2**int(res.group('rank_dioint')))/(60*1000.)
+    nbrCount = int(res.group('rank_nbr'))
+    return {'event': 'rank', 'rank': rank, 'trickle': trickle }
+
+def onSwitch(res):
+    parent = int(res.group('switch_parent'))
+    return {'event': 'switch', 'pswitch': parent }
+
+def onSending(res):
+    message = res.group('sending_message')
+    return {'event': 'sending', 'message': message }
+
+def onLink(res):
+    child = int(res.group('link_child'))
+    parent = int(res.group('link_parent'))
+    return {'event': 'link', 'child': child, 'parent': parent }
+
+def onLinksEnd(res):
+    # This was the last line, commit full topology
+    return {'event': 'topology' }
+
+def onDAGInit(res):
+    return {'event': 'DAGinit' }
+
+rplPattern = compileAlternatives([
+    ('rank', r'.*? rank (?P<rank_rank>\d*).*?dioint (?P<rank_dioint>\d*).*?nbr count (?P<rank_nbr>\d*)'),
+    ('switch', r'parent switch: .*? -> .*?-(?P<switch_parent>\d*)$'),
+    ('sending', r'sending a (?P<sending_message>.+?) '),
+    ('link', r'links: 6G-(?P<link_child>\d+)\s*to 6G-(?P<link_parent>\d+)'),
+    ('linksEnd', r'links: end of list'),
+    ('DAGInit', r'initialized DAG'),
+])
+rplHandlers = {
+    'rank': onRank,
+    'switch': onSwitch,
+    'sending': onSending,
+    'link': onLink,
+    'linksEnd': onLinksEnd,
+    'DAGInit': onDAGInit,
+}
+
+def onRadioTx(res):
+    tx = float(res.group('tx_tx'))
+    total = float(res.group('tx_total'))
+    return {'channel-utilization': 100.*tx/total }
+
+def onRadioTotal(res):
+    radio = float(res.group('total_radio'))
+    total = float(res.group('total_total'))
+    return {'duty-cycle': 100.*radio/total }
+
+energestPattern = compileAlternatives([
+    ('tx', r'Radio Tx\s*:\s*(?P<tx_tx>\d*)/\s*(?P<tx_total>\d+)'),
+    ('total', r'Radio total\s*:\s*(?P<total_radio>\d*)/\s*(?P<total_total>\d+)'),
+])
+energestHandlers = {
+    'tx': onRadioTx,
+    'total': onRadioTotal,
+}
+
+def onSend(res):
+    type = res.group('send_type')
+    id = int(res.group('send_id'))
+    dest = int(res.group('send_dest'))
+    return {'event': 'send', 'type': type, 'id': id, 'node': dest }
+
+def onRecv(res):
+    type = res.group('recv_type')
+    id = int(res.group('recv_id'))
+    src = int(res.group('recv_src'))
+    return {'event': 'recv', 'type': type, 'id': id, 'src': src }
+
+appPattern = compileAlternatives([
+    ('send', r'Sending (?P<send_type>.+?) (?P<send_id>\d+) to 6G-(?P<send_dest>\d+)'),
+    ('recv', r'Received (?P<recv_type>.+?) (?P<recv_id>\d+) from 6G-(?P<recv_src>\d+)'),
+])
+appHandlers = {
+    'send': onSend,
+    'recv': onRecv,
+}
+
+def parseRPL(log):
+    return dispatch(rplPattern, rplHandlers, log)
+
 def parseEnergest(log):
-    res = re.compile('Radio Tx\s*:\s*(\d*)/\s*(\d+)').match(log)
-    if res:
-        tx = float(res.group(1))
-        total = float(res.group(2))
-        return {'channel-utilization': 100.*tx/total }
-    res = re.compile('Radio total\s*:\s*(\d*)/\s*(\d+)').match(log)
-    if res:
-        radio = float(res.group(1))
-        total = float(res.group(2))
-        return {'duty-cycle': 100.*radio/total }
-    return None
+    return dispatch(energestPattern, energestHandlers, log)
 
 def parseApp(log):
-    res = re.compile('Sending (.+?) (\d+) to 6G-(\d+)').match(log)
-    if res:
-        type = res.group(1)
-        id = int(res.group(2))
-        dest = int(res.group(3))
-        return {'event': 'send', 'type': type, 'id': id, 'node': dest }
-    res = re.compile('Received (.+?) (\d+) from 6G-(\d+)').match(log)
-    if res:
-        type = res.group(1)
-        id = int(res.group(2))
-        src = int(res.group(3))
-        return {'event': 'recv', 'type': type, 'id': id, 'src': src }
-    return None
-
-def parseLine(line):
-    res = re.compile('\s*([.\d]+)\\tID:(\d+)\\t\[(.*?):(.*?)\](.*)$').match(line)
-    if res:
-        time = float(res.group(1))
-        nodeid = int(res.group(2))
-        level = res.group(3).strip()
-        module = res.group(4).strip()
-        log = res.group(5).strip()
-        return time, nodeid, level, module, log
-    return None, None, None, None, None
-
-def doParse(file):
-    global networkFormationTime
-
-    time = None
-    lastPrintedTime = 0
-
-    arrays = {
-        "packets": [],
-        "energest": [],
-        "ranks": [],
-        "trickle": [],
-        "switches": [],
-        "DAGinits": [],
-        "topology": [],
-    }
+    return dispatch(appPattern, appHandlers, log)
+
+# Per-module message parsers, selected from the module field of each line
+moduleParsers = {
+    'App': parseApp,
+    'Energest': parseEnergest,
+    'RPL': parseRPL,
+}
+
+# Columnar storage for one series of events: one typed array per field and
+# one for the event times, so that no object is kept per event. String fields
+# are stored as codes into a per-field list of categories. Fields missing from
+# an event are stored as NaN, so they must be floats.
+class EventSeries:
+    def __init__(self, columns):
+        self.time = array('d')
+        self.columns = OrderedDict()
+        self.categories = {}
+        for name, typecode in columns:
+            if typecode == 'category':
+                self.columns[name] = array('H')
+                self.categories[name] = {}
+            else:
+                self.columns[name] = array(typecode)
+
+    def __len__(self):
+        return len(self.time)
+
+    # Append an event given as a dict of fields, and return its row number
+    def append(self, time, fields):
+        for name, column in self.columns.items():
+            value = fields.get(name, np.nan)
+            if name in self.categories:
+                value = self.categories[name].setdefault(value, len(self.categories[name]))
+            column.append(value)
+        self.time.append(time)
+        return len(self.time) - 1
+
+    def set(self, row, name, value):
+        self.columns[name][row] = value
+
+    # Build a DataFrame indexed by timestamp, optionally leaving out some rows.
+    # Timestamps are rounded to the microsecond, as timedelta does.
+    def toDataFrame(self, dropRows = ()):
+        keep = np.ones(len(self.time), dtype=bool)
+        keep[list(dropRows)] = False
+        data = OrderedDict()
+        for name, column in self.columns.items():
+            values = np.frombuffer(column, dtype=column.typecode)[keep]
+            if name in self.categories:
+                values = pd.Categorical.from_codes(values, categories=list(self.categories[name]))
+            data[name] = values
+        micros = np.round(np.frombuffer(self.time)[keep] * 1e6).astype(np.int64)
+        index = pd.TimedeltaIndex(micros.astype('timedelta64[us]'), name="timestamp")
+        return DataFrame(data, index=index)
+
+# Columns of each kind of event series
+packetColumns = [('node', 'q'), ('event', 'category'), ('type', 'category'), ('id', 'q'), ('pdr', 'd'), ('latency', 'd')]
+energestColumns = [('node', 'q'), ('channel-utilization', 'd'), ('duty-cycle', 'd')]
+rankColumns = [('node', 'q'), ('event', 'category'), ('rank', 'q'), ('trickle', 'd')]
+switchColumns = [('node', 'q'), ('event', 'category'), ('pswitch', 'q')]
+eventColumns = [('node', 'q'), ('event', 'category')]
+messageColumns = [('node', 'q'), ('event', 'category'), ('message', 'category')]
+topologyColumns = [('node', 'q'), ('event', 'category'), ('hops', 'q'), ('children', 'q')]
+
+# Retire pending requests sent more than `timeout` seconds before `now`. They
+# stay in the packet series with a PDR of 0, i.e. as lost. Requests are
+# pending in the order they were sent, so only the oldest ones are checked.
+def retireRequests(pending, now, timeout):
+    while len(pending) > 0:
+        sendTime = next(iter(pending.values()))[0]
+        if now - sendTime <= timeout:
+            break
+        pending.popitem(last=False)
+
+# Parser for one log. All parsing state lives in the parser object, so that
+# several logs can be parsed in the same interpreter.
+class LogParser:
+    def __init__(self, requestTimeout = defaultRequestTimeout):
+        self.requestTimeout = requestTimeout
+        self.networkFormationTime = None
+        self.topology = TopologyTree()
+        # Requests waiting for a response, keyed by (node, id)
+        self.pending = OrderedDict()
+        # Time of the last parsed line
+        self.time = None
+
+        self.ranks = EventSeries(rankColumns)
+        self.arrays = {
+            "packets": EventSeries(packetColumns),
+            "energest": EventSeries(energestColumns),
+            "ranks": self.ranks,
+            "trickle": self.ranks,
+            "switches": EventSeries(switchColumns),
+            "DAGinits": EventSeries(eventColumns),
+            "topology": EventSeries(topologyColumns),
+        }
 
-#    print("\nProcessing %s" %(file))
-    # Filter out non-printable chars from log file
-    os.system("cat %s | tr -dc '[:print:]\n\t' | sponge %s" %(file, file))
-    for line in open(file, 'r').readlines():
-        # match time, id, module, log; The common format for all log lines
-        time, nodeid, level, module, log = parseLine(line)
+    def parse(self, file):
+        for event in read_log_events(file):
+            self.parseEvent(event)
+        return self.dataFrames()
 
-        if time == None:
-            # malformed line
-            continue
+    # Parse one tokenized log line, as read by contikilog
+    def parseEvent(self, event):
+        time, nodeid, level, module, log = event
 
-        if time - lastPrintedTime >= 60:
-#            print("%u, "%(time / 60),end='', flush=True)
-            lastPrintedTime = time
+        self.time = time
+        # a response after the timeout must not match its request, whatever
+        # was logged in between
+        retireRequests(self.pending, time, self.requestTimeout)
 
-        entry = {
-            "timestamp": timedelta(seconds=time),
-            "node": nodeid,
-        }
+        parser = moduleParsers.get(module)
+        if parser == None:
+            # module we do not track
+            return
 
         try:
+            ret = parser(log)
+            if(ret == None):
+                return
+
+            # events may name another node, e.g. the destination of a request
+            ret.setdefault("node", nodeid)
+
             if module == "App":
-                ret = parseApp(log)
-                if(ret != None):
-                    entry.update(ret)
-                    if(ret['event'] == 'send' and ret['type'] == 'request'):
-                        # populate series of sent requests
-                        entry['pdr'] = 0.
-                        arrays["packets"].append(entry)
-                        if networkFormationTime == None:
-                            networkFormationTime = time
-                    elif(ret['event'] == 'recv' and ret['type'] == 'response'):
-                        # update sent request series with latency and PDR
-                        txElement = [x for x in arrays["packets"] if x['event']=='send' and x['id']==ret['id']][0]
-                        txElement['latency'] = time - txElement['timestamp'].seconds
-                        txElement['pdr'] = 100.
-
-            if module == "Energest":
-                ret = parseEnergest(log)
-                if(ret != None):
-                    entry.update(ret)
-                    arrays["energest"].append(entry)
-
-            if module == "RPL":
-                ret = parseRPL(log)
-                if(ret != None):
-                    entry.update(ret)
-                    if(ret['event'] == 'rank'):
-                        arrays["ranks"].append(entry)
-                        arrays["trickle"].append(entry)
-                    elif(ret['event'] == 'switch'):
-                        arrays["switches"].append(entry)
-                    elif(ret['event'] == 'DAGinit'):
-                        arrays["DAGinits"].append(entry)
-                    elif(ret['event'] == 'sending'):
-                        if not ret['message'] in arrays:
-                            arrays[ret['message']] = []
-                        arrays[ret['message']].append(entry)
-                    elif(ret['event'] == 'topology'):
-                        for n in parents.keys():
-                            nodeEntry = entry.copy()
-                            nodeEntry["node"] = n
-                            nodeEntry["hops"] = calculateHops(n)
-                            nodeEntry["children"] = calculateChildren(n)
-                            arrays["topology"].append(nodeEntry)
+                self.onAppEvent(time, ret)
+            elif module == "Energest":
+                self.arrays["energest"].append(time, ret)
+            elif module == "RPL":
+                self.onRPLEvent(time, ret)
         except: # typical exception: failed str conversion to int, due to lossy logs
-            print("Exception: %s" %(str(sys.exc_info()[0])))
-            continue
+            sys.stderr.write("Exception: %s\n" %(str(sys.exc_info()[0])))
+
+    def onAppEvent(self, time, ret):
+        packets = self.arrays["packets"]
+        if(ret['event'] == 'send' and ret['type'] == 'request'):
+            # populate series of sent requests
+            ret['pdr'] = 0.
+            row = packets.append(time, ret)
+            key = (ret['node'], ret['id'])
+            self.pending[key] = (time, row)
+            # a re-sent request is now the newest, for the oldest-first
+            # retirement
+            self.pending.move_to_end(key)
+            if self.networkFormationTime == None:
+                self.networkFormationTime = time
+        elif(ret['event'] == 'recv' and ret['type'] == 'response'):
+            # update sent request series with latency and PDR;
+            # responses to retired or unknown requests are ignored
+            sendTime, row = self.pending.pop((ret['src'], ret['id']), (None, None))
+            if row != None:
+                packets.set(row, 'latency', time - timedelta(seconds=sendTime).seconds)
+                packets.set(row, 'pdr', 100.)
+
+    def onRPLEvent(self, time, ret):
+        if(ret['event'] == 'rank'):
+            self.ranks.append(time, ret)
+        elif(ret['event'] == 'switch'):
+            self.arrays["switches"].append(time, ret)
+        elif(ret['event'] == 'DAGinit'):
+            self.arrays["DAGinits"].append(time, ret)
+        elif(ret['event'] == 'sending'):
+            if not ret['message'] in self.arrays:
+                self.arrays[ret['message']] = EventSeries(messageColumns)
+            self.arrays[ret['message']].append(time, ret)
+        elif(ret['event'] == 'link'):
+            self.topology.update(ret['child'], ret['parent'])
+        elif(ret['event'] == 'topology'):
+            for n, hops, children in self.topology.snapshot(time):
+                ret["node"] = n
+                ret["hops"] = hops
+                ret["children"] = children
+                self.arrays["topology"].append(time, ret)
+
+    # Build the frames of all non-empty series
+    def dataFrames(self):
+        # Remove packets that were still in-flight when the test stopped, i.e.
+        # unanswered but sent less than requestTimeout before the last log line
+        if self.time != None:
+            retireRequests(self.pending, self.time, self.requestTimeout)
+        inFlight = [row for sendTime, row in self.pending.values()]
+
+        # Build one frame per series; ranks and trickle share theirs
+        dfs = {}
+        frames = {}
+        for key, series in self.arrays.items():
+            if(len(series) > 0):
+                if not id(series) in frames:
+                    frames[id(series)] = series.toDataFrame(inFlight if key == "packets" else ())
+                dfs[key] = frames[id(series)]
+
+        return dfs
+
+# Metrics reported under stats, as (series, column, aggregation, name, label)
+statsMetrics = [
+    ("packets", "pdr", "mean", "Round-trip PDR (%)", None),
+    ("packets", "latency", "mean", "Round-trip latency (s)", None),
+
+    ("energest", "duty-cycle", "mean", "Radio duty cycle (%)", None),
+    ("energest", "channel-utilization", "mean", "Channel utilization (%)", None),
+
+    ("ranks", "rank", "mean", "RPL rank (ETX-128)", None),
+    ("switches", "pswitch", "count", "RPL parent switches (#)", None),
+    ("DAGinits", "event", "count", "RPL joining DAG (#)", None),
+    ("trickle", "trickle", "mean", "RPL Trickle period (min)", None),
+
+    ("DIS", "message", "count", "RPL DIS sent (#)", "rpl-dis"),
+    ("unicast-DIO", "message", "count", "RPL uDIO sent (#)", "rpl-udio"),
+    ("multicast-DIO", "message", "count", "RPL mDIO sent (#)", "rpl-mdio"),
+    ("DAO", "message", "count", "RPL DAO sent (#)", "rpl-dao"),
+    ("DAO-ACK", "message", "count", "RPL DAO-ACK sent (#)", "rpl-daoack"),
+
+    ("topology", "hops", "mean", "RPL hop count (#)", None),
+    ("topology", "children", "mean", "RPL children count (#)", None),
+]
+
+# Text format of each global statistic
+globalStatsFormats = {
+    "pdr": "%.4f",
+    "loss-rate": "%.e",
+    "packets-sent": "%u",
+    "packets-received": "%u",
+    "latency": "%.4f",
+    "duty-cycle": "%.2f",
+    "channel-utilization": "%.2f",
+    "network-formation-time": "%.2f",
+}
+
+def computeGlobalStats(dfs, networkFormationTime):
+    packets = dfs["packets"]
+    energest = dfs["energest"]
+    pdr = float(packets["pdr"].mean())
+    return {
+        "pdr": pdr,
+        "loss-rate": 1-(pdr/100),
+        "packets-sent": int(packets["pdr"].count()),
+        "packets-received": int(packets["pdr"].sum()/100),
+        "latency": float(packets["latency"].mean()),
+        "duty-cycle": float(energest["duty-cycle"].mean()),
+        "channel-utilization": float(energest["channel-utilization"].mean()),
+        "network-formation-time": networkFormationTime,
+    }
 
-#    print("")
+# Compute the per-node and per-time aggregates of all metrics. Each frame is
+# grouped once per node and once per time bin (in minutes), and all of its
+# metrics are reduced over these groupings, so that grouping cost does not grow
+# with the number of metrics.
+def computeStats(dfs, timeBin = defaultTimeBin):
+    frames = OrderedDict()
+    for key, metric, agg, name, label in statsMetrics:
+        if key in dfs:
+            label = label if label != None else metric
+            frames.setdefault(id(dfs[key]), (dfs[key], []))[1].append((label, metric, agg))
+
+    perNode = {}
+    perTime = {}
+    for df, metrics in frames.values():
+        byNode = df.groupby("node")
+        byTime = df.groupby(pd.Grouper(freq="%uMin" %(timeBin)))
+        for label, metric, agg in metrics:
+            perNode[label] = getattr(byNode[metric], agg)()
+            perTime[label] = getattr(byTime[metric], agg)()
+
+    stats = {}
+    for key, metric, agg, name, label in statsMetrics:
+        label = label if label != None else metric
+        if not label in perNode:
+            continue
+        stats[label] = {
+            "name": name,
+            "per-node": {
+                "x": [int(x) for x in perNode[label].index],
+                "y": [float(y) for y in perNode[label]],
+            },
+            "per-time": {
+                "x": list(range(0, timeBin*len(perTime[label]), timeBin)),
+                "y": [float(y) for y in perTime[label]],
+            },
+        }
+    return stats
+
+# The results in the historical YAML-like text layout
+def formatText(results):
+    lines = ["global-stats:"]
+    for key, value in results["global-stats"].items():
+        lines.append("  %s: %s" %(key, globalStatsFormats[key] %(value) if value != None else "null"))
+    lines.append("stats:")
+    for label, stat in results["stats"].items():
+        lines.append("  %s:" %(label))
+        lines.append("    name: %s" %(stat["name"]))
+        lines.append("    per-node:")
+        lines.append("      x: [%s]" %(", ".join(["%u"%x for x in stat["per-node"]["x"]])))
+        lines.append("      y: [%s]" %(', '.join(["%.4f"%(x) for x in stat["per-node"]["y"]])))
+        lines.append("    per-time:")
+        lines.append("      x: [%s]" %(", ".join(["%u"%x for x in stat["per-time"]["x"]])))
+        lines.append("      y: [%s]" %(', '.join(["%.4f"%(x) for x in stat["per-time"]["y"]]).replace("nan", "null")))
+    return "\n".join(lines) + "\n"
+
+# Replace NaN with None, recursively, for machine-readable formats
+def withoutNaN(value):
+    if isinstance(value, dict):
+        return dict((k, withoutNaN(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return [withoutNaN(v) for v in value]
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
 
-    # Remove last few packets -- might be in-flight when test stopped
-    arrays["packets"] = arrays["packets"][0:-10]
+# Parse a log and compute its results, or None if nothing was parsed
+def analyzeLog(file, requestTimeout = defaultRequestTimeout, timeBin = defaultTimeBin):
+    parser = LogParser(requestTimeout)
+    dfs = parser.parse(file)
+    if len(dfs) == 0:
+        return None
+    return {
+        "global-stats": computeGlobalStats(dfs, parser.networkFormationTime),
+        "stats": computeStats(dfs, timeBin),
+    }
 
-    dfs = {}
-    for key in arrays.keys():
-        if(len(arrays[key]) > 0):
-            df = DataFrame(arrays[key])
-            dfs[key] = df.set_index("timestamp")
+# Batch mode worker: failures are reported in the results of the run rather
+# than aborting the whole batch
+def analyzeRun(file, requestTimeout, timeBin):
+    try:
+        results = analyzeLog(file, requestTimeout, timeBin)
+    except Exception as e:
+        return {"error": "%s: %s" %(type(e).__name__, e)}
+    if results == None:
+        return {"error": "no events found"}
+    return results
+
+# Expand the command-line paths to a list of logs; directories contribute
+# their files matching pattern
+def expandLogs(paths, pattern):
+    files = []
+    for path in paths:
+        path = path.rstrip('/')
+        if os.path.isdir(path):
+            files.extend(sorted(f for f in glob.glob(os.path.join(path, pattern)) if os.path.isfile(f)))
+        else:
+            files.append(path)
+    return files
+
+# Statistics of each global metric across runs, leaving out failed runs and
+# missing values
+def aggregateRuns(runs):
+    values = OrderedDict()
+    failed = 0
+    for results in runs.values():
+        if "error" in results:
+            failed += 1
+            continue
+        for key, value in results["global-stats"].items():
+            if value != None and not math.isnan(value):
+                values.setdefault(key, []).append(value)
+
+    globalStats = {}
+    for key, v in values.items():
+        v = np.array(v, dtype=float)
+        globalStats[key] = {
+            "mean": float(v.mean()),
+            "std": float(v.std(ddof=1)) if len(v) > 1 else 0.,
+            "min": float(v.min()),
+            "max": float(v.max()),
+        }
+    return {
+        "runs": len(runs),
+        "failed": failed,
+        "global-stats": globalStats,
+    }
 
-    return dfs
+# Parse many logs across a process pool
+def analyzeBatch(files, requestTimeout = defaultRequestTimeout, timeBin = defaultTimeBin, jobs = None):
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        results = executor.map(analyzeRun, files, [requestTimeout] * len(files), [timeBin] * len(files))
+        runs = OrderedDict(zip(files, results))
+    return {
+        "runs": dict(runs),
+        "aggregate": aggregateRuns(runs),
+    }
 
-def outputStats(dfs, key, metric, agg, name, metricLabel = None):
-    if not key in dfs:
+def formatBatchText(batch):
+    lines = ["runs:"]
+    for file, results in batch["runs"].items():
+        lines.append("  %s:" %(file))
+        if "error" in results:
+            lines.append("    error: %s" %(results["error"]))
+        else:
+            lines.extend("    " + line for line in formatText(results).splitlines())
+    aggregate = batch["aggregate"]
+    lines.append("aggregate:")
+    lines.append("  runs: %u" %(aggregate["runs"]))
+    lines.append("  failed: %u" %(aggregate["failed"]))
+    lines.append("  global-stats:")
+    for key, stat in aggregate["global-stats"].items():
+        lines.append("    %s: {%s}" %(key, ", ".join(["%s: %.4f" %(k, v) for k, v in stat.items()])))
+    return "\n".join(lines) + "\n"
+
+# The results as a long table, one row per value
+def resultsTable(results):
+    rows = []
+    for key, value in results["global-stats"].items():
+        rows.append((key, None, "global", None, value))
+    for label, stat in results["stats"].items():
+        for axis in ("per-node", "per-time"):
+            for x, y in zip(stat[axis]["x"], stat[axis]["y"]):
+                rows.append((label, stat["name"], axis, x, y))
+    return DataFrame(rows, columns=["metric", "name", "axis", "x", "y"])
+
+def batchTable(batch):
+    tables = []
+    for file, results in batch["runs"].items():
+        if not "error" in results:
+            table = resultsTable(results)
+            table.insert(0, "run", file)
+            tables.append(table)
+    rows = []
+    for key, stat in batch["aggregate"]["global-stats"].items():
+        for k, v in stat.items():
+            rows.append((None, key, None, "aggregate-" + k, None, v))
+    tables.append(DataFrame(rows, columns=["run", "metric", "name", "axis", "x", "y"]))
+    return pd.concat(tables, ignore_index=True)
+
+# Write the results of one log, or of a batch when batch is set
+def writeResults(results, format, output = None, batch = False):
+    if format == "parquet":
+        if output == None:
+            sys.exit("The parquet format requires an output file")
+        (batchTable(results) if batch else resultsTable(results)).to_parquet(output)
         return
 
-    df = dfs[key]
-    perNode = getattr(df.groupby("node")[metric], agg)()
-    perTime = getattr(df.groupby([pd.Grouper(freq="2Min")])[metric], agg)()
+    if format == "text":
+        text = formatBatchText(results) if batch else formatText(results)
+    elif format == "json":
+        text = json.dumps(withoutNaN(results), indent=2) + "\n"
+    elif format == "yaml":
+        text = yaml.safe_dump(withoutNaN(results), sort_keys=False, default_flow_style=None)
 
-    print("  %s:" %(metricLabel if metricLabel != None else metric))
-    print("    name: %s" %(name))
-    print("    per-node:")
-    print("      x: [%s]" %(", ".join(["%u"%x for x in sort(df.node.unique())])))
-    print("      y: [%s]" %(', '.join(["%.4f"%(x) for x in perNode])))
-    print("    per-time:")
-    print("      x: [%s]" %(", ".join(["%u"%x for x in range(0, 2*len(df.groupby([pd.Grouper(freq="2Min")]).mean().index), 2)])))
-    print("      y: [%s]" %(', '.join(["%.4f"%(x) for x in perTime]).replace("nan", "null")))
+    if output == None:
+        sys.stdout.write(text)
+    else:
+        with open(output, "w") as f:
+            f.write(text)
+
+# An argparse type for integers of at least 1
+def positiveInt(value):
+    try:
+        n = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid integer: '{}'".format(value))
+    if n < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, not {}".format(n))
+    return n
 
 def main():
-    if len(sys.argv) < 2:
-        return
+    parser = argparse.ArgumentParser(description="Parse rpl-req-resp logs and output their statistics")
+    parser.add_argument("files", nargs="+", metavar="file",
+                        help="log file to parse; with several files or a directory, run in batch mode")
+    parser.add_argument("--request-timeout", type=float, default=defaultRequestTimeout,
+                        help="seconds after which an unanswered request is lost (default: %(default)s)")
+    parser.add_argument("--time-bin", type=positiveInt, default=defaultTimeBin,
+                        help="width of the per-time bins, in minutes (default: %(default)s)")
+    parser.add_argument("--format", choices=["text", "json", "yaml", "parquet"], default="text",
+                        help="output format (default: %(default)s)")
+    parser.add_argument("-o", "--output", help="output file (default: standard output)")
+    parser.add_argument("-j", "--jobs", type=int,
+                        help="number of logs parsed in parallel in batch mode (default: number of CPUs)")
+    parser.add_argument("--pattern", default="*.*log*",
+                        help="logs to parse in directories, in batch mode (default: %(default)s)")
+    args = parser.parse_args()
+
+    if len(args.files) == 1 and not os.path.isdir(args.files[0]):
+        # Parse the original log
+        try:
+            results = analyzeLog(args.files[0].rstrip('/'), args.request_timeout, args.time_bin)
+        except ValueError as e:
+            sys.exit(str(e))
+        if results == None:
+            return
+        writeResults(results, args.format, args.output)
     else:
-        file = sys.argv[1].rstrip('/')
-
-    # Parse the original log
-    dfs = doParse(file)
-
-    if len(dfs) == 0:
-        return
-
-    print("global-stats:")
-    print("  pdr: %.4f" %(dfs["packets"]["pdr"].mean()))
-    print("  loss-rate: %.e" %(1-(dfs["packets"]["pdr"].mean()/100)))
-    print("  packets-sent: %u" %(dfs["packets"]["pdr"].count()))
-    print("  packets-received: %u" %(dfs["packets"]["pdr"].sum()/100))
-    print("  latency: %.4f" %(dfs["packets"]["latency"].mean()))
-    print("  duty-cycle: %.2f" %(dfs["energest"]["duty-cycle"].mean()))
-    print("  channel-utilization: %.2f" %(dfs["energest"]["channel-utilization"].mean()))
-    print("  network-formation-time: %.2f" %(networkFormationTime))
-    print("stats:")
-
-    # Output relevant metrics
-    outputStats(dfs, "packets", "pdr", "mean", "Round-trip PDR (%)")
-    outputStats(dfs, "packets", "latency", "mean", "Round-trip latency (s)")
-
-    outputStats(dfs, "energest", "duty-cycle", "mean", "Radio duty cycle (%)")
-    outputStats(dfs, "energest", "channel-utilization", "mean", "Channel utilization (%)")
-
-    outputStats(dfs, "ranks", "rank", "mean", "RPL rank (ETX-128)")
-    outputStats(dfs, "switches", "pswitch", "count", "RPL parent switches (#)")
-    outputStats(dfs, "DAGinits", "event", "count", "RPL joining DAG (#)")
-    outputStats(dfs, "trickle", "trickle", "mean", "RPL Trickle period (min)")
-
-    outputStats(dfs, "DIS", "message", "count", "RPL DIS sent (#)", "rpl-dis")
-    outputStats(dfs, "unicast-DIO", "message", "count", "RPL uDIO sent (#)", "rpl-udio")
-    outputStats(dfs, "multicast-DIO", "message", "count", "RPL mDIO sent (#)", "rpl-mdio")
-    outputStats(dfs, "DAO", "message", "count", "RPL DAO sent (#)", "rpl-dao")
-    outputStats(dfs, "DAO-ACK", "message", "count", "RPL DAO-ACK sent (#)", "rpl-daoack")
-
-    outputStats(dfs, "topology", "hops", "mean", "RPL hop count (#)")
-    outputStats(dfs, "topology", "children", "mean", "RPL children count (#)")
-
-main()
+        files = expandLogs(args.files, args.pattern)
+        if len(files) == 0:
+            sys.exit("No logs to parse")
+        batch = analyzeBatch(files, args.request_timeout, args.time_bin, args.jobs)
+        writeResults(batch, args.format, args.output, batch=True)
+
+if __name__ == '__main__':
+    main()
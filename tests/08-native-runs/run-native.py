@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+# Run native unit-test binaries and check their output as it is printed.
+#
+# This is run-one.sh without the polling: the output of each binary is read
+# from its pipe, written to its .run.log, and every line is matched against
+# the assertion being waited for, so an assertion passes as soon as its line
+# is printed and the binary is stopped as soon as it is done. The tests given
+# on the command line, and the binaries of each test, run concurrently.
+#
+#   ./run-native.py 12-heapmem 13-coffee 14-sha-256
+#
+# A test is a directory with binaries in build/native/, named after
+# $TEST_PREFIX (default: test), or a single native binary. The report of each
+# test is printed, and written to <test>.testlog in the test directory (the
+# current directory for a binary), in the format of utils.sh. The exit code is
+# 1 if any test failed.
+
+import os
+import re
+import sys
+import signal
+import glob
+import time
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# The assertions on the output of each binary, in order: (name, pattern,
+# timeout in seconds)
+ASSERTIONS = [
+    ("start", "Run unit-test", 30),
+    ("run", "=check-me= DONE", 120),
+]
+
+# A line that fails the binary whenever it is printed
+FAILURE_PATTERN = "=check-me= FAILED"
+
+REPORT_NAME_WIDTH = 60
+
+#######################################################
+# Watch the output of a binary
+
+class OutputWatcher:
+    def __init__(self, stream, log_file):
+        self.lines = []
+        self.closed = False
+        self.lock = threading.Condition()
+        self.reader = threading.Thread(target=self.read, args=(stream, log_file), daemon=True)
+        self.reader.start()
+
+    def read(self, stream, log_file):
+        with open(log_file, "w") as log:
+            for line in iter(stream.readline, ""):
+                log.write(line)
+                log.flush()
+                with self.lock:
+                    self.lines.append(line)
+                    self.lock.notify_all()
+        with self.lock:
+            self.closed = True
+            self.lock.notify_all()
+
+    # Wait for a line matching pattern, from line `start` on. Returns the index
+    # of the line after it, or None on timeout or if the output ends first.
+    def wait_for(self, pattern, timeout, start=0):
+        match = re.compile(pattern).search
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            while True:
+                for i in range(start, len(self.lines)):
+                    if match(self.lines[i]):
+                        return i + 1
+                start = len(self.lines)
+                remaining = deadline - time.monotonic()
+                if self.closed or remaining <= 0:
+                    return None
+                self.lock.wait(remaining)
+
+    def contains(self, pattern):
+        match = re.compile(pattern).search
+        with self.lock:
+            return any(match(line) for line in self.lines)
+
+#######################################################
+# Run the tests
+
+def report_line(name, status):
+    return "* {:<{}}        {}".format(name + " ...", REPORT_NAME_WIDTH, status)
+
+# Run a binary and check the assertions on its output. Returns whether it
+# passed and its report lines.
+def run_binary(binary, log_file):
+    name = os.path.join(".", os.path.relpath(binary, os.path.dirname(log_file)))
+    try:
+        proc = subprocess.Popen([os.path.abspath(binary)], cwd=os.path.dirname(log_file),
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                                universal_newlines=True, errors="replace", start_new_session=True)
+    except OSError as e:
+        with open(log_file, "w") as log:
+            log.write("Cannot run {}: {}\n".format(binary, e))
+        return False, [report_line("start {}".format(name), "FAIL (0 seconds)")]
+    watcher = OutputWatcher(proc.stdout, log_file)
+    report = []
+    ok = True
+    position = 0
+    try:
+        for assertion, pattern, timeout in ASSERTIONS:
+            name_assertion = "{} {}".format(assertion, name)
+            if not ok:
+                report.append(report_line(name_assertion, "SKIP"))
+                continue
+            start = time.monotonic()
+            found = watcher.wait_for(pattern, timeout, position)
+            seconds = int(time.monotonic() - start)
+            if found is None:
+                report.append(report_line(name_assertion, "FAIL ({} seconds timeout)".format(timeout)))
+                ok = False
+            else:
+                report.append(report_line(name_assertion, "OK   ({}/{} seconds)".format(seconds, timeout)))
+                position = found
+    finally:
+        # the binary's own children would keep its output open
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        proc.wait()
+        watcher.reader.join()
+
+    check = "check {}".format(name)
+    if not ok:
+        report.append(report_line(check, "SKIP"))
+    elif watcher.contains(FAILURE_PATTERN):
+        report.append(report_line(check, "FAIL (0 seconds)"))
+        ok = False
+    else:
+        report.append(report_line(check, "OK   (0 seconds)"))
+    return ok, report
+
+# The binaries of a test, and the directory its logs go to: the test
+# directory, or the current directory for a single binary
+def test_binaries(test):
+    if os.path.isdir(test):
+        prefix = os.environ.get("TEST_PREFIX", "test")
+        return sorted(glob.glob(os.path.join(test, "build", "native", prefix + "*.native"))), test
+    return [test], "."
+
+def test_name(test):
+    name = os.path.basename(os.path.normpath(test))
+    return name[:-len(".native")] if name.endswith(".native") else name
+
+def log_name(binary):
+    return os.path.basename(binary)[:-len(".native")] + ".run.log"
+
+# Run the tests, all their binaries at once, and report each test as it ends
+def run_tests(tests, jobs):
+    print_lock = threading.Lock()
+
+    def run_test(test, futures):
+        binaries, log_dir = test_binaries(test)
+        name = test_name(test)
+        results = [future.result() for future in futures]
+        ok = bool(results) and all(passed for passed, _ in results)
+        report = ["==== {} test results ====".format(name)]
+        for _, lines in results:
+            report.extend(lines)
+        with print_lock:
+            print("-- Test {}".format(test))
+            for line in report[1:]:
+                print(line)
+            if not ok:
+                if not binaries:
+                    print("No native binaries found for {}".format(test))
+                for binary in binaries:
+                    log_file = os.path.join(log_dir, log_name(binary))
+                    print("==== {} ====".format(log_name(binary)))
+                    if os.path.exists(log_file):
+                        with open(log_file, errors="replace") as f:
+                            sys.stdout.write(f.read())
+            print("")
+            print("-- End of test")
+            result = ">>> {:<60} {}".format(name, "  TEST OK" if ok else "TEST FAIL")
+            print(result)
+            sys.stdout.flush()
+        with open(os.path.join(log_dir, name + ".testlog"), "w") as f:
+            f.write("\n".join(report + [result]) + "\n")
+        return ok
+
+    with ThreadPoolExecutor(max_workers=jobs) as binaries_pool:
+        plan = []
+        for test in tests:
+            binaries, log_dir = test_binaries(test)
+            for binary in binaries:
+                if os.path.exists(os.path.join(log_dir, log_name(binary))):
+                    os.remove(os.path.join(log_dir, log_name(binary)))
+            plan.append((test, [binaries_pool.submit(run_binary, binary, os.path.join(log_dir, log_name(binary)))
+                                for binary in binaries]))
+        with ThreadPoolExecutor(max_workers=len(plan) or 1) as tests_pool:
+            outcomes = list(tests_pool.map(lambda item: run_test(*item), plan))
+    return all(outcomes)
+
+#######################################################
+# Main
+
+def main():
+    parser = argparse.ArgumentParser(description="Run native unit-test binaries concurrently.")
+    parser.add_argument("tests", nargs="+", metavar="TEST",
+                        help="a test directory, with binaries in build/native/, or a native binary")
+    parser.add_argument("-j", "--jobs", type=int, default=max(4, os.cpu_count() or 1),
+                        help="the number of binaries run at once (default: the number of CPUs, at least 4)")
+    args = parser.parse_args()
+
+    sys.exit(0 if run_tests(args.tests, args.jobs) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,5 @@
 #!/bin/bash
 
-source ../utils.sh
-
-BIN_PREFIX=${TEST_PREFIX:-test}
-BASENAME=$(basename $1)
-
-cd ${1}
-test_init
-
-echo "-- Starting test $1"
-
-for TEST in ./build/native/${BIN_PREFIX}*.native; do
-  RUNLOG=$(basename $TEST .native).run.log
-  register_logfile $RUNLOG
-
-  # Start test in background
-  $TEST &> $RUNLOG &
-  register_last_bg_cmd
-
-  wait_log_assert "start $TEST" "Run unit-test" $RUNLOG 30
-  wait_log_assert "run $TEST" "=check-me= DONE" $RUNLOG 120
-  assert "check $TEST" "! grep -q '=check-me= FAILED' $RUNLOG"
-done
-
-do_wrap_up
+# Run the native unit tests of a test directory, checking their output as it
+# is printed; see run-native.py.
+exec ./run-native.py "$1"
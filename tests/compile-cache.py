@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+
+# Build the EXAMPLES matrix of a compile test, skipping unchanged entries.
+#
+# Makefile.compile-test cleans and rebuilds every example/target:defines entry
+# on each run. This script builds the entries the same way, one after another
+# with a parallel make, and records a fingerprint of each successful build in
+# a cache: the make arguments, the toolchain (the tools and flags make uses,
+# as set by the makefiles and the environment, with the path and version of
+# the compiler found on PATH), the build system (the Makefiles and linker
+# scripts of the tree), the files of the example directory, and the sources and
+# headers the compiler read, from the dependency files of the build. Entries
+# can also be built on parallel workers, never two of the same example
+# directory at once, as they share its build directory. An entry is skipped
+# when its fingerprint matches a successful build, and its binary sizes are
+# then taken from the cache for BINARY_SIZE_LOGFILE. The size lines are
+# followed by the example, target and defines of their entry, tab-separated,
+# for tools/footprint/footprint-db.py.
+#
+# Failed entries are appended to the summary file, in the format of
+# Makefile.compile-test, and the exit code is 0: the summary is the outcome.
+
+import os
+import re
+import sys
+import glob
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# the Contiki-NG tree this file is in
+CONTIKI_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CACHE_FILE = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+                          "contiki-ng", "compile-cache.json")
+CACHE_VERSION = 3
+
+SUMMARY_FILE = "summary"
+
+# the parts of the tree whose build files make the build system fingerprint
+BUILD_SYSTEM_DIRS = ["os", "arch"]
+BUILD_SYSTEM_FILE_RE = re.compile(r"^Makefile|\.(mk|ld|lds)$")
+
+# the files of an example directory that are inputs of its builds: the
+# binaries copied next to them are not
+EXAMPLE_FILE_RE = re.compile(r"^Makefile|\.(c|h|cpp|hpp|s|S|mk|ld|lds|csc|js|py)$")
+
+# the make goal printing the toolchain of an entry, and the make variables it
+# prints, as make sees them with the environment
+PRINT_TOOLCHAIN_GOAL = "compile-cache-print-toolchain"
+TOOLCHAIN_VARIABLES = ["CC", "LD", "AR", "OBJCOPY", "CFLAGS", "LDFLAGS"]
+TOOLCHAIN_TOOLS = ["CC", "LD", "AR", "OBJCOPY"]
+
+#######################################################
+# Fingerprints
+
+class FileHashes:
+    def __init__(self):
+        self.hashes = {}
+        self.lock = threading.Lock()
+
+    # The hash of a file, or None if it does not exist; each file is read once
+    def get(self, path):
+        with self.lock:
+            if path in self.hashes:
+                return self.hashes[path]
+        try:
+            with open(path, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+        except OSError:
+            digest = None
+        with self.lock:
+            self.hashes[path] = digest
+        return digest
+
+def hash_files(paths, hashes, root):
+    h = hashlib.sha256()
+    for path in sorted(paths):
+        h.update("{}\0{}\0".format(os.path.relpath(path, root), hashes.get(path)).encode())
+    return h.hexdigest()
+
+def walk_files(directory, skip_dirs=()):
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [d for d in dirs if d not in skip_dirs and not d.startswith(".")]
+        for name in files:
+            yield os.path.join(root, name)
+
+# The fingerprint of the build system: its build files, and the names of the C
+# files of os/ and arch/, as a module builds all the C files of its directories
+# and a new one is in no dependency file yet
+def build_system_hash(contiki, hashes):
+    paths = [path for path in glob.glob(os.path.join(contiki, "Makefile*"))]
+    sources = []
+    for directory in BUILD_SYSTEM_DIRS:
+        for path in walk_files(os.path.join(contiki, directory)):
+            if BUILD_SYSTEM_FILE_RE.search(os.path.basename(path)):
+                paths.append(path)
+            elif path.endswith(".c"):
+                sources.append(os.path.relpath(path, contiki))
+    h = hashlib.sha256(hash_files(paths, hashes, contiki).encode())
+    for source in sorted(sources):
+        h.update("{}\0".format(source).encode())
+    return h.hexdigest()
+
+# The files a build read, from the dependency files written by the compiler,
+# except for the generated ones in the build directory
+def build_dependencies(example_dir, since):
+    build_dir = os.path.join(example_dir, "build")
+    deps = set()
+    for dep_file in glob.glob(os.path.join(build_dir, "**", ".deps", "*.d"), recursive=True):
+        if os.path.getmtime(dep_file) < since:
+            continue
+        with open(dep_file) as f:
+            text = f.read().replace("\\\n", " ")
+        for line in text.splitlines():
+            _, sep, prerequisites = line.partition(": ")
+            if not sep:
+                continue
+            for path in prerequisites.split():
+                path = os.path.normpath(os.path.join(example_dir, path))
+                if not path.startswith(build_dir + os.sep):
+                    deps.add(path)
+    return deps
+
+#######################################################
+# The matrix entries
+
+class Entry:
+    def __init__(self, spec, examples_dir):
+        fields = spec.split(":")
+        self.example = os.path.dirname(fields[0])
+        self.target = os.path.basename(fields[0])
+        self.defines = fields[1:]
+        self.directory = os.path.realpath(os.path.join(examples_dir, self.example))
+        self.key = None
+        self.cached = None
+        self.ok = None
+        self.seconds = 0.0
+        self.sizes = []
+
+    def make_args(self, make_options):
+        return self.defines + ["TARGET=" + self.target] + make_options
+
+    def name(self):
+        return "{}/ {} for target {}".format(self.example, " ".join(self.defines), self.target)
+
+    def size_line(self, line):
+        return "{}\t{}/\t{}\t{}\n".format(line, self.example, self.target, " ".join(self.defines))
+
+    def summary_line(self):
+        return "{:<75} {:<40} {:<20} TEST FAIL\n".format(self.example + "/", " ".join(self.defines), self.target)
+
+class CompileCache:
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = {}
+        try:
+            with open(filename) as f:
+                data = json.load(f)
+            if data.get("version") == CACHE_VERSION:
+                self.entries = data["entries"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    # The cached build of an entry, if its dependencies are unchanged
+    def lookup(self, entry, hashes):
+        cached = self.entries.get(entry.key)
+        if cached is None:
+            return None
+        for path, digest in cached["deps"].items():
+            if hashes.get(path) != digest:
+                return None
+        return cached
+
+    def store(self, entry, deps, hashes):
+        self.entries[entry.key] = {
+            "deps": {path: hashes.get(path) for path in sorted(deps)},
+            "sizes": entry.sizes,
+            "seconds": round(entry.seconds, 1),
+            "time": int(time.time()),
+        }
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        # keep the entries other runs stored meanwhile
+        entries = CompileCache(self.filename).entries
+        entries.update(self.entries)
+        temp = "{}.{}.tmp".format(self.filename, os.getpid())
+        with open(temp, "w") as f:
+            json.dump({"version": CACHE_VERSION, "entries": entries}, f)
+        os.replace(temp, self.filename)
+
+#######################################################
+# Build the matrix
+
+class Builder:
+    def __init__(self, entries, args):
+        self.entries = entries
+        self.make = args.make
+        self.make_options = args.make_option
+        self.make_jobs = args.make_jobs
+        self.size_log = args.size_log
+        self.contiki = os.path.realpath(args.contiki)
+        self.cache = None if args.no_cache else CompileCache(args.cache)
+        self.hashes = FileHashes()
+        self.compilers = {}
+        self.busy = set()
+        self.lock = threading.Condition()
+        self.output_lock = threading.Lock()
+
+    # The version of a compiler, its first line of --version
+    def compiler_version(self, cc):
+        if not cc:
+            return ""
+        with self.lock:
+            if cc in self.compilers:
+                return self.compilers[cc]
+        try:
+            version = subprocess.run(cc.split() + ["--version"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                     universal_newlines=True, stdin=subprocess.DEVNULL).stdout
+            version = version.splitlines()[0] if version else cc
+        except OSError:
+            version = cc
+        with self.lock:
+            self.compilers[cc] = version
+        return version
+
+    # The toolchain of an entry: the values make gives the toolchain variables,
+    # the files the tools resolve to on PATH, and the compiler version
+    def toolchain(self, entry):
+        recipe = "".join("$(info {}={})".format(name, "$(" + name + ")") for name in TOOLCHAIN_VARIABLES)
+        try:
+            output = subprocess.run([self.make, "-s", "--no-print-directory", "-C", entry.directory,
+                                     "--eval", "{}: ; {}@:".format(PRINT_TOOLCHAIN_GOAL, recipe), PRINT_TOOLCHAIN_GOAL]
+                                    + entry.make_args(self.make_options),
+                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True,
+                                    stdin=subprocess.DEVNULL).stdout
+        except OSError:
+            return ""
+        # the last value of each: makefiles may print other things while read
+        values = {}
+        for line in output.splitlines():
+            name, sep, value = line.partition("=")
+            if sep and name in TOOLCHAIN_VARIABLES:
+                values[name] = value.strip()
+        parts = ["{}={}".format(name, values.get(name, "")) for name in TOOLCHAIN_VARIABLES]
+        for name in TOOLCHAIN_TOOLS:
+            tool = values.get(name, "").split()
+            path = shutil.which(tool[0]) if tool else None
+            parts.append("{}:{}".format(name, os.path.realpath(path) if path else ""))
+        parts.append(self.compiler_version(values.get("CC", "")))
+        return "\n".join(parts)
+
+    def fingerprint(self, entry, build_system):
+        h = hashlib.sha256()
+        for part in [entry.example, entry.target, self.toolchain(entry), build_system,
+                     hash_files([path for path in walk_files(entry.directory, skip_dirs=("build",))
+                                 if EXAMPLE_FILE_RE.search(os.path.basename(path))],
+                                self.hashes, entry.directory)]:
+            h.update(part.encode() + b"\0")
+        for arg in entry.make_args(self.make_options):
+            h.update(arg.encode() + b"\0")
+        return h.hexdigest()
+
+    # Clean and build an entry, as Makefile.compile-test does
+    def build(self, entry):
+        print("Building: {}".format(entry.name()))
+        sys.stdout.flush()
+        size_log = tempfile.NamedTemporaryFile(prefix="compile-cache-sizes-", delete=False)
+        size_log.close()
+        make_args = entry.make_args(self.make_options) + ["BINARY_SIZE_LOGFILE=" + size_log.name]
+        start = time.time()
+        output = subprocess.run([self.make, "-C", entry.directory] + make_args + ["clean"],
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL)
+        if output.returncode == 0:
+            build = subprocess.run([self.make, "-C", entry.directory, "-j{}".format(self.make_jobs)] + make_args,
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL)
+            output.stdout += build.stdout
+            output.returncode = build.returncode
+        entry.seconds = time.time() - start
+        entry.ok = output.returncode == 0
+        with open(size_log.name) as f:
+            entry.sizes = f.read().splitlines()
+        os.remove(size_log.name)
+        with self.output_lock:
+            sys.stdout.write(output.stdout.decode(errors="replace"))
+            sys.stdout.flush()
+        if entry.ok and self.cache is not None:
+            deps = build_dependencies(entry.directory, start - 1)
+            with self.lock:
+                self.cache.store(entry, deps, self.hashes)
+
+    # Take the next entry whose example directory is not being built: builds
+    # of the same example clean each other's files
+    def take(self, pending):
+        with self.lock:
+            while pending:
+                for i, entry in enumerate(pending):
+                    if entry.directory not in self.busy:
+                        self.busy.add(entry.directory)
+                        return pending.pop(i)
+                self.lock.wait()
+            return None
+
+    def release(self, entry):
+        with self.lock:
+            self.busy.discard(entry.directory)
+            self.lock.notify_all()
+
+    def worker(self, pending):
+        while True:
+            entry = self.take(pending)
+            if entry is None:
+                return
+            try:
+                self.build(entry)
+            finally:
+                self.release(entry)
+
+    def run(self, jobs):
+        if self.cache is not None:
+            build_system = build_system_hash(self.contiki, self.hashes)
+            with ThreadPoolExecutor(max_workers=jobs) as pool:
+                keys = list(pool.map(lambda entry: self.fingerprint(entry, build_system), self.entries))
+            for entry, key in zip(self.entries, keys):
+                entry.key = key
+                entry.cached = self.cache.lookup(entry, self.hashes)
+                if entry.cached is not None:
+                    entry.ok = True
+                    entry.sizes = entry.cached["sizes"]
+                    print("Cached: {}".format(entry.name()))
+
+        pending = [entry for entry in self.entries if entry.cached is None]
+        workers = [threading.Thread(target=self.worker, args=(pending,)) for _ in range(min(jobs, len(pending)))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        if self.cache is not None:
+            self.cache.save()
+
+def print_report(entries, jobs, seconds):
+    cached = [entry for entry in entries if entry.cached is not None]
+    built = [entry for entry in entries if entry.cached is None]
+    saved = sum(entry.cached["seconds"] for entry in cached)
+    print("Build cache: {} of {} entries cached ({:.0f}%), {:.1f} s of builds saved; "
+          "{} built in {:.1f} s on {} workers".format(
+              len(cached), len(entries), 100.0 * len(cached) / len(entries) if entries else 0.0, saved,
+              len(built), seconds, jobs))
+
+#######################################################
+# Main
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a compile test matrix, skipping unchanged entries.")
+    parser.add_argument("entries", nargs="*", metavar="ENTRY",
+                        help="an EXAMPLES entry: example/target[:VARIABLE=value...]")
+    parser.add_argument("--examples-dir", default=os.path.join(CONTIKI_PATH, "examples"),
+                        help="the directory the examples are relative to")
+    parser.add_argument("--contiki", default=CONTIKI_PATH, help="the Contiki-NG tree")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="the number of entries built at once (default: 1)")
+    parser.add_argument("--make-jobs", type=int, default=os.cpu_count() or 1,
+                        help="the make -j of each build (default: the number of CPUs)")
+    parser.add_argument("--make", default=os.environ.get("MAKE", "make"), help="the make command")
+    parser.add_argument("--make-option", action="append", default=[], metavar="OPTION",
+                        help="an option or variable passed to every build")
+    parser.add_argument("--size-log", help="the BINARY_SIZE_LOGFILE binary sizes are appended to")
+    parser.add_argument("--summary", default=SUMMARY_FILE,
+                        help="the file failed entries are appended to (default: {})".format(SUMMARY_FILE))
+    parser.add_argument("--cache", default=CACHE_FILE, help="the cache file (default: {})".format(CACHE_FILE))
+    parser.add_argument("--no-cache", action="store_true", help="build all entries, and do not record them")
+    args = parser.parse_args()
+
+    entries = [Entry(spec, args.examples_dir) for spec in args.entries]
+    jobs = max(1, args.jobs)
+    start = time.time()
+    Builder(entries, args).run(jobs)
+    seconds = time.time() - start
+
+    failed = [entry for entry in entries if not entry.ok]
+    if failed:
+        with open(args.summary, "a") as f:
+            for entry in failed:
+                f.write(entry.summary_line())
+    if args.size_log:
+        with open(args.size_log, "a") as f:
+            for entry in entries:
+                f.writelines(entry.size_line(line) for line in entry.sizes)
+    print_report(entries, jobs, seconds)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+
+# Batched Cooja simulations, served to clients over a local socket.
+#
+# Starting Cooja from Gradle costs tens of seconds of Gradle configuration and
+# JVM startup, often more than the simulation itself. Cooja runs all the
+# simulation scripts given on its command line in one JVM, so the daemon
+# collects the jobs clients submit, each a .csc script and a random seed, and
+# runs them in batches: one Cooja process per batch instead of one per job.
+# Seeds are applied through a copy of each script with its <randomseed> set,
+# as Cooja's --random-seed would apply to all the scripts of a batch; a script
+# without one gets one. A job's log is <logdir>/<script>.seed-<seed>.testlog,
+# or <logdir>/<script>.testlog without a seed.
+#
+# Scripts that build firmware from the same sources start their build commands
+# with `make clean`, and so break each other when run at once. Batches run at
+# once can give each job a private build directory instead: its build commands
+# get a BUILD_DIR under build/, and its firmware paths follow, so that jobs
+# only share sources. This only applies to scripts naming all the firmware they
+# build (see can_set_build_dir); the others build in build/ as usual.
+#
+# The protocol is one JSON object per line, answered by one JSON object:
+#   {"op": "submit", "csc": path, "seed": n, "logdir": path} -> {"job": id}
+#   {"op": "wait", "job": id}   -> the job result, once the job is done; a
+#                                  result is only returned once
+#   {"op": "status"}            -> the pending, running and done job counts
+#   {"op": "shutdown"}          -> {}, the daemon exits after running batches
+#
+# Start the daemon with `coojabatch.py serve`, or from Python with
+# start_daemon(); CoojaClient submits jobs and waits for their results.
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import socketserver
+
+# the Contiki-NG tree this file is in
+CONTIKI_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GRADLE = os.environ.get("GRADLE", os.path.join(CONTIKI_PATH, "tools", "cooja", "gradlew"))
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), "coojabatch-{}.sock".format(os.getuid()))
+
+# how long the daemon waits for more jobs after the first pending one, so that
+# jobs submitted together are run together, in seconds
+BATCH_WINDOW_SECONDS = 2.0
+
+# the largest number of scripts run by one Cooja process
+MAX_BATCH_JOBS = 64
+
+RANDOM_SEED_RE = re.compile(r"<randomseed>[^<]*</randomseed>")
+SIMULATION_RE = re.compile(r"<simulation>")
+SOURCE_RE = re.compile(r"<source[^>]*>\s*([^<]+?)\s*</source>")
+COMMANDS_RE = re.compile(r"<commands[^>]*>[^<]*</commands>")
+FIRMWARE_BUILD_RE = re.compile(r"(<firmware[^>]*>[^<]*?/)build/")
+MOTETYPE_RE = re.compile(r"<motetype>.*?</motetype>", re.DOTALL)
+PLAIN_MAKE_RE = re.compile(r"\bmake\b")
+CLEAN_GOAL_RE = re.compile(r"\bclean\b")
+
+#######################################################
+# Run batches of simulations
+
+# A simulation script with its random seed set, adding the <randomseed>
+# element if the script has none. Raises ValueError if it has no simulation.
+def set_random_seed(script, seed):
+    element = "<randomseed>{}</randomseed>".format(seed)
+    script, count = RANDOM_SEED_RE.subn(element, script)
+    if count == 0:
+        script, count = SIMULATION_RE.subn("<simulation>\n    " + element, script, count=1)
+    if count == 0:
+        raise ValueError("no <simulation> element to set the random seed in")
+    return script
+
+# A simulation script building its firmware in the given build directory,
+# relative to the directory of each source, instead of in build/
+def set_build_dir(script, build_dir):
+    make = "$(MAKE) BUILD_DIR={}".format(build_dir)
+    script = COMMANDS_RE.sub(lambda m: m.group(0).replace("$(MAKE)", make), script)
+    return FIRMWARE_BUILD_RE.sub(lambda m: m.group(1) + build_dir + "/", script)
+
+# Whether set_build_dir moves all the firmware a simulation script builds. Each
+# mote type built by make has to name its firmware under build/: nothing else
+# tells Cooja where the firmware went, as with Cooja motes, which have none.
+def can_set_build_dir(script):
+    for motetype in MOTETYPE_RE.findall(script):
+        commands = COMMANDS_RE.search(motetype)
+        if commands is None:
+            continue
+        if PLAIN_MAKE_RE.search(commands.group(0)) or not FIRMWARE_BUILD_RE.search(motetype):
+            return False
+    return True
+
+# A simulation script without the build commands cleaning the firmware, to
+# rebuild only what changed in a build directory shared with other runs
+def remove_clean_commands(script):
+    def without_clean(match):
+        element = match.group(0)
+        start, end = element.index(">") + 1, element.rindex("<")
+        lines = [line for line in element[start:end].split("\n") if not CLEAN_GOAL_RE.search(line)]
+        return element[:start] + "\n".join(lines) + element[end:]
+    return COMMANDS_RE.sub(without_clean, script)
+
+# The directories of the firmware sources of a simulation script
+def source_dirs(script, csc, contiki=CONTIKI_PATH):
+    config_dir = os.path.dirname(os.path.abspath(csc))
+    return {os.path.normpath(os.path.dirname(source.replace("[CONTIKI_DIR]", contiki)
+                                             .replace("[CONFIG_DIR]", config_dir)))
+            for source in SOURCE_RE.findall(script)}
+
+# The Cooja command running the given scripts, as in Makefile.simulation-test,
+# with the random seed of all of them overridden if a seed is given
+def cooja_command(csc_files, logdir, contiki=CONTIKI_PATH, seed=None):
+    args = "--no-gui --contiki={} --logdir={}".format(contiki, logdir)
+    if seed is not None:
+        args += " --random-seed={}".format(seed)
+    args += " " + " ".join(csc_files)
+    return [GRADLE, "--no-watch-fs", "--parallel", "--build-cache", "-p", os.path.join(contiki, "tools", "cooja"),
+            "run", "-Dslf4j.provider=ch.qos.logback.classic.spi.LogbackServiceProvider", "--args=" + args]
+
+class Job:
+    def __init__(self, job_id, csc, seed=None, logdir=None):
+        self.id = job_id
+        self.csc = os.path.abspath(csc)
+        self.seed = seed
+        self.logdir = os.path.abspath(logdir or os.path.dirname(self.csc))
+        self.result = None
+        self.done = threading.Event()
+        self.build_dirs = []
+
+    # The name of the job's copy of its script, next to the original so that
+    # the paths it refers to still resolve
+    def script_copy(self):
+        stem = os.path.splitext(os.path.basename(self.csc))[0]
+        return os.path.join(os.path.dirname(self.csc), ".{}.batch-{}.csc".format(stem, self.id))
+
+    # The name of the job's log: with the seed, if any, so that the runs of a
+    # script with several seeds do not overwrite each other's log
+    def log_name(self):
+        stem = os.path.splitext(os.path.basename(self.csc))[0]
+        if self.seed is not None:
+            stem += ".seed-{}".format(self.seed)
+        return stem + ".testlog"
+
+    def error(self, message):
+        return {"job": self.id, "csc": self.csc, "seed": self.seed, "ok": False,
+                "log": None, "retcode": None, "error": message}
+
+    # The job's private build directory, relative to its sources
+    def build_dir(self):
+        return "build/batch-{}-{}".format(os.getpid(), self.id)
+
+# Run jobs in one Cooja process, and set their results. Each job passes if its
+# log reports TEST OK. With private_builds, each job whose script names all
+# its firmware builds it in its own build directory, removed after the batch.
+def run_batch(all_jobs, contiki=CONTIKI_PATH, private_builds=False):
+    batch_dir = tempfile.mkdtemp(prefix="coojabatch-")
+    scripts = []
+    try:
+        jobs = []
+        for job in all_jobs:
+            try:
+                with open(job.csc) as f:
+                    script = f.read()
+                if job.seed is not None:
+                    script = set_random_seed(script, job.seed)
+                if private_builds and can_set_build_dir(script):
+                    job.build_dirs = [os.path.join(source_dir, job.build_dir())
+                                      for source_dir in source_dirs(script, job.csc, contiki)]
+                    script = set_build_dir(script, job.build_dir())
+            except (OSError, ValueError) as e:
+                # the job fails alone, rather than with the requested seed ignored
+                job.result = job.error("{}: {}".format(job.csc, e))
+                continue
+            with open(job.script_copy(), "w") as f:
+                f.write(script)
+            scripts.append(job.script_copy())
+            jobs.append(job)
+        if not jobs:
+            return
+
+        start = time.time()
+        with open(os.path.join(batch_dir, "cooja.out"), "w") as out:
+            try:
+                retcode = subprocess.call(cooja_command(scripts, batch_dir, contiki),
+                                          stdout=out, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL)
+            except OSError as e:
+                out.write("Cannot run Cooja: {}\n".format(e))
+                retcode = -1
+        seconds = round(time.time() - start, 1)
+        # keep Cooja's output next to the first log on failure, to investigate
+        cooja_output = os.path.join(jobs[0].logdir, "cooja-batch-{}.coojalog".format(jobs[0].id))
+
+        for job in jobs:
+            os.makedirs(job.logdir, exist_ok=True)
+            log = os.path.join(job.logdir, job.log_name())
+            batch_log = os.path.join(batch_dir, os.path.basename(job.script_copy())[:-len(".csc")] + ".testlog")
+            ok = False
+            if os.path.exists(batch_log):
+                shutil.move(batch_log, log)
+                with open(log) as f:
+                    ok = any(line.strip() == "TEST OK" for line in f)
+            job.result = {
+                "job": job.id,
+                "csc": job.csc,
+                "seed": job.seed,
+                "ok": ok,
+                "log": log if os.path.exists(log) else None,
+                "retcode": retcode,
+                "batch_jobs": len(jobs),
+                "batch_seconds": seconds,
+                "batch_start": start,
+                "cooja_output": cooja_output,
+            }
+        if retcode != 0 or not all(job.result["ok"] for job in jobs):
+            shutil.copy(os.path.join(batch_dir, "cooja.out"), cooja_output)
+        else:
+            for job in jobs:
+                job.result["cooja_output"] = None
+    finally:
+        for script in scripts:
+            try:
+                os.remove(script)
+            except OSError:
+                pass
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        for job in all_jobs:
+            for build_dir in job.build_dirs:
+                shutil.rmtree(build_dir, ignore_errors=True)
+            if job.result is None:
+                job.result = job.error("batch failed")
+            job.done.set()
+
+#######################################################
+# The daemon
+
+class CoojaDaemon:
+    def __init__(self, contiki=CONTIKI_PATH, batch_window=BATCH_WINDOW_SECONDS, max_batch=MAX_BATCH_JOBS):
+        self.contiki = contiki
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.jobs = {}
+        self.pending = []
+        self.running = 0
+        self.completed = 0
+        self.next_id = 1
+        self.lock = threading.Condition()
+        self.stopping = False
+
+    def submit(self, csc, seed=None, logdir=None):
+        with self.lock:
+            job = Job(self.next_id, csc, seed, logdir)
+            self.next_id += 1
+            self.jobs[job.id] = job
+            self.pending.append(job)
+            self.lock.notify_all()
+        return job.id
+
+    # Wait for a job, and forget it: its result is only returned once. An
+    # unknown job, or one whose result was already returned, is an error.
+    def wait(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return {"job": job_id, "ok": False, "error": "unknown job {}".format(job_id)}
+        job.done.wait()
+        with self.lock:
+            self.jobs.pop(job_id, None)
+        return job.result
+
+    def status(self):
+        with self.lock:
+            return {
+                "pending": len(self.pending),
+                "running": self.running,
+                "done": self.completed,
+            }
+
+    # Take the next batch: wait for a first job, then for the batch window to
+    # collect the jobs submitted with it
+    def next_batch(self):
+        with self.lock:
+            while not self.pending and not self.stopping:
+                self.lock.wait()
+            if not self.pending:
+                return None
+            deadline = time.monotonic() + self.batch_window
+            while len(self.pending) < self.max_batch and not self.stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.lock.wait(remaining)
+            batch, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+            self.running = len(batch)
+            return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                return
+            run_batch(batch, self.contiki)
+            with self.lock:
+                self.running = 0
+                self.completed += len(batch)
+
+    def shutdown(self):
+        with self.lock:
+            self.stopping = True
+            self.lock.notify_all()
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        daemon = self.server.cooja
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                op = request.get("op")
+                if op == "submit":
+                    response = {"job": daemon.submit(request["csc"], request.get("seed"), request.get("logdir"))}
+                elif op == "wait":
+                    response = daemon.wait(request["job"])
+                elif op == "status":
+                    response = daemon.status()
+                elif op == "shutdown":
+                    daemon.shutdown()
+                    response = {}
+                else:
+                    response = {"error": "unknown op {}".format(op)}
+            except (ValueError, KeyError, TypeError) as e:
+                response = {"error": "bad request: {}".format(e)}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+# Serve clients on a Unix socket until asked to shut down
+def serve(socket_path=DEFAULT_SOCKET, contiki=CONTIKI_PATH, batch_window=BATCH_WINDOW_SECONDS,
+          max_batch=MAX_BATCH_JOBS):
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    daemon = CoojaDaemon(contiki, batch_window, max_batch)
+    server = Server(socket_path, RequestHandler)
+    server.cooja = daemon
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        os.remove(socket_path)
+
+#######################################################
+# The client library
+
+class CoojaClient:
+    def __init__(self, socket_path=DEFAULT_SOCKET):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        self.file = self.sock.makefile("rwb")
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def request(self, **request):
+        self.file.write(json.dumps(request).encode() + b"\n")
+        self.file.flush()
+        response = json.loads(self.file.readline())
+        if "error" in response and request["op"] != "wait":
+            raise RuntimeError(response["error"])
+        return response
+
+    # Submit a simulation script, with a random seed (the script's own by
+    # default) and the directory of its log (that of the script by default)
+    def submit(self, csc, seed=None, logdir=None):
+        return self.request(op="submit", csc=os.path.abspath(csc), seed=seed,
+                            logdir=os.path.abspath(logdir) if logdir else None)["job"]
+
+    # Wait for a job; its result tells whether it passed and where its log is
+    def wait(self, job_id):
+        return self.request(op="wait", job=job_id)
+
+    # Submit (csc, seed, logdir) jobs together, so that they share a batch,
+    # and wait for all of them
+    def run_all(self, jobs):
+        job_ids = [self.submit(*job) for job in jobs]
+        return [self.wait(job_id) for job_id in job_ids]
+
+    def status(self):
+        return self.request(op="status")
+
+    def shutdown(self):
+        self.request(op="shutdown")
+
+# Start a daemon in the background unless one already serves the socket, and
+# return once it accepts clients
+def start_daemon(socket_path=DEFAULT_SOCKET, timeout=10):
+    try:
+        CoojaClient(socket_path).close()
+        return
+    except OSError:
+        pass
+    subprocess.Popen([sys.executable, os.path.abspath(__file__), "serve", "--socket", socket_path],
+                     stdin=subprocess.DEVNULL, start_new_session=True)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            CoojaClient(socket_path).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("The Cooja batch daemon did not start on {}".format(socket_path))
+
+#######################################################
+# Run the application
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Cooja simulations in batches, for clients on a local socket.")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="socket path (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="run the daemon in the foreground")
+    serve_parser.add_argument("--contiki", default=CONTIKI_PATH, help="Contiki-NG tree (default: %(default)s)")
+    serve_parser.add_argument("--batch-window", type=float, default=BATCH_WINDOW_SECONDS,
+                              help="seconds to wait for more jobs before starting a batch (default: %(default)s)")
+    serve_parser.add_argument("--max-batch", type=int, default=MAX_BATCH_JOBS,
+                              help="most scripts run by one Cooja process (default: %(default)s)")
+    run_parser = commands.add_parser("run", help="run simulation scripts through the daemon, starting it if needed")
+    run_parser.add_argument("csc", nargs="+", help="simulation scripts")
+    run_parser.add_argument("--seed", type=int, action="append",
+                            help="random seed; can be repeated to run each script with each seed")
+    run_parser.add_argument("--logdir", help="directory of the logs (default: that of each script)")
+    commands.add_parser("status", help="show the job counts of the daemon")
+    commands.add_parser("shutdown", help="stop the daemon")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.socket, args.contiki, args.batch_window, args.max_batch)
+        return
+
+    if args.command == "run":
+        start_daemon(args.socket)
+
+    with CoojaClient(args.socket) as client:
+        if args.command == "status":
+            print(json.dumps(client.status()))
+        elif args.command == "shutdown":
+            client.shutdown()
+        else:
+            seeds = args.seed or [None]
+            results = client.run_all([(csc, seed, args.logdir) for seed in seeds for csc in args.csc])
+            for result in results:
+                outcome = "OK" if result.get("ok") else "FAIL"
+                if "error" in result:
+                    outcome += " ({})".format(result["error"])
+                print("{} seed {}: {}".format(result.get("csc"), result.get("seed"), outcome))
+            if not all(result.get("ok") for result in results):
+                exit(1)
+
+#######################################################
+
+if __name__ == '__main__':
+    main()
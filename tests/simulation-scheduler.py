@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+
+# Run the Cooja simulation tests of a directory in parallel batches.
+#
+# Each test script is run once per random seed, as in Makefile.simulation-test.
+# The script x seed runs are split into one batch per worker, longest first
+# onto the least loaded batch, so that the long tests (the 31-hop multicast,
+# the Orchestra variants) are spread over the workers instead of being the
+# tail of the run. Each batch is one Cooja process, run by coojabatch.py, so
+# Gradle and the JVM start once per worker rather than once per run.
+#
+# Durations are estimated from a history of earlier runs, kept in a JSON file
+# next to the tests; tests without history are estimated from their TIMEOUT
+# and number of motes. Each run of a test naming all its firmware builds it in a
+# build directory of its own, so that it runs at the same time as the tests
+# built from the same sources. The other tests, such as those of Cooja motes,
+# build in the shared build directory of their sources, so the runs of tests
+# sharing sources go to the same batch, to run one after another.
+#
+# Failed runs are appended to the summary file as "TEST FAIL: <test> seed <n>",
+# as the Makefile did, and the exit code is 0 unless the scheduler itself
+# fails: the summary file is the outcome.
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+import subprocess
+
+from coojabatch import CONTIKI_PATH, GRADLE, Job, can_set_build_dir, run_batch, source_dirs
+
+HISTORY_FILE = ".simulation-durations.json"
+
+# weight of the latest duration of a test in its estimate
+HISTORY_WEIGHT = 0.5
+
+SUMMARY_FILE = "summary"
+
+# Cooja's timeout for scripts without TIMEOUT(), in simulated milliseconds
+DEFAULT_TIMEOUT_MS = 20 * 60 * 1000
+
+TIMEOUT_RE = re.compile(r"TIMEOUT\((\d+)")
+MOTE_RE = re.compile(r"<mote>")
+
+#######################################################
+# The runs and their durations
+
+class Run:
+    def __init__(self, csc, seed, estimate, shared_dirs=()):
+        self.csc = csc
+        self.seed = seed
+        self.estimate = estimate
+        # the source directories the run builds in, shared with other runs
+        self.shared_dirs = set(shared_dirs)
+        self.seconds = None
+        self.ok = False
+        self.log = None
+        self.cooja_output = None
+
+    def name(self):
+        return "{} seed {}".format(self.csc, self.seed)
+
+# A duration proxy for tests never run: simulated time times motes
+def test_cost(script):
+    timeouts = TIMEOUT_RE.findall(script)
+    timeout = int(timeouts[0]) if timeouts else DEFAULT_TIMEOUT_MS
+    return timeout / 1000 * max(1, len(MOTE_RE.findall(script)))
+
+def load_history(filename):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_history(history, filename):
+    temp = filename + ".tmp"
+    with open(temp, "w") as f:
+        json.dump(history, f, indent=2, sort_keys=True)
+    os.replace(temp, filename)
+
+def update_history(history, runs):
+    for run in runs:
+        # only passed runs: failures may stop early or run into a timeout
+        if not run.ok:
+            continue
+        entry = history.setdefault(os.path.basename(run.csc), {"seconds": run.seconds, "runs": 0})
+        entry["seconds"] = round(HISTORY_WEIGHT * run.seconds + (1 - HISTORY_WEIGHT) * entry["seconds"], 1)
+        entry["runs"] += 1
+
+# Expand the tests x seeds matrix, with the estimated duration of each run.
+# Tests without history are estimated from their cost, scaled by the median
+# seconds per cost of the tests with history.
+def plan_runs(tests, seeds, history, contiki=CONTIKI_PATH):
+    scripts = {}
+    for csc in tests:
+        with open(csc) as f:
+            scripts[csc] = f.read()
+    known = {csc: history[os.path.basename(csc)]["seconds"]
+             for csc in tests if os.path.basename(csc) in history}
+    ratios = sorted(known[csc] / test_cost(scripts[csc]) for csc in known)
+    scale = ratios[len(ratios) // 2] if ratios else 1.0
+
+    runs = []
+    for csc in tests:
+        estimate = known.get(csc, test_cost(scripts[csc]) * scale)
+        shared_dirs = () if can_set_build_dir(scripts[csc]) else source_dirs(scripts[csc], csc, contiki)
+        runs.extend(Run(csc, seed, estimate, shared_dirs) for seed in seeds)
+    # longest first; the seed keeps the order of equal runs stable
+    runs.sort(key=lambda run: (-run.estimate, run.csc, run.seed))
+    return runs
+
+# Group the runs building in a shared directory: runs with a shared source
+# directory in common, directly or through other runs, are in the same group
+def group_runs(runs):
+    groups = []
+    for run in runs:
+        merged = [group for group in groups if group[0] & run.shared_dirs]
+        dirs, members = set(run.shared_dirs), []
+        for group in merged:
+            groups.remove(group)
+            dirs |= group[0]
+            members.extend(group[1])
+        groups.append((dirs, members + [run]))
+    return [members for _, members in groups]
+
+# Split the runs into batches of about the same estimated duration, keeping
+# each group of runs building in a shared directory in one batch. The groups,
+# longest first, each go to the batch with the least work so far.
+def plan_batches(runs, count):
+    groups = sorted(group_runs(runs), key=lambda group: -sum(run.estimate for run in group))
+    batches = [[] for _ in range(count)]
+    loads = [0.0] * count
+    for group in groups:
+        i = loads.index(min(loads))
+        batches[i].extend(group)
+        loads[i] += sum(run.estimate for run in group)
+    return [batch for batch in batches if batch]
+
+#######################################################
+# Run the simulations
+
+class Scheduler:
+    def __init__(self, batches, contiki):
+        self.batches = batches
+        self.total = sum(len(batch) for batch in batches)
+        self.contiki = contiki
+        self.finished = []
+        self.lock = threading.Lock()
+
+    # Run a batch in one Cooja process. Its runs are simulated one after
+    # another, each ending when its log is last written, so the duration of a
+    # run is from the end of the previous one, building included.
+    def execute(self, batch, first_id):
+        jobs = [Job(first_id + i, run.csc, run.seed) for i, run in enumerate(batch)]
+        run_batch(jobs, self.contiki, private_builds=True)
+        previous = None
+        for run, job in zip(batch, jobs):
+            result = job.result
+            if previous is None:
+                previous = result.get("batch_start", time.time())
+            run.ok = result["ok"]
+            run.log = result["log"]
+            run.cooja_output = result.get("cooja_output")
+            end = os.path.getmtime(run.log) if run.log else previous
+            run.seconds = max(0.0, end - previous)
+            previous = max(previous, end)
+        self.report(batch, jobs)
+
+    def report(self, batch, jobs):
+        with self.lock:
+            outputs = []
+            for run, job in zip(batch, jobs):
+                self.finished.append(run)
+                if run.ok:
+                    status = "OK"
+                else:
+                    status = "FAIL ({})".format(job.result.get("error") or "no TEST OK in {}".format(run.log))
+                    if run.cooja_output and run.cooja_output not in outputs:
+                        outputs.append(run.cooja_output)
+                print("[{}/{}] {}: {} in {:.1f} s".format(len(self.finished), self.total, run.name(), status,
+                                                          run.seconds))
+            for output in outputs:
+                print("Cooja output of the batch, kept in {}:".format(output))
+                with open(output) as f:
+                    sys.stdout.write(f.read())
+            sys.stdout.flush()
+
+    def run(self):
+        workers = []
+        first_id = 1
+        for batch in self.batches:
+            workers.append(threading.Thread(target=self.execute, args=(batch, first_id)))
+            first_id += len(batch)
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return self.finished
+
+# Build Cooja once before the concurrent batches, instead of in all of them at once
+def build_cooja(contiki):
+    print("Building Cooja")
+    sys.stdout.flush()
+    subprocess.call([GRADLE, "--no-watch-fs", "--parallel", "--build-cache",
+                     "-p", os.path.join(contiki, "tools", "cooja"), "classes"], stdin=subprocess.DEVNULL)
+
+def print_timing(runs, batches, seconds):
+    print("========== Timing ==========")
+    for run in sorted(runs, key=lambda run: -run.seconds):
+        print("{:8.1f} s  {}{}".format(run.seconds, run.name(), "" if run.ok else "  (FAIL)"))
+    busy = sum(run.seconds for run in runs)
+    print("{} simulations in {:.1f} s in {} Cooja processes; {:.1f} s one after another, speedup {:.2f}x".format(
+        len(runs), seconds, batches, busy, busy / seconds if seconds else 1.0))
+
+#######################################################
+# Main
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Cooja simulation tests in parallel batches, longest first.")
+    parser.add_argument("tests", nargs="+", metavar="CSC", help="simulation scripts to run")
+    parser.add_argument("--base-seed", type=int, default=1, help="the first random seed (default: 1)")
+    parser.add_argument("--run-count", type=int, default=1, help="the number of seeds each test runs with (default: 1)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="the number of Cooja processes run at once (default: the number of CPUs)")
+    parser.add_argument("--contiki", default=CONTIKI_PATH, help="the Contiki-NG tree")
+    parser.add_argument("--history", default=HISTORY_FILE,
+                        help="the file of test durations (default: {})".format(HISTORY_FILE))
+    parser.add_argument("--summary", default=SUMMARY_FILE,
+                        help="the file failed runs are appended to (default: {})".format(SUMMARY_FILE))
+    args = parser.parse_args()
+
+    contiki = os.path.realpath(args.contiki)
+    seeds = range(args.base_seed, args.base_seed + args.run_count)
+    history = load_history(args.history)
+    runs = plan_runs(args.tests, seeds, history, contiki)
+    batches = plan_batches(runs, max(1, args.jobs))
+
+    start = time.time()
+    if len(batches) > 1:
+        build_cooja(contiki)
+    runs = Scheduler(batches, contiki).run()
+    seconds = time.time() - start
+
+    failed = sorted((run for run in runs if not run.ok), key=lambda run: (run.csc, run.seed))
+    if failed:
+        with open(args.summary, "a") as f:
+            for run in failed:
+                f.write("TEST FAIL: {}\n".format(run.name()))
+
+    update_history(history, runs)
+    save_history(history, args.history)
+    print_timing(runs, len(batches), seconds)
+
+if __name__ == "__main__":
+    main()
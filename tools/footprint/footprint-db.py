@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+# A database of firmware footprints, fed from BINARY_SIZE_LOGFILE size logs.
+#
+# The compile tests write the `size` output of every binary they build to
+# BINARY_SIZE_LOGFILE. This tool keeps those sizes in SQLite, one build per
+# ingested log, keyed by commit, example, target and defines, and compares
+# the text, data and bss sections of any two builds:
+#
+#   make -C tests/01-compile-base BINARY_SIZE_LOGFILE=$PWD/sizes.log
+#   ./footprint-db.py ingest sizes.log              # as a build of HEAD
+#   ./footprint-db.py builds
+#   ./footprint-db.py diff develop HEAD --threshold 64
+#
+# Builds are named by commit (a prefix is enough, and git revisions such as
+# HEAD are resolved), a commit naming its latest build, or by build id as #id.
+# diff exits with 1 when a section grows beyond the thresholds, so that it
+# can fail a CI job.
+#
+# Size lines written by tests/compile-cache.py carry the example, target and
+# defines of their binary. Plain `size` lines name their binary from the
+# Contiki-NG root, <example>/build/<target>/..., and are keyed by the example
+# and target of that path. A log with the same key twice, such as a binary
+# built with different defines by plain make, keeps the last size and warns.
+
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import subprocess
+
+DEFAULT_DB = os.path.join(os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share"),
+                          "contiki-ng", "footprint.db")
+
+SECTIONS = ["text", "data", "bss"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS builds (
+    id INTEGER PRIMARY KEY,
+    commit_id TEXT NOT NULL,
+    label TEXT NOT NULL,
+    time INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sizes (
+    build INTEGER NOT NULL REFERENCES builds(id) ON DELETE CASCADE,
+    example TEXT NOT NULL,
+    target TEXT NOT NULL,
+    defines TEXT NOT NULL,
+    binary TEXT NOT NULL,
+    text INTEGER NOT NULL,
+    data INTEGER NOT NULL,
+    bss INTEGER NOT NULL,
+    PRIMARY KEY (build, example, target, defines, binary)
+);
+CREATE INDEX IF NOT EXISTS builds_commit ON builds(commit_id);
+CREATE INDEX IF NOT EXISTS sizes_key ON sizes(example, target, defines, binary);
+"""
+
+#######################################################
+# The database
+
+def open_db(filename):
+    directory = os.path.dirname(os.path.abspath(filename))
+    os.makedirs(directory, exist_ok=True)
+    db = sqlite3.connect(filename)
+    db.execute("PRAGMA foreign_keys = ON")
+    db.executescript(SCHEMA)
+    return db
+
+# A line of a size log: `size` output (text, data, bss, dec, hex, filename),
+# optionally followed by the tab-separated example, target and defines of the
+# binary. Returns None for other lines, such as the `size` header.
+def parse_size_line(line):
+    fields = [field.strip() for field in line.rstrip("\n").split("\t")]
+    if len(fields) < 6:
+        fields = line.split()
+        if len(fields) != 6:
+            return None
+    try:
+        text, data, bss = (int(field) for field in fields[:3])
+    except ValueError:
+        return None
+    binary = fields[5]
+    example, target, defines = (fields[6:9] + ["", "", ""])[:3]
+    if not target:
+        # [<example>/]build/<target>[/<board>]/<binary>
+        parts = binary.split("/")
+        builds = [i for i, part in enumerate(parts[:-2]) if part == "build"]
+        if builds:
+            target = parts[builds[-1] + 1]
+            if not example and builds[-1]:
+                example = "/".join(parts[:builds[-1]]) + "/"
+    return (example, target, defines, binary, text, data, bss)
+
+def git_commit(revision):
+    try:
+        return subprocess.run(["git", "rev-parse", "--verify", "--quiet", revision + "^{commit}"],
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              universal_newlines=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def ingest(db, log_file, commit, label):
+    with open(log_file) as f:
+        rows = [row for row in (parse_size_line(line) for line in f) if row is not None]
+    counts = {}
+    for row in rows:
+        counts[row[:4]] = counts.get(row[:4], 0) + 1
+    for key, count in sorted(counts.items()):
+        if count > 1:
+            print("Warning: {}: {} is in the log {} times, keeping its last size".format(
+                log_file, key_name(key), count), file=sys.stderr)
+    with db:
+        build = db.execute("INSERT INTO builds (commit_id, label, time) VALUES (?, ?, ?)",
+                           (commit, label, int(time.time()))).lastrowid
+        # a binary built twice with the same key: the last size wins
+        db.executemany("INSERT OR REPLACE INTO sizes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                       [(build,) + row for row in rows])
+    return build, len(counts)
+
+# The build id a name refers to: #<build id>, or the latest build of a commit
+# given by a prefix of its hash or a git revision
+def resolve_build(db, name):
+    if name.startswith("#"):
+        row = db.execute("SELECT id FROM builds WHERE id = ?", (name[1:],)).fetchone() \
+            if name[1:].isdigit() else None
+        if row:
+            return row[0]
+        sys.exit("No build {}".format(name))
+    for commit in [name, git_commit(name)]:
+        if not commit:
+            continue
+        row = db.execute("SELECT id FROM builds WHERE commit_id LIKE ? ORDER BY time DESC, id DESC LIMIT 1",
+                         (commit + "%",)).fetchone()
+        if row:
+            return row[0]
+    sys.exit("No build matches {}".format(name))
+
+def build_sizes(db, build):
+    return {row[:4]: row[4:] for row in db.execute(
+        "SELECT example, target, defines, binary, text, data, bss FROM sizes WHERE build = ?", (build,))}
+
+#######################################################
+# Compare builds
+
+def key_name(key):
+    example, target, defines, binary = key
+    name = " ".join(part for part in [example, defines] if part)
+    return "{} [{}] {}".format(name, target, os.path.basename(binary)) if name else binary
+
+def format_delta(old, new):
+    delta = new - old
+    if not delta:
+        return "0"
+    return "{:+d} ({:+.1f}%)".format(delta, 100.0 * delta / old) if old else "{:+d}".format(delta)
+
+# A section grows beyond the thresholds: by more than `threshold` bytes and
+# more than `threshold_percent` percent
+def is_regression(old, new, threshold, threshold_percent):
+    delta = new - old
+    return delta > threshold and (not old or 100.0 * delta / old > threshold_percent)
+
+def diff(db, old_build, new_build, threshold, threshold_percent, show_all):
+    old, new = build_sizes(db, old_build), build_sizes(db, new_build)
+    regressions = 0
+    rows = []
+    for key in sorted(set(old) & set(new)):
+        flagged = [section for section, o, n in zip(SECTIONS, old[key], new[key])
+                   if is_regression(o, n, threshold, threshold_percent)]
+        regressions += bool(flagged)
+        if flagged or show_all or old[key] != new[key]:
+            rows.append([key_name(key)] + [format_delta(o, n) for o, n in zip(old[key], new[key])]
+                        + ["REGRESSION: " + ",".join(flagged) if flagged else ""])
+
+    if rows:
+        widths = [max(len(row[i]) for row in rows + [["binary"] + SECTIONS]) for i in range(4)]
+        print("  ".join(title.ljust(width) for title, width in zip(["binary"] + SECTIONS, widths)).rstrip())
+        for row in rows:
+            print(("  ".join(field.ljust(width) for field, width in zip(row, widths)) + "  " + row[4]).rstrip())
+    for key in sorted(set(new) - set(old)):
+        print("new: {} ({})".format(key_name(key), ", ".join(
+            "{} {}".format(section, size) for section, size in zip(SECTIONS, new[key]))))
+    for key in sorted(set(old) - set(new)):
+        print("removed: {}".format(key_name(key)))
+
+    total_old = [sum(sizes[i] for key, sizes in old.items() if key in new) for i in range(3)]
+    total_new = [sum(sizes[i] for key, sizes in new.items() if key in old) for i in range(3)]
+    print("{} binaries in both builds; total {}; {} regressions".format(
+        len(set(old) & set(new)),
+        ", ".join("{} {}".format(section, format_delta(o, n)) for section, o, n in zip(SECTIONS, total_old, total_new)),
+        regressions))
+    return regressions
+
+#######################################################
+# Main
+
+def main():
+    parser = argparse.ArgumentParser(description="Firmware footprint database, fed from BINARY_SIZE_LOGFILE logs.")
+    parser.add_argument("--db", default=DEFAULT_DB, help="the database file (default: {})".format(DEFAULT_DB))
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    ingest_parser = commands.add_parser("ingest", help="store a size log as a build")
+    ingest_parser.add_argument("log", help="a BINARY_SIZE_LOGFILE")
+    ingest_parser.add_argument("--commit", default="HEAD", help="the commit of the build (default: HEAD)")
+    ingest_parser.add_argument("--label", default="", help="a label for the build, such as the test it is from")
+
+    builds_parser = commands.add_parser("builds", help="list the builds")
+    builds_parser.add_argument("-n", type=int, default=20, help="the number of builds listed (default: 20)")
+
+    diff_parser = commands.add_parser("diff", help="compare the sections of two builds")
+    diff_parser.add_argument("old", help="the reference build: a commit, or a build id as #id")
+    diff_parser.add_argument("new", help="the build compared to it")
+    diff_parser.add_argument("--threshold", type=int, default=0,
+                             help="flag sections growing by more bytes than this (default: 0)")
+    diff_parser.add_argument("--threshold-percent", type=float, default=0.0,
+                             help="and by more than this percentage (default: 0)")
+    diff_parser.add_argument("--all", action="store_true", help="also list the unchanged binaries")
+    args = parser.parse_args()
+
+    db = open_db(args.db)
+    if args.command == "ingest":
+        commit = git_commit(args.commit) or args.commit
+        build, count = ingest(db, args.log, commit, args.label)
+        print("Build {}: {} binaries of commit {}".format(build, count, commit[:12]))
+    elif args.command == "builds":
+        for build, commit, label, when, count in db.execute(
+                "SELECT id, commit_id, label, time, (SELECT COUNT(*) FROM sizes WHERE build = builds.id) "
+                "FROM builds ORDER BY id DESC LIMIT ?", (args.n,)):
+            print("{:5}  {}  {}  {:4} binaries  {}".format(
+                build, commit[:12], time.strftime("%Y-%m-%d %H:%M", time.localtime(when)), count, label))
+    elif args.command == "diff":
+        regressions = diff(db, resolve_build(db, args.old), resolve_build(db, args.new),
+                           args.threshold, args.threshold_percent, args.all)
+        sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,17 @@
 # Sphinx extension that builds Contiki-NG documentation and copies it over to
 # the sphinx build dir
+#
+# Doxygen runs in the background from the start of the sphinx build, and is
+# skipped when a fingerprint of its inputs matches that of the API docs
+# already in the sphinx build dir.
+import fnmatch
+import hashlib
+import os
+import shutil
+import signal
 import subprocess
+import tempfile
+import threading
 from sphinx.util import logging
 logger = logging.getLogger(__name__)
 
@@ -12,44 +23,181 @@ api_doc_defaults = {
     'doxygen_build': True,
 }
 
+# Doxygen inputs, relative to the Contiki-NG root, and the files it reads
+# from them. Keep in sync with INPUT, FILE_PATTERNS and EXAMPLE_PATH in the
+# Doxyfile.
+api_doc_inputs = ('arch', 'os', 'examples/hello-world')
+api_doc_input_patterns = ('*.h', '*.c', '*.doc.html', 'doxygen*.txt')
 
-def api_doc_build(app, exception):
-    if exception is not None:
-        logger.warning('%s exiting without building' % (__name__,))
+# Shipped over the doxygen output, see api_doc_install
+api_doc_extra_js = 'js/dynsections.js'
+
+api_doc_fingerprint_file = '.fingerprint'
+
+
+def api_doc_path(app, path):
+    return os.path.join(app.confdir, path)
+
+
+def api_doc_hash_tree(h, top, patterns=None, skip=()):
+    for root, dirs, files in os.walk(top):
+        dirs[:] = sorted(d for d in dirs
+                         if os.path.join(root, d) not in skip)
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if path in skip or (patterns is not None and
+                                not any(fnmatch.fnmatch(name, p)
+                                        for p in patterns)):
+                continue
+            h.update(os.path.relpath(path, top).encode() + b'\0')
+            with open(path, 'rb') as f:
+                h.update(hashlib.sha256(f.read()).digest())
+
+
+# A fingerprint of everything the doxygen output depends on: the doxygen
+# version, the doxygen directory (Doxyfile, layout, pages), the sources and
+# the javascript shipped over the output
+def api_doc_fingerprint(app):
+    src_dir = api_doc_path(app, app.config.api_doc_doxygen_src_dir)
+    docroot = os.path.join(src_dir, '..', '..')
+    h = hashlib.sha256()
+
+    try:
+        h.update(subprocess.run(['doxygen', '--version'],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL).stdout)
+    except OSError:
+        pass
+
+    api_doc_hash_tree(h, src_dir, skip=(
+        os.path.join(src_dir, app.config.api_doc_doxygen_out_dir),
+        os.path.join(src_dir, 'doxygen.log')))
+    for input_dir in api_doc_inputs:
+        h.update(input_dir.encode() + b'\0')
+        api_doc_hash_tree(h, os.path.join(docroot, input_dir),
+                          api_doc_input_patterns)
+    with open(api_doc_path(app, api_doc_extra_js), 'rb') as f:
+        h.update(f.read())
+    return h.hexdigest()
+
+
+def api_doc_static_api_dir(app):
+    return os.path.join(app.outdir, '_api')
+
+
+def api_doc_cached_fingerprint(app):
+    try:
+        with open(os.path.join(api_doc_static_api_dir(app),
+                               api_doc_fingerprint_file)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+# Runs in the background while sphinx builds: fingerprints the inputs, and
+# runs doxygen unless the API docs in the build dir are up to date
+def api_doc_doxygen(app, state):
+    try:
+        state['fingerprint'] = api_doc_fingerprint(app)
+    except OSError as e:
+        logger.warning('%s cannot fingerprint the doxygen inputs: %s'
+                       % (__name__, e))
         return
+    if state['fingerprint'] == api_doc_cached_fingerprint(app):
+        logger.info('%s API docs are up to date, not running doxygen'
+                    % (__name__,))
+        return
+
+    src_dir = api_doc_path(app, app.config.api_doc_doxygen_src_dir)
+    logger.info('%s building API docs from "%s"' % (__name__, src_dir))
+    with state['lock']:
+        if state['cancelled']:
+            return
+        state['process'] = subprocess.Popen(
+            ['make', '-C', src_dir], start_new_session=True,
+            stdout=(subprocess.DEVNULL
+                    if app.config.api_doc_doxygen_suppress_out else None))
+    state['returncode'] = state['process'].wait()
+
+
+def api_doc_start(app):
+    if not app.config.api_doc_doxygen_build:
+        return
+
+    state = {
+        'lock': threading.Lock(),
+        'cancelled': False,
+        'process': None,
+        'returncode': None,
+        'fingerprint': None,
+    }
+    state['thread'] = threading.Thread(target=api_doc_doxygen,
+                                       args=(app, state), daemon=True)
+    app.api_doc_state = state
+    state['thread'].start()
+
+
+# Replace the API docs in the build dir with the doxygen output. Each step is
+# a rename within the build dir, so the API docs are never half there.
+def api_doc_install(app, fingerprint):
+    api_doc_build_dir = os.path.join(
+        api_doc_path(app, app.config.api_doc_doxygen_src_dir),
+        app.config.api_doc_doxygen_out_dir)
+    static_api_dir = api_doc_static_api_dir(app)
+
+    logger.info('%s moving "%s" to "%s"'
+                % (__name__, api_doc_build_dir, static_api_dir))
+    staging_dir = tempfile.mkdtemp(prefix='_api.', dir=app.outdir)
+    new_dir = os.path.join(staging_dir, 'new')
+    old_dir = os.path.join(staging_dir, 'old')
+    try:
+        # a rename, unless the build dir is on another file system
+        shutil.move(api_doc_build_dir, new_dir)
 
-    if app.config.api_doc_doxygen_build:
-        make_invocation_suffix = ('> /dev/null'
-                                  if app.config.api_doc_doxygen_suppress_out
-                                  else '')
-        make_invocation = ' '.join(('make -C',
-                                    app.config.api_doc_doxygen_src_dir,
-                                    make_invocation_suffix))
+        # Fundamentally a workaround: Readthedocs doxygen build plain
+        # refulses to build the same html/*.js files as local builds do. So
+        # we ship them and we copy them over to the output dir by force,
+        # till readthedocs starts behaving, hopefully in the near future
+        shutil.copy(api_doc_path(app, api_doc_extra_js), new_dir)
 
-        logger.info('%s building API docs from "%s"'
-                     % (__name__, app.config.api_doc_doxygen_src_dir))
-        logger.info('%s executing "%s"'
-                     % (__name__, make_invocation))
+        with open(os.path.join(new_dir, api_doc_fingerprint_file), 'w') as f:
+            f.write(fingerprint + '\n')
 
-        subprocess.call(make_invocation, shell=True)
+        if os.path.exists(static_api_dir):
+            os.rename(static_api_dir, old_dir)
+        os.rename(new_dir, static_api_dir)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
 
-        api_doc_build_dir = "/".join((app.config.api_doc_doxygen_src_dir,
-                                      app.config.api_doc_doxygen_out_dir))
-        api_doc_static_api_dir = "/".join((app.outdir, '_api'))
 
-        logger.info('%s moving "%s" to "%s"'
-                     % (__name__, api_doc_build_dir, api_doc_static_api_dir))
-        subprocess.call(' '.join(('mv', api_doc_build_dir,
-                                  api_doc_static_api_dir)),
-                        shell=True)
+def api_doc_build(app, exception):
+    state = getattr(app, 'api_doc_state', None)
+    if state is None:
+        return
+
+    if exception is not None:
+        logger.warning('%s exiting without building' % (__name__,))
+        with state['lock']:
+            state['cancelled'] = True
+            if state['process'] is not None:
+                # make and the doxygen it runs
+                try:
+                    os.killpg(state['process'].pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+        state['thread'].join()
+        return
+
+    state['thread'].join()
+    if state['process'] is None:
+        # up to date, or the fingerprint failed
+        return
+    if state['returncode'] != 0:
+        logger.warning('%s doxygen failed with exit code %d'
+                       % (__name__, state['returncode']))
+        return
 
-        # Fundamentally a workaround: Readthedocs doxygen build plain refulses
-        # to build the same html/*.js files as local builds do. So we ship them
-        # and we copy them over to the output dir by force, till readthedocs
-        # starts behaving, hopefully in the near future
-        subprocess.call(' '.join(('cp js/dynsections.js',
-                                  api_doc_static_api_dir)),
-                        shell=True)
+    api_doc_install(app, state['fingerprint'])
 
 
 def setup(app):
@@ -58,8 +206,10 @@ def setup(app):
         logger.debug('Add config value %s: %s' %(config_val, v))
         app.add_config_value(config_val, v, '')
 
-    # We will build and copy the docs after the end of the sphinx build, and.
-    # only if it has been successful. Regsiter for the build-finished event.
+    # Doxygen runs in the background during the sphinx build. We copy its
+    # output after the end of the build, and only if the build has been
+    # successful.
+    app.connect('builder-inited', api_doc_start)
     app.connect('build-finished', api_doc_build)
 
     logger.info('%s initialised' % (__name__,))
@@ -12,7 +12,9 @@ This extension allows to import sources from directories out of the Sphinx
 source directory. They are copied to the source directory before starting the
 build. Note that the copy is *smart*, that is, only updated files are actually
 copied. Therefore, incremental builds detect changes correctly and behave as
-expected.
+expected. A manifest of the copied files, kept in the doctree directory,
+records the hashes of their sources and of their adjusted contents, so that
+unchanged sources are skipped without being read.
 
 Paths for external content included via e.g. figure, literalinclude, etc.
 are adjusted as needed.
@@ -30,23 +32,78 @@ Configuration options
   destination directory.
 """
 
-import filecmp
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import hashlib
+import json
 import os
 from pathlib import Path
 import re
 import shutil
 import tempfile
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Pattern, Tuple
 
 from sphinx.application import Sphinx
+from sphinx.util import logging
 
 
-__version__ = "0.1.0"
+__version__ = "0.2.0"
+
+logger = logging.getLogger(__name__)
 
 
 DEFAULT_DIRECTIVES = ("figure", "image", "include", "literalinclude")
 """Default directives for included content."""
 
+MANIFEST_NAME = "external_content.json"
+"""Name of the manifest file, stored in the doctree directory."""
+
+MANIFEST_VERSION = 1
+"""Version of the manifest format."""
+
+
+@functools.lru_cache()
+def _include_regex(directives: Tuple[str, ...]) -> Pattern:
+    """Compile the regular expression matching the given directives.
+
+    Args:
+        directives: Directives to be matched.
+
+    Returns:
+        Compiled regular expression, with the directive and path as groups.
+    """
+
+    return re.compile(r"\.\. (" + "|".join(directives) + r")::\s*([^`\n]+)")
+
+
+def _adjust_content(
+    content: str, basepath: Path, dstpath: Path, directives: List[str]
+) -> Tuple[str, int]:
+    """Adjust included content paths in a document.
+
+    Args:
+        content: Document contents.
+        basepath: Base path to be used to resolve content location.
+        dstpath: Destination path of the document.
+        directives: Directives to be parsed and adjusted.
+
+    Returns:
+        Adjusted contents and number of adjusted paths.
+    """
+
+    def _adjust(m):
+        directive, fpath = m.groups()
+
+        # ignore absolute paths
+        if fpath.startswith("/"):
+            fpath_adj = fpath
+        else:
+            fpath_adj = Path(os.path.relpath(basepath / fpath, dstpath)).as_posix()
+
+        return f".. {directive}:: {fpath_adj}"
+
+    return _include_regex(tuple(directives)).subn(_adjust, content)
+
 
 def adjust_includes(
     fname: Path,
@@ -70,37 +127,149 @@ def adjust_includes(
 
     dstpath = dstpath or fname.parent
 
-    def _adjust(m):
-        directive, fpath = m.groups()
-
-        # ignore absolute paths
-        if fpath.startswith("/"):
-            fpath_adj = fpath
-        else:
-            fpath_adj = Path(os.path.relpath(basepath / fpath, dstpath)).as_posix()
-
-        return f".. {directive}:: {fpath_adj}"
-
     with open(fname, "r+", encoding=encoding) as f:
         content = f.read()
-        content_adj, modified = re.subn(
-            r"\.\. (" + "|".join(directives) + r")::\s*([^`\n]+)", _adjust, content
-        )
+        content_adj, modified = _adjust_content(content, basepath, dstpath, directives)
         if modified:
             f.seek(0)
             f.write(content_adj)
             f.truncate()
 
 
+def _hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _load_manifest(path: Path, directives: List[str], encoding: str) -> Dict[str, Any]:
+    """Load the manifest of a previous synchronization.
+
+    Args:
+        path: Manifest file.
+        directives: Directives currently adjusted.
+        encoding: Current sources encoding.
+
+    Returns:
+        Manifest entries by destination path, empty if there is no usable
+        manifest.
+    """
+
+    try:
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    # adjusted outputs depend on the directives and encoding
+    if (
+        manifest.get("version") != MANIFEST_VERSION
+        or manifest.get("directives") != list(directives)
+        or manifest.get("encoding") != encoding
+    ):
+        return {}
+
+    return manifest.get("files", {})
+
+
+def _save_manifest(
+    path: Path, files: Dict[str, Any], directives: List[str], encoding: str
+) -> None:
+    """Save the manifest atomically.
+
+    Args:
+        path: Manifest file.
+        files: Manifest entries by destination path.
+        directives: Directives adjusted.
+        encoding: Sources encoding.
+    """
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        "w", encoding="utf-8", dir=path.parent, delete=False
+    ) as f:
+        json.dump(
+            {
+                "version": MANIFEST_VERSION,
+                "directives": list(directives),
+                "encoding": encoding,
+                "files": files,
+            },
+            f,
+        )
+    os.replace(f.name, path)
+
+
+def _sync_file(
+    src: Path,
+    dst: Path,
+    directives: List[str],
+    encoding: str,
+    dst_hash: Optional[str],
+) -> Tuple[bool, Dict[str, Any]]:
+    """Copy a source file to its destination, adjusting included content paths.
+
+    The destination is only written if its contents change.
+
+    Args:
+        src: Source file.
+        dst: Destination file.
+        directives: Directives to be parsed and adjusted.
+        encoding: Sources encoding.
+        dst_hash: Hash of the destination contents, as last written, if known.
+
+    Returns:
+        Whether the destination was written, and its manifest entry.
+    """
+
+    st = src.stat()
+    data = src.read_bytes()
+    entry = {
+        "src": os.fspath(src),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "src_hash": _hash(data),
+    }
+
+    adjusted = data
+    if dst.suffix == ".rst":
+        content_adj, modified = _adjust_content(
+            data.decode(encoding), src.parent, dst.parent, directives
+        )
+        if modified:
+            adjusted = content_adj.encode(encoding)
+    entry["dst_hash"] = _hash(adjusted)
+
+    if dst.exists() and (
+        entry["dst_hash"] == dst_hash or entry["dst_hash"] == _hash(dst.read_bytes())
+    ):
+        return False, entry
+
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=dst.parent, delete=False) as f:
+        f.write(adjusted)
+    shutil.copymode(src, f.name)
+    os.replace(f.name, dst)
+
+    return True, entry
+
+
 def sync_contents(app: Sphinx) -> None:
     """Synchronize external contents.
 
+    A manifest of the source and adjusted destination hashes is kept in the
+    doctree directory, so that unchanged sources are skipped without being
+    read. Changed sources are processed in a thread pool.
+
     Args:
         app: Sphinx application instance.
     """
 
     srcdir = Path(app.srcdir).resolve()
-    to_copy = []
+    directives = app.config.external_content_directives
+    encoding = app.config.source_encoding
+    manifest_path = Path(app.doctreedir) / MANIFEST_NAME
+    manifest = _load_manifest(manifest_path, directives, encoding)
+
+    to_copy = {}
     to_delete = set(f for f in srcdir.glob("**/*") if not f.is_dir())
     to_keep = set(
         f
@@ -113,53 +282,49 @@ def sync_contents(app: Sphinx) -> None:
         prefix_src, glob = content
         for src in prefix_src.glob(glob):
             if src.is_dir():
-                to_copy.extend(
-                    [(f, prefix_src) for f in src.glob("**/*") if not f.is_dir()]
-                )
+                files = [f for f in src.glob("**/*") if not f.is_dir()]
             else:
-                to_copy.append((src, prefix_src))
-
-    for entry in to_copy:
-        src, prefix_src = entry
-        dst = (srcdir / src.relative_to(prefix_src)).resolve()
-
-        if dst in to_delete:
-            to_delete.remove(dst)
-
-        if not dst.parent.exists():
-            dst.parent.mkdir(parents=True)
-
-        # just copy if it does not exist
-        if not dst.exists():
-            shutil.copy(src, dst)
-            adjust_includes(
-                dst,
-                src.parent,
-                app.config.external_content_directives,
-                app.config.source_encoding,
-            )
-        # if origin file is modified only copy if different
-        elif src.stat().st_mtime > dst.stat().st_mtime:
-            with tempfile.TemporaryDirectory() as td:
-                # adjust origin includes before comparing
-                src_adjusted = Path(td) / src.name
-                shutil.copy(src, src_adjusted)
-                adjust_includes(
-                    src_adjusted,
-                    src.parent,
-                    app.config.external_content_directives,
-                    app.config.source_encoding,
-                    dstpath=dst.parent,
-                )
-
-                if not filecmp.cmp(src_adjusted, dst):
-                    dst.unlink()
-                    shutil.move(os.fspath(src_adjusted), os.fspath(dst))
+                files = [src]
+            for f in files:
+                to_copy[(srcdir / f.relative_to(prefix_src)).resolve()] = f
+
+    files = {}
+    changed = []
+    for dst, src in to_copy.items():
+        to_delete.discard(dst)
+
+        key = os.fspath(dst.relative_to(srcdir))
+        entry = manifest.get(key)
+        if entry is not None and entry["src"] == os.fspath(src) and dst.exists():
+            st = src.stat()
+            if (entry["size"], entry["mtime_ns"]) == (st.st_size, st.st_mtime_ns):
+                files[key] = entry
+                continue
+
+        changed.append((key, src, dst, entry["dst_hash"] if entry else None))
+
+    copied = 0
+    with ThreadPoolExecutor() as executor:
+        results = executor.map(
+            lambda c: _sync_file(c[1], c[2], directives, encoding, c[3]), changed
+        )
+        for (key, _, _, _), (written, entry) in zip(changed, results):
+            files[key] = entry
+            copied += written
 
     # remove any previously copied file not present in the origin folder,
     # excepting those marked to be kept.
+    deleted = 0
     for file in to_delete - to_keep:
         file.unlink()
+        deleted += 1
+
+    _save_manifest(manifest_path, files, directives, encoding)
+
+    logger.info(
+        f"external content: {copied} copied, {len(to_copy) - copied} unchanged, "
+        f"{deleted} deleted"
+    )
 
 
 def setup(app: Sphinx) -> Dict[str, Any]: